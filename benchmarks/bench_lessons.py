@@ -0,0 +1,267 @@
+"""End-to-end benchmark of `medicode python` over every student lesson.
+
+Starts a local stand-in for the validate endpoint serving canned driver
+code, then runs the real CLI against each lesson under student/tut-* in
+fresh processes with ``--profile``. For every phase in the profile, and for
+each lesson as a whole, it records p50/p95 latency and peak memory, plus the
+number of processes each run starts. The results are compared with the
+recorded baseline and the benchmark fails on a regression.
+
+Processes are counted by an audit hook loaded into every interpreter the run
+starts, which logs each fork and subprocess.
+
+Usage:
+    python benchmarks/bench_lessons.py            # compare with the baseline
+    python benchmarks/bench_lessons.py --update   # record a new baseline
+    python benchmarks/bench_lessons.py --tutorial_id tut-3 --cold
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from medicode_cli.lessons import discover_lessons  # noqa: E402
+from medicode_cli.profiler import percentile  # noqa: E402
+from medicode_cli.stub_server import StubServer  # noqa: E402
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "lessons.json"
+
+# Allowed slowdown and memory growth over the baseline before the benchmark fails
+TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.10
+# Phases this short are mostly noise, so they get this much slack on top
+MIN_SLACK_MS = 5.0
+
+SPAWN_HOOK = '''\
+import os
+import sys
+
+_log = os.environ.get("MEDICODE_BENCH_SPAWN_LOG")
+if _log:
+    def _log_spawn(event, args):
+        if event in ("os.fork", "subprocess.Popen", "os.system"):
+            fd = os.open(_log, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+            os.write(fd, event.encode() + b"\\n")
+            os.close(fd)
+
+    sys.addaudithook(_log_spawn)
+'''
+
+
+def make_home(workdir: Path) -> Path:
+    """A home directory with a logged-in config, so the CLI doesn't prompt."""
+    home = workdir / "home"
+    (home / ".medicode").mkdir(parents=True)
+    config = {"access_token": "benchmark", "refresh_token": "benchmark", "expires_at": time.time() + 86400}
+    (home / ".medicode" / "config.json").write_text(json.dumps(config))
+    return home
+
+
+def run_once(lesson, env: dict, workdir: Path):
+    """Check one lesson in a fresh CLI process.
+
+    Returns:
+        dict: wall time, peak memory, processes started and the profiled phases
+    """
+    trace_path = workdir / "trace.json"
+    spawn_log = workdir / "spawns.log"
+    for path in (trace_path, spawn_log):
+        if path.exists():
+            path.unlink()
+
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "medicode_cli",
+            "--profile",
+            "--profile-output",
+            str(trace_path),
+            "python",
+            "--tutorial_id",
+            lesson.tutorial_id,
+            "--lesson_id",
+            lesson.lesson_id,
+            "--task_id",
+            "1",
+        ],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env={**env, "MEDICODE_BENCH_SPAWN_LOG": str(spawn_log)},
+    )
+    # wait4 reports the peak memory of the CLI and the processes it waited for
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    phases = defaultdict(lambda: {"duration": 0.0, "peak_rss_bytes": 0})
+    if trace_path.exists():
+        for event in json.loads(trace_path.read_text())["traceEvents"]:
+            phase = phases[event["name"]]
+            phase["duration"] += event["dur"] / 1e6
+            phase["peak_rss_bytes"] = max(
+                phase["peak_rss_bytes"], event["args"].get("peak_rss_bytes") or 0
+            )
+    spawns = spawn_log.read_text().splitlines() if spawn_log.exists() else []
+
+    return {
+        "returncode": process.returncode,
+        "wall": wall,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_bytes": max(
+            usage.ru_maxrss * 1024, *(phase["peak_rss_bytes"] for phase in phases.values()), 0
+        ),
+        "subprocesses": len(spawns),
+        "phases": dict(phases),
+    }
+
+
+def summarise(runs) -> dict:
+    walls = [run["wall"] * 1000 for run in runs]
+    return {
+        "p50_ms": round(percentile(walls, 50), 1),
+        "p95_ms": round(percentile(walls, 95), 1),
+        "peak_rss_mb": round(max(run["peak_rss_bytes"] for run in runs) / (1024 * 1024), 1),
+        "subprocesses": max(run["subprocesses"] for run in runs),
+    }
+
+
+def summarise_phases(runs) -> dict:
+    durations, peaks = defaultdict(list), defaultdict(int)
+    for run in runs:
+        for name, phase in run["phases"].items():
+            durations[name].append(phase["duration"] * 1000)
+            peaks[name] = max(peaks[name], phase["peak_rss_bytes"])
+    return {
+        name: {
+            "p50_ms": round(percentile(durations[name], 50), 1),
+            "p95_ms": round(percentile(durations[name], 95), 1),
+            "peak_rss_mb": round(peaks[name] / (1024 * 1024), 1),
+        }
+        for name in sorted(durations)
+    }
+
+
+def measure(lessons, repeat: int, cold: bool):
+    with tempfile.TemporaryDirectory(prefix="medicode-bench-") as tmp, StubServer() as server:
+        workdir = Path(tmp)
+        home = make_home(workdir)
+        env = os.environ.copy()
+        env.update(
+            {
+                "HOME": str(home),
+                "MEDICODE_BASE_URL": server.base_url,
+                # Loads the spawn-counting audit hook as sitecustomize
+                "PYTHONPATH": os.pathsep.join(
+                    filter(None, [str(workdir), str(ROOT), env.get("PYTHONPATH")])
+                ),
+            }
+        )
+        (workdir / "sitecustomize.py").write_text(SPAWN_HOOK)
+
+        runs_by_lesson = {}
+        for lesson in lessons:
+            runs = []
+            for _ in range(repeat):
+                if cold:
+                    shutil.rmtree(home / ".medicode" / "cache", ignore_errors=True)
+                runs.append(run_once(lesson, env, workdir))
+            runs_by_lesson[lesson.name] = runs
+            print(
+                f"{lesson.name:20} p50 {summarise(runs)['p50_ms']:8.1f} ms",
+                file=sys.stderr,
+            )
+        requests = dict(server.requests)
+
+    all_runs = [run for runs in runs_by_lesson.values() for run in runs]
+    return {
+        "total": summarise(all_runs),
+        "phases": summarise_phases(all_runs),
+        "lessons": {name: summarise(runs) for name, runs in runs_by_lesson.items()},
+        "requests": requests,
+        "failed_runs": sum(1 for run in all_runs if run["returncode"] != 0),
+    }
+
+
+def compare(name: str, result: dict, baseline: dict) -> list:
+    """Regressions of one result against its baseline entry."""
+    failures = []
+    for metric in ("p50_ms", "p95_ms"):
+        limit = baseline.get(metric)
+        if limit is not None and result[metric] > limit * (1 + TOLERANCE) + MIN_SLACK_MS:
+            failures.append(
+                f"{name}: {metric} {result[metric]} exceeds baseline {limit} by more than {TOLERANCE:.0%}"
+            )
+    limit = baseline.get("peak_rss_mb")
+    if limit and result["peak_rss_mb"] > limit * (1 + MEMORY_TOLERANCE):
+        failures.append(
+            f"{name}: peak_rss_mb {result['peak_rss_mb']} exceeds baseline {limit} by more than {MEMORY_TOLERANCE:.0%}"
+        )
+    limit = baseline.get("subprocesses")
+    if limit is not None and result.get("subprocesses", 0) > limit:
+        failures.append(f"{name}: starts {result['subprocesses']} processes, baseline {limit}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--update", action="store_true", help="Record a new baseline")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per lesson")
+    parser.add_argument("--tutorial_id", help="Only benchmark this tutorial's lessons")
+    parser.add_argument(
+        "--cold", action="store_true", help="Clear the driver cache before every run"
+    )
+    args = parser.parse_args()
+
+    lessons = discover_lessons(args.tutorial_id)
+    if not lessons:
+        print("No lessons found", file=sys.stderr)
+        return 1
+    results = measure(lessons, args.repeat, args.cold)
+
+    failures = []
+    if results["failed_runs"]:
+        failures.append(f"{results['failed_runs']} runs exited with an error")
+
+    if args.update:
+        baseline = {key: results[key] for key in ("total", "phases", "lessons")}
+        BASELINE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        BASELINE_PATH.write_text(json.dumps(baseline, indent=2) + "\n")
+        print(f"Baseline written to {BASELINE_PATH}")
+    else:
+        baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+        failures += compare("total", results["total"], baseline.get("total", {}))
+        for group in ("phases", "lessons"):
+            for name, result in results[group].items():
+                failures += compare(name, result, baseline.get(group, {}).get(name, {}))
+
+    total = results["total"]
+    print(
+        f"{len(lessons)} lessons x {args.repeat}: p50 {total['p50_ms']} ms, p95 {total['p95_ms']} ms, "
+        f"peak {total['peak_rss_mb']} MB, {total['subprocesses']} processes per run"
+    )
+    for name, phase in results["phases"].items():
+        print(
+            f"  {name:36} p50 {phase['p50_ms']:8.1f} ms   p95 {phase['p95_ms']:8.1f} ms"
+            f"   peak {phase['peak_rss_mb']:6.1f} MB"
+        )
+    print(f"Server requests: {results['requests']}")
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
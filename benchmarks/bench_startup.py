@@ -0,0 +1,157 @@
+"""Cold-start benchmark for the medicode CLI.
+
+Runs the CLI entry point in fresh interpreters under ``python -X importtime``
+and fails when startup regresses past the recorded baseline, or when a light
+command starts importing heavy modules again.
+
+Absolute times depend on the machine, so the baseline is relative: wall time
+as a multiple of a bare ``python -c pass`` timed in the same run, and the
+number of modules imported on top of the bare interpreter's.
+
+Usage:
+    python benchmarks/bench_startup.py            # compare with the baseline
+    python benchmarks/bench_startup.py --update   # record a new baseline
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "startup.json"
+
+# Command lines to time, relative to `medicode`
+SCENARIOS = {
+    "help": ["--help"],
+    "python_help": ["python", "--help"],
+    "logout_help": ["logout", "--help"],
+}
+
+# What every scenario is measured against
+REFERENCE = ["-c", "pass"]
+
+# Modules that must not be imported by these scenarios
+FORBIDDEN_MODULES = {
+    "help": ["requests", "rich", "urllib3"],
+    "python_help": ["requests", "rich", "urllib3"],
+    "logout_help": ["requests", "rich", "urllib3"],
+}
+
+# Allowed slowdown of the wall time ratio over the baseline before the benchmark fails
+TOLERANCE = 0.5
+# Allowed extra modules over the baseline before the benchmark fails
+MODULE_SLACK = 5
+
+
+def run_once(args):
+    """Run the interpreter once, returning wall time, import time and imported modules."""
+    env = os.environ.copy()
+    env["PYTHONPATH"] = f"{ROOT}{os.pathsep}{env['PYTHONPATH']}" if env.get("PYTHONPATH") else str(ROOT)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    wall = time.perf_counter() - start
+
+    import_us = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        modules.add(name.strip())
+        # Only top-level imports, nested ones are included in their parent
+        if not name.startswith("  "):
+            import_us += int(cumulative)
+    return wall, import_us, modules
+
+
+def measure_command(args, repeat: int):
+    run_once(args)  # Warm the filesystem cache and .pyc files
+    walls, imports, modules = [], [], set()
+    for _ in range(repeat):
+        wall, import_us, imported = run_once(args)
+        walls.append(wall)
+        imports.append(import_us)
+        modules |= imported
+    # The fastest run is the least disturbed by other load on the machine
+    return min(walls), statistics.median(imports), modules
+
+
+def measure(repeat: int):
+    reference_wall, _, reference_modules = measure_command(REFERENCE, repeat)
+    results = {}
+    for scenario, args in SCENARIOS.items():
+        wall, import_us, modules = measure_command(["-m", "medicode_cli", *args], repeat)
+        results[scenario] = {
+            "wall_ms": round(wall * 1000, 1),
+            "import_ms": round(import_us / 1000, 1),
+            "wall_ratio": round(wall / reference_wall, 2),
+            "module_count": len(modules - reference_modules),
+            "modules": modules,
+        }
+    return reference_wall, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--update", action="store_true", help="Record a new baseline")
+    parser.add_argument("--repeat", type=int, default=7, help="Runs per scenario")
+    args = parser.parse_args()
+
+    reference_wall, results = measure(args.repeat)
+    failures = []
+    for scenario, forbidden in FORBIDDEN_MODULES.items():
+        for module in forbidden:
+            if module in results[scenario]["modules"]:
+                failures.append(f"{scenario}: imports {module}")
+
+    if args.update:
+        baseline = {
+            scenario: {
+                "wall_ratio": result["wall_ratio"],
+                "module_count": result["module_count"],
+            }
+            for scenario, result in results.items()
+        }
+        BASELINE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        BASELINE_PATH.write_text(json.dumps(baseline, indent=2) + "\n")
+        print(f"Baseline written to {BASELINE_PATH}")
+    else:
+        baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+        for scenario, result in results.items():
+            expected = baseline.get(scenario, {})
+            ratio = expected.get("wall_ratio")
+            if ratio is not None and result["wall_ratio"] > ratio * (1 + TOLERANCE):
+                failures.append(
+                    f"{scenario}: {result['wall_ratio']}x bare python exceeds baseline "
+                    f"{ratio}x by more than {TOLERANCE:.0%}"
+                )
+            count = expected.get("module_count")
+            if count is not None and result["module_count"] > count + MODULE_SLACK:
+                failures.append(
+                    f"{scenario}: imports {result['module_count']} modules, baseline {count}"
+                )
+
+    print(f"{'bare python':12} wall {reference_wall * 1000:8.1f} ms")
+    for scenario, result in results.items():
+        print(
+            f"{scenario:12} wall {result['wall_ms']:8.1f} ms ({result['wall_ratio']:5.2f}x)   "
+            f"imports {result['import_ms']:8.1f} ms, {result['module_count']} modules"
+        )
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,118 @@
+import importlib
+
 import click
 
-from medicode_cli.commands import login, logout, ping, python
+from medicode_cli import profiler
+
+# Commands are imported only when they run, so `medicode --help` and light
+# commands like logout don't pay for requests, rich and the API client.
+# name: (module, attribute, short help)
+COMMANDS = {
+    "login": ("medicode_cli.commands.login", "login", "Login to MediCode."),
+    "logout": ("medicode_cli.commands.logout", "logout", "Logout from MediCode."),
+    "python": ("medicode_cli.commands.python", "python", "Run the code in {tutorial_id}-{lesson_id}.py"),
+    "ping": ("medicode_cli.commands.ping", "ping", "Health check ping"),
+    "sync": ("medicode_cli.commands.sync", "sync", "Send submissions queued while offline."),
+    "status": ("medicode_cli.commands.status", "status", "Show your progress through the tutorials."),
+    "loadtest": (
+        "medicode_cli.commands.loadtest",
+        "loadtest",
+        "Simulate a classroom against the validate endpoint.",
+    ),
+}
+
+
+class LazyGroup(click.Group):
+    """A click group that imports each command's module on first use."""
+
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_commands and cmd_name not in self.commands:
+            module_name, attribute, _ = self.lazy_commands[cmd_name]
+            with profiler.span(f"import {module_name}"):
+                command = getattr(importlib.import_module(module_name), attribute)
+            self.add_command(command, name=cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def invoke(self, ctx):
+        try:
+            return super().invoke(ctx)
+        except (click.exceptions.Exit, click.ClickException, click.Abort):
+            raise
+        except Exception:
+            from medicode_cli.log import dump_recent
+
+            dump_recent()
+            raise
+
+    def format_commands(self, ctx, formatter):
+        # Use the registered help so listing commands doesn't import them
+        rows = []
+        for name in self.list_commands(ctx):
+            if name in self.commands:
+                rows.append((name, self.commands[name].get_short_help_str()))
+            else:
+                rows.append((name, self.lazy_commands[name][2]))
+        if rows:
+            with formatter.section("Commands"):
+                formatter.write_dl(rows)
+
+
+def _start_profiling(ctx, param, enabled):
+    """Enable the profiler before the command is even imported, and report when it ends."""
+    if not enabled:
+        return
+
+    active = profiler.enable()
+    # Everything else nests under one span for the whole invocation
+    root = active.span("medicode")
+    root.__enter__()
+
+    def finish():
+        root.__exit__(None, None, None)
+        trace_path = ctx.meta.get("medicode.profile_output", "medicode-trace.json")
+        active.write_chrome_trace(trace_path)
+        click.echo(active.summary(), err=True)
+        click.echo(f"Trace written to {trace_path} (open it in https://ui.perfetto.dev)", err=True)
+        profiler.disable()
+
+    ctx.call_on_close(finish)
+
+
+def _set_profile_output(ctx, param, path):
+    if path is not None:
+        ctx.meta["medicode.profile_output"] = path
 
 
-@click.group()
+@click.group(cls=LazyGroup, lazy_commands=COMMANDS)
+@click.option(
+    "--profile",
+    is_flag=True,
+    is_eager=True,
+    expose_value=False,
+    callback=_start_profiling,
+    help="Time each phase of the command, print a summary and write a Chrome trace",
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False),
+    expose_value=False,
+    callback=_set_profile_output,
+    help="Where --profile writes the trace  [default: medicode-trace.json]",
+)
 def cli():
     """MediCode CLI - A command-line interface for MediCode."""
-    pass
+    # Imported here so --help doesn't pay for logging
+    from medicode_cli.log import setup_logging
 
+    setup_logging()
 
-# Register commands
-cli.add_command(login.login, name="login")
-cli.add_command(logout.logout, name="logout")
-cli.add_command(python.python, name="python")
-cli.add_command(ping.ping, name="ping")
 
 if __name__ == "__main__":
-    cli() 
\ No newline at end of file
+    cli()
@@ -0,0 +1,119 @@
+"""Asyncio front end to the MediCode API client.
+
+Commands that need several server calls can start them together and await
+them, so their network waits overlap instead of adding up. The calls run
+the synchronous ``MedicodeAPI`` on a bounded thread pool, so they share its
+pooled keep-alive connections, retries, caches and auth headers, and a
+semaphore caps how many are in flight at once.
+
+Example:
+    async with AsyncMedicodeAPI() as api:
+        healthy, response = await asyncio.gather(
+            api.health_check(), api.validate_code(code, "tut-4", "1")
+        )
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from .cache import DriverCache
+from .constants import ASYNC_MAX_CONCURRENCY
+from .medicode_api import MedicodeAPI
+
+
+class AsyncMedicodeAPI:
+    def __init__(
+        self, api: Optional[MedicodeAPI] = None, max_concurrency: int = ASYNC_MAX_CONCURRENCY
+    ):
+        """
+        Args:
+            api (MedicodeAPI, optional): The client to run the requests with
+            max_concurrency (int): Requests in flight at once
+        """
+        self.api = api or MedicodeAPI()
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="medicode-api"
+        )
+
+    async def _call(self, function, *args, **kwargs):
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(function, *args, **kwargs)
+            )
+
+    async def validate_code(
+        self,
+        code: str,
+        tutorial_id: str,
+        lesson_id: str,
+        task_id: Optional[str] = None,
+        etag: Optional[str] = None,
+    ) -> dict:
+        """See ``MedicodeAPI.validate_code``."""
+        return await self._call(
+            self.api.validate_code, code, tutorial_id, lesson_id, task_id, etag=etag
+        )
+
+    async def fetch_driver(
+        self,
+        code: str,
+        tutorial_id: str,
+        lesson_id: str,
+        task_id: Optional[str] = None,
+        cache: Optional[DriverCache] = None,
+        offline: bool = False,
+        submit: bool = True,
+    ) -> dict:
+        """See ``MedicodeAPI.fetch_driver``."""
+        return await self._call(
+            self.api.fetch_driver,
+            code,
+            tutorial_id,
+            lesson_id,
+            task_id,
+            cache=cache,
+            offline=offline,
+            submit=submit,
+        )
+
+    async def fetch_drivers(
+        self,
+        submissions: List[dict],
+        cache: Optional[DriverCache] = None,
+        offline: bool = False,
+        submit: bool = True,
+    ) -> List[dict]:
+        """See ``MedicodeAPI.fetch_drivers``.
+
+        The lessons go out in one batched request, or, if the server can't
+        batch, as at most ``max_concurrency`` requests at once.
+        """
+        return await self._call(
+            self.api.fetch_drivers,
+            submissions,
+            cache=cache,
+            offline=offline,
+            max_workers=self.max_concurrency,
+            submit=submit,
+        )
+
+    async def health_check(self) -> bool:
+        """See ``MedicodeAPI.health_check``."""
+        return await self._call(self.api.health_check)
+
+    async def aclose(self):
+        """Wait for the requests still in flight, then stop the thread pool."""
+        loop = asyncio.get_running_loop()
+        # Waiting on the loop's own thread would stall everything else on it
+        await loop.run_in_executor(None, functools.partial(self._executor.shutdown, wait=True))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
@@ -1,70 +1,34 @@
+import atexit
 import json
+import os
+import tempfile
 import time
 import random
 import string
-import webbrowser
 import threading
 from pathlib import Path
 from typing import Optional, Dict, Any
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import parse_qs, urlparse
-from rich.console import Console
-from . import constants
+from . import constants, profiler
+from .console import console
 
-console = Console()
 
+# Parsed config files by path, with the (mtime, size) they were read at.
+# Shared by every AuthManager, as a command may create several
+_config_memo: Dict[Path, tuple] = {}
+_config_lock = threading.Lock()
 
-class OAuthCallbackHandler(BaseHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        self.auth_manager = kwargs.pop("auth_manager")
-        super().__init__(*args, **kwargs)
+# The background token refresh, which is waited for before the CLI exits
+_refresh_thread: Optional[threading.Thread] = None
 
-    def do_GET(self):
-        if self.path.startswith("/callback"):
-            query = parse_qs(urlparse(self.path).query)
 
-            # Verify state
-            if query.get("state", [""])[0] != self.auth_manager.state:
-                self.send_response(400)
-                self.send_header("Content-type", "text/html")
-                self.end_headers()
-                self.wfile.write(b"Invalid state parameter")
-                return
-
-            # Get tokens from query parameters
-            access_token = query.get("access_token", [""])[0]
-            refresh_token = query.get("refresh_token", [""])[0]
-            expires_in = int(query.get("expires_in", ["3600"])[0])
-
-            if access_token:
-                # Store tokens
-                self.auth_manager._save_config(
-                    {
-                        "access_token": access_token,
-                        "refresh_token": refresh_token,
-                        "expires_at": time.time() + expires_in,
-                    }
-                )
+def _wait_for_refresh():
+    """Let a refresh in flight save the new tokens, as the old refresh token may be spent."""
+    thread = _refresh_thread
+    if thread is not None and thread.is_alive():
+        thread.join(constants.TOKEN_REFRESH_EXIT_WAIT)
 
-                # Send success response
-                self.send_response(200)
-                self.send_header("Content-type", "text/html")
-                self.end_headers()
-                self.wfile.write(
-                    b"Authentication successful! You can close this window."
-                )
 
-                # Stop the server
-                threading.Thread(target=self.server.shutdown).start()
-            else:
-                self.send_response(400)
-                self.send_header("Content-type", "text/html")
-                self.end_headers()
-                self.wfile.write(b"Authentication failed")
-
-    def log_message(self, format, *args):
-        # Suppress HTTP server logs
-        pass
+atexit.register(_wait_for_refresh)
 
 
 class AuthManager:
@@ -73,26 +37,49 @@ class AuthManager:
         self.config_file = self.config_dir / "config.json"
         self.state = None
         self._ensure_config_dir()
-        self._load_config()
 
     def _ensure_config_dir(self):
         """Ensure the config directory exists."""
         self.config_dir.mkdir(parents=True, exist_ok=True)
 
-    def _load_config(self) -> Dict[str, Any]:
-        """Load the configuration from the config file."""
-        if not self.config_file.exists():
-            return {}
+    def _config_file_stamp(self):
         try:
-            with open(self.config_file, "r") as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return {}
+            stat = self.config_file.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load_config(self) -> Dict[str, Any]:
+        """Load the configuration, re-reading the file only if it has changed."""
+        with profiler.span("load config"), _config_lock:
+            stamp = self._config_file_stamp()
+            memo = _config_memo.get(self.config_file)
+            if memo is not None and memo[0] == stamp:
+                return dict(memo[1])
+            config = {}
+            if stamp is not None:
+                try:
+                    with open(self.config_file, "r") as f:
+                        config = json.load(f)
+                except (OSError, json.JSONDecodeError):
+                    config = {}
+            _config_memo[self.config_file] = (stamp, config)
+            return dict(config)
 
     def _save_config(self, config: Dict[str, Any]):
-        """Save the configuration to the config file."""
-        with open(self.config_file, "w") as f:
-            json.dump(config, f)
+        """Atomically save the configuration to the config file."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.config_dir, prefix=".config-", suffix=".tmp")
+        try:
+            # The file holds tokens, so only the user may read it
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(config, f)
+            os.replace(tmp_path, self.config_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with _config_lock:
+            _config_memo[self.config_file] = (self._config_file_stamp(), dict(config))
 
     def _generate_state(self) -> str:
         """Generate a random state parameter for OAuth."""
@@ -100,6 +87,11 @@ class AuthManager:
 
     def login(self):
         """Handle the login process using OAuth."""
+        import webbrowser
+        from http.server import HTTPServer
+
+        from .oauth_callback import OAuthCallbackHandler
+
         # Generate state parameter
         self.state = self._generate_state()
 
@@ -128,6 +120,56 @@ class AuthManager:
         server_thread.join()
         console.print("[green]Successfully logged in![/green]")
 
+    def refresh(self) -> Optional[str]:
+        """Exchange the stored refresh token for a new access token.
+
+        Returns:
+            str: The new access token, or None if it could not be refreshed
+        """
+        config = self._load_config()
+        refresh_token = config.get("refresh_token")
+        if not refresh_token:
+            return None
+
+        from .transport import get_transport
+
+        try:
+            response = get_transport().post(
+                constants.OAUTH_REFRESH_URL,
+                json={"client_id": constants.OAUTH_CLIENT_ID, "refresh_token": refresh_token},
+            )
+            if not response.ok:
+                return None
+            tokens = response.json()
+        except Exception:  # noqa: BLE001
+            return None
+
+        access_token = tokens.get("access_token")
+        if not access_token:
+            return None
+        self._save_config(
+            {
+                **config,
+                "access_token": access_token,
+                "refresh_token": tokens.get("refresh_token", refresh_token),
+                "expires_at": time.time() + int(tokens.get("expires_in", 3600)),
+            }
+        )
+        return access_token
+
+    def _refresh_in_background(self):
+        """Refresh the token on a thread unless a refresh is already running.
+
+        The thread doesn't hold up the command, but the CLI waits up to
+        TOKEN_REFRESH_EXIT_WAIT for it on exit so the new tokens get saved.
+        """
+        global _refresh_thread
+        with _config_lock:
+            if _refresh_thread is not None and _refresh_thread.is_alive():
+                return
+            _refresh_thread = threading.Thread(target=self.refresh, daemon=True)
+            _refresh_thread.start()
+
     def get_token(self) -> Optional[str]:
         """Get the current access token, refreshing if necessary."""
         config = self._load_config()
@@ -135,12 +177,19 @@ class AuthManager:
             return None
 
         current_time = time.time()
-        if current_time >= config.get("expires_at", 0):
-            # Token expired, need to re-authenticate
-            console.print(
-                "[yellow]Session expired. Please run 'medicode login' again.[/yellow]"
-            )
-            return None
+        expires_at = config.get("expires_at", 0)
+        if current_time >= expires_at:
+            # Token expired, try the refresh token before asking for a login
+            access_token = self.refresh()
+            if access_token is None:
+                console.print(
+                    "[yellow]Session expired. Please run 'medicode login' again.[/yellow]"
+                )
+            return access_token
+
+        if current_time >= expires_at - constants.TOKEN_REFRESH_MARGIN:
+            # Still valid, so refresh ahead of time without making the caller wait
+            self._refresh_in_background()
 
         return config.get("access_token")
 
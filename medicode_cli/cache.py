@@ -0,0 +1,169 @@
+"""Persistent on-disk caches stored under ~/.medicode/cache."""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from . import constants
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    value: Dict[str, Any]
+    stored_at: float
+
+    def is_fresh(self, ttl: Optional[float]) -> bool:
+        """Whether the entry is younger than ``ttl`` seconds (None never expires)."""
+        return ttl is None or time.time() - self.stored_at < ttl
+
+
+class DiskCache:
+    """A size-bounded LRU cache of JSON documents, one file per entry.
+
+    Recency is tracked with the file mtime, which is bumped on every hit, so
+    eviction removes the least recently used files first until the cache is
+    back under ``max_bytes`` and ``max_entries``.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_bytes: int,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        root: Optional[Path] = None,
+    ):
+        self.directory = (root or constants.CACHE_DIR) / name
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.directory / f"{digest}.json"
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Return the entry for ``key``, fresh or not, marking it as recently used."""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                document = json.load(f)
+            os.utime(path)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if document.get("key") != key:
+            return None
+        return CacheEntry(key=key, value=document["value"], stored_at=document["stored_at"])
+
+    def get_fresh(self, key: str) -> Optional[CacheEntry]:
+        """Return the entry for ``key`` only if it is within the TTL."""
+        entry = self.get(key)
+        if entry is None or not entry.is_fresh(self.ttl):
+            return None
+        return entry
+
+    def put(self, key: str, value: Dict[str, Any], stored_at: Optional[float] = None):
+        """Atomically store ``value`` under ``key`` and evict if over budget."""
+        document = {
+            "key": key,
+            "stored_at": time.time() if stored_at is None else stored_at,
+            "value": value,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(document, f)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.evict()
+
+    def touch(self, key: str):
+        """Reset the age of an existing entry, e.g. after revalidating it."""
+        entry = self.get(key)
+        if entry is not None:
+            self.put(key, entry.value)
+
+    def delete(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+
+    def evict(self):
+        """Remove least recently used entries until the cache is within budget."""
+        entries = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        for _, size, path in entries:
+            over_entries = self.max_entries is not None and count > self.max_entries
+            if total <= self.max_bytes and not over_entries:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            count -= 1
+
+
+def driver_key(tutorial_id: str, lesson_id: str, task_id: Optional[str]) -> str:
+    return f"{tutorial_id}/lesson-{lesson_id}/task-{task_id}"
+
+
+class DriverCache(DiskCache):
+    """Validate responses (driver code and flags) keyed by tutorial, lesson and task."""
+
+    def __init__(self, root: Optional[Path] = None):
+        super().__init__(
+            "driver",
+            max_bytes=constants.DRIVER_CACHE_MAX_BYTES,
+            max_entries=constants.DRIVER_CACHE_MAX_ENTRIES,
+            ttl=constants.DRIVER_CACHE_TTL,
+            root=root,
+        )
+
+
+class ServerCache(DiskCache):
+    """What we have learnt about each server, such as whether it accepts gzip request bodies."""
+
+    def __init__(self, root: Optional[Path] = None):
+        super().__init__(
+            "server",
+            max_bytes=64 * 1024,
+            ttl=constants.SERVER_CACHE_TTL,
+            root=root,
+        )
+
+
+def verdict_key(lesson_path: str, student_code: str, driver_code: str, options: dict) -> str:
+    """The content address of a run: the code, the tests and what runs them.
+
+    ``options`` are the run's settings that can change its outcome, such as
+    its resource limits.
+    """
+    document = [lesson_path, student_code, driver_code, options, sys.version]
+    return hashlib.sha256(json.dumps(document, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class VerdictCache(DiskCache):
+    """The verdict and output of the last run of each student code and driver pair."""
+
+    def __init__(self, root: Optional[Path] = None):
+        super().__init__(
+            "verdict",
+            max_bytes=constants.VERDICT_CACHE_MAX_BYTES,
+            max_entries=constants.VERDICT_CACHE_MAX_ENTRIES,
+            root=root,
+        )
@@ -0,0 +1,265 @@
+"""Memory-bounded capture of program output.
+
+A lesson stuck in ``while True: print(...)`` can produce output much faster
+than anything reads it. Output is therefore streamed as it arrives and only
+the start and the end of it are kept, and a process that goes over the
+output limit is killed instead of being left to run until its timeout.
+"""
+
+import codecs
+import collections
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Dict, Optional
+
+from . import constants
+
+
+class BoundedBuffer:
+    """Keep the first ``head_size`` and last ``tail_size`` characters or bytes written."""
+
+    def __init__(
+        self,
+        head_size: int = constants.OUTPUT_HEAD_BYTES,
+        tail_size: int = constants.OUTPUT_TAIL_BYTES,
+        empty=b"",
+    ):
+        self.head_size = head_size
+        self.tail_size = tail_size
+        self.total = 0
+        self._empty = empty
+        self._head = empty
+        self._tail = collections.deque()
+        self._tail_length = 0
+
+    def write(self, data) -> int:
+        length = len(data)
+        self.total += length
+        room = self.head_size - len(self._head)
+        if room > 0:
+            self._head += data[:room]
+            data = data[room:]
+        if data and self.tail_size:
+            self._tail.append(data)
+            self._tail_length += len(data)
+            # Drop whole chunks that are no longer part of the tail
+            while self._tail_length - len(self._tail[0]) >= self.tail_size:
+                self._tail_length -= len(self._tail.popleft())
+        return length
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > len(self._head) + min(self._tail_length, self.tail_size)
+
+    def getvalue(self):
+        tail = self._empty.join(self._tail)
+        if self.tail_size:
+            tail = tail[-self.tail_size :]
+        if not self.truncated:
+            return self._head + tail
+        omitted = self.total - len(self._head) - len(tail)
+        marker = f"\n... [{omitted} characters of output omitted] ...\n"
+        if isinstance(self._empty, bytes):
+            marker = marker.replace("characters", "bytes").encode()
+        return self._head + marker + tail
+
+
+class _DecodingWriter(io.BufferedIOBase):
+    """The binary ``buffer`` of a BoundedTextIO, decoding what is written into it."""
+
+    def __init__(self, text: "BoundedTextIO"):
+        super().__init__()
+        self._text = text
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self._text.write(self._decoder.decode(data))
+        return len(data)
+
+    def flush(self):
+        self._text.flush()
+
+
+class BoundedTextIO(io.TextIOBase):
+    """A text stream for ``redirect_stdout`` that keeps a bounded copy of what is written.
+
+    Writes are passed on to ``tee`` as well, if given, which is flushed at
+    the end of every line so the output can be followed while it runs.
+    Bytes written to ``buffer``, as with ``sys.stdout.buffer.write``, are
+    decoded as UTF-8 and kept with the text.
+    """
+
+    def __init__(self, tee=None, **buffer_options):
+        super().__init__()
+        self.tee = tee
+        self._bounded = BoundedBuffer(empty="", **buffer_options)
+        self._binary = _DecodingWriter(self)
+
+    @property
+    def buffer(self) -> BinaryIO:
+        return self._binary
+
+    @property
+    def encoding(self) -> str:
+        return "utf-8"
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        self._bounded.write(s)
+        if self.tee is not None:
+            self.tee.write(s)
+            if "\n" in s:
+                self.tee.flush()
+        return len(s)
+
+    def flush(self):
+        if self.tee is not None:
+            self.tee.flush()
+
+    def getvalue(self) -> str:
+        return self._bounded.getvalue()
+
+
+class PipeCapture:
+    """Drain a process's output pipes on threads into bounded buffers.
+
+    Each pipe gets its own thread so a process filling one pipe can't block
+    while we wait on another. ``echo`` maps pipe names to binary streams the
+    output is copied to as it arrives. Once more than ``limit`` bytes have
+    arrived across all pipes, ``on_limit`` is called, normally to kill the
+    process, and the rest of the output is read and discarded.
+    """
+
+    def __init__(
+        self,
+        fds: Dict[str, int],
+        limit: Optional[int] = constants.OUTPUT_LIMIT_BYTES,
+        on_limit: Optional[Callable[[], None]] = None,
+        echo: Optional[Dict[str, BinaryIO]] = None,
+    ):
+        self.limit = limit
+        self.on_limit = on_limit
+        self.echo = echo or {}
+        self.buffers = {name: BoundedBuffer() for name in fds}
+        self.limit_exceeded = False
+        self._total = 0
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._drain, args=(fd, name), daemon=True)
+            for name, fd in fds.items()
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _drain(self, fd: int, name: str):
+        buffer = self.buffers[name]
+        echo = self.echo.get(name)
+        with os.fdopen(fd, "rb", buffering=0) as f:
+            while True:
+                chunk = f.read(constants.OUTPUT_READ_SIZE)
+                if not chunk:
+                    return
+                if self.limit_exceeded:
+                    continue
+                with self._lock:
+                    self._total += len(chunk)
+                    exceeded = self.limit is not None and self._total > self.limit
+                    if exceeded:
+                        self.limit_exceeded = True
+                if exceeded:
+                    if self.on_limit is not None:
+                        self.on_limit()
+                    continue
+                buffer.write(chunk)
+                if echo is not None:
+                    echo.write(chunk)
+                    echo.flush()
+
+    def wait(self, deadline: Optional[float] = None) -> bool:
+        """Wait until every pipe is closed or ``deadline`` (a ``time.perf_counter``) passes.
+
+        Returns:
+            bool: False if the deadline passed with a pipe still open
+        """
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.perf_counter()))
+            if thread.is_alive():
+                return False
+        return True
+
+    def text(self, name: str) -> str:
+        return self.buffers[name].getvalue().decode("utf-8", errors="replace")
+
+
+@dataclass
+class BoundedRun:
+    returncode: int
+    stdout: str
+    stderr: str
+    timed_out: bool = False
+    limit_exceeded: bool = False
+
+
+def run_bounded(
+    args,
+    timeout: Optional[float] = None,
+    limit: Optional[int] = constants.OUTPUT_LIMIT_BYTES,
+    echo: bool = False,
+    **popen_options,
+) -> BoundedRun:
+    """Like ``subprocess.run(args, capture_output=True, text=True)`` with bounded output.
+
+    Args:
+        args: The command to run
+        timeout (float, optional): Seconds before the process is killed
+        limit (int, optional): Bytes of output before the process is killed
+        echo (bool): Also stream the output to our stdout and stderr
+    """
+    process = subprocess.Popen(
+        args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **popen_options
+    )
+    capture = PipeCapture(
+        {"stdout": os.dup(process.stdout.fileno()), "stderr": os.dup(process.stderr.fileno())},
+        limit=limit,
+        on_limit=process.kill,
+        echo={"stdout": binary_stream(sys.stdout), "stderr": binary_stream(sys.stderr)}
+        if echo
+        else None,
+    )
+    process.stdout.close()
+    process.stderr.close()
+    capture.start()
+
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    timed_out = not capture.wait(deadline)
+    if timed_out:
+        process.kill()
+        capture.wait()
+    returncode = process.wait()
+    return BoundedRun(
+        returncode=returncode,
+        stdout=capture.text("stdout"),
+        stderr=capture.text("stderr"),
+        timed_out=timed_out,
+        limit_exceeded=capture.limit_exceeded,
+    )
+
+
+def binary_stream(stream) -> BinaryIO:
+    """The binary stream underneath a text stream such as sys.stdout, flushing it first."""
+    stream.flush()
+    return getattr(stream, "buffer", stream)
@@ -0,0 +1,284 @@
+"""Structural index of student code, built once per content hash.
+
+Driver checks used to re-parse the student code or scan it with regexes for
+every check. ``index_source`` parses it once, records the assignments,
+definitions, imports, loops, calls and attribute accesses in dictionaries
+keyed by name, and caches the result in memory and on disk under the hash
+of the source, so later lookups are dictionary hits.
+"""
+
+import ast
+import hashlib
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Set
+
+# Bump when the index layout changes so stale disk entries are ignored
+INDEX_VERSION = 3
+
+MODULE_SCOPE = "<module>"
+
+
+@dataclass
+class CodeIndex:
+    content_hash: str
+    # name -> [{"kind": "assign" | "annotated" | "augmented", "scope", "lineno"}]
+    assignments: Dict[str, List[dict]] = field(default_factory=dict)
+    # name -> [{"args", "signature", "scope", "lineno"}], a method and a
+    # module-level function may share a name
+    functions: Dict[str, List[dict]] = field(default_factory=dict)
+    # name -> {"bases", "methods", "scope", "lineno"}
+    classes: Dict[str, dict] = field(default_factory=dict)
+    # bound name -> {"module", "name", "lineno"}
+    imports: Dict[str, dict] = field(default_factory=dict)
+    # every imported module, for imports_module
+    modules: Set[str] = field(default_factory=set)
+    # [{"kind": "for" | "while", "scope", "lineno"}]
+    loops: List[dict] = field(default_factory=list)
+    # every kind in loops, for has_loop
+    loop_kinds: Set[str] = field(default_factory=set)
+    # dotted callee name, e.g. "print" or "math.sqrt" -> [lineno, ...]
+    calls: Dict[str, List[int]] = field(default_factory=dict)
+    # dotted attribute, e.g. "sys.stdin" or "np.random.rand" -> [lineno, ...]
+    attributes: Dict[str, List[int]] = field(default_factory=dict)
+    # [lineno, ...] of set displays and set comprehensions
+    sets: List[int] = field(default_factory=list)
+    syntax_error: Optional[str] = None
+
+    def assigns(self, name: str, scope: Optional[str] = MODULE_SCOPE) -> bool:
+        """Whether ``name`` is assigned, at module level by default or in any scope with None."""
+        return any(scope is None or a["scope"] == scope for a in self.assignments.get(name, ()))
+
+    def defines_function(
+        self, name: str, args: Optional[List[str]] = None, scope: Optional[str] = MODULE_SCOPE
+    ) -> bool:
+        """Whether function ``name`` is defined, optionally with exactly these arguments.
+
+        Looks at module level by default, or in any scope with None.
+        """
+        return any(
+            (scope is None or function["scope"] == scope)
+            and (args is None or function["args"] == list(args))
+            for function in self.functions.get(name, ())
+        )
+
+    def defines_class(self, name: str) -> bool:
+        return name in self.classes
+
+    def imports_module(self, module: str) -> bool:
+        return module in self.modules
+
+    def calls_function(self, name: str) -> bool:
+        return name in self.calls
+
+    def has_loop(self, kind: Optional[str] = None) -> bool:
+        return bool(self.loop_kinds) if kind is None else kind in self.loop_kinds
+
+    def top_level_variables(self) -> List[str]:
+        return [name for name in self.assignments if self.assigns(name)]
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        # Stored as JSON, which has no sets
+        data["modules"] = sorted(self.modules)
+        data["loop_kinds"] = sorted(self.loop_kinds)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CodeIndex":
+        index = cls(**data)
+        index.modules = set(index.modules)
+        index.loop_kinds = set(index.loop_kinds)
+        return index
+
+
+def _dotted_name(node: ast.AST) -> Optional[str]:
+    """The dotted name of a callee such as ``print`` or ``obj.method``."""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        parent = _dotted_name(node.value)
+        return f"{parent}.{node.attr}" if parent else node.attr
+    return None
+
+
+def _target_names(target: ast.AST) -> List[str]:
+    if isinstance(target, ast.Name):
+        return [target.id]
+    if isinstance(target, (ast.Tuple, ast.List)):
+        return [name for element in target.elts for name in _target_names(element)]
+    if isinstance(target, ast.Starred):
+        return _target_names(target.value)
+    return []
+
+
+class _Indexer(ast.NodeVisitor):
+    def __init__(self, index: CodeIndex):
+        self.index = index
+        self.scopes = [MODULE_SCOPE]
+
+    @property
+    def scope(self) -> str:
+        return self.scopes[-1]
+
+    def _assign(self, target: ast.AST, kind: str, lineno: int):
+        for name in _target_names(target):
+            self.index.assignments.setdefault(name, []).append(
+                {"kind": kind, "scope": self.scope, "lineno": lineno}
+            )
+
+    def visit_Assign(self, node: ast.Assign):
+        for target in node.targets:
+            self._assign(target, "assign", node.lineno)
+        self.generic_visit(node)
+
+    def visit_AnnAssign(self, node: ast.AnnAssign):
+        self._assign(node.target, "annotated", node.lineno)
+        self.generic_visit(node)
+
+    def visit_AugAssign(self, node: ast.AugAssign):
+        self._assign(node.target, "augmented", node.lineno)
+        self.generic_visit(node)
+
+    def _function(self, node):
+        arguments = node.args
+        args = [a.arg for a in arguments.posonlyargs + arguments.args]
+        if arguments.vararg:
+            args.append(f"*{arguments.vararg.arg}")
+        args += [a.arg for a in arguments.kwonlyargs]
+        if arguments.kwarg:
+            args.append(f"**{arguments.kwarg.arg}")
+        self.index.functions.setdefault(node.name, []).append(
+            {
+                "args": args,
+                "signature": f"{node.name}({ast.unparse(arguments)})",
+                "scope": self.scope,
+                "lineno": node.lineno,
+            }
+        )
+        self.scopes.append(node.name)
+        self.generic_visit(node)
+        self.scopes.pop()
+
+    visit_FunctionDef = _function
+    visit_AsyncFunctionDef = _function
+
+    def visit_ClassDef(self, node: ast.ClassDef):
+        self.index.classes[node.name] = {
+            "bases": [ast.unparse(base) for base in node.bases],
+            "methods": [
+                item.name
+                for item in node.body
+                if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef))
+            ],
+            "scope": self.scope,
+            "lineno": node.lineno,
+        }
+        self.scopes.append(node.name)
+        self.generic_visit(node)
+        self.scopes.pop()
+
+    def visit_Import(self, node: ast.Import):
+        for alias in node.names:
+            bound = alias.asname or alias.name.split(".")[0]
+            self.index.imports[bound] = {"module": alias.name, "name": None, "lineno": node.lineno}
+            self.index.modules.add(alias.name)
+
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        for alias in node.names:
+            self.index.imports[alias.asname or alias.name] = {
+                "module": node.module,
+                "name": alias.name,
+                "lineno": node.lineno,
+            }
+            self.index.modules.add(node.module)
+
+    def _loop(self, node, kind: str):
+        self.index.loops.append({"kind": kind, "scope": self.scope, "lineno": node.lineno})
+        self.index.loop_kinds.add(kind)
+        if kind == "for":
+            self._assign(node.target, "assign", node.lineno)
+        self.generic_visit(node)
+
+    def visit_For(self, node: ast.For):
+        self._loop(node, "for")
+
+    visit_AsyncFor = visit_For
+
+    def visit_While(self, node: ast.While):
+        self._loop(node, "while")
+
+    def visit_Call(self, node: ast.Call):
+        name = _dotted_name(node.func)
+        if name:
+            self.index.calls.setdefault(name, []).append(node.lineno)
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node: ast.Attribute):
+        name = _dotted_name(node)
+        if name:
+            self.index.attributes.setdefault(name, []).append(node.lineno)
+        self.generic_visit(node)
+
+    def _set(self, node):
+        self.index.sets.append(node.lineno)
+        self.generic_visit(node)
+
+    visit_Set = _set
+    visit_SetComp = _set
+
+
+def content_hash(source: str) -> str:
+    return hashlib.sha256(f"{INDEX_VERSION}\0{source}".encode("utf-8")).hexdigest()
+
+
+def build_index(source: str, tree: Optional[ast.Module] = None) -> CodeIndex:
+    """Parse ``source``, unless its ``tree`` is given, and index it, without any caching."""
+    index = CodeIndex(content_hash=content_hash(source))
+    if tree is None:
+        try:
+            tree = ast.parse(source)
+        except SyntaxError as e:
+            index.syntax_error = f"{e.msg} (line {e.lineno})"
+            return index
+    _Indexer(index).visit(tree)
+    return index
+
+
+_memory: Dict[str, CodeIndex] = {}
+_disk_cache = None
+
+
+def _get_disk_cache():
+    global _disk_cache
+    if _disk_cache is None:
+        from medicode_cli import constants
+        from medicode_cli.cache import DiskCache
+
+        _disk_cache = DiskCache("ast_index", max_bytes=constants.AST_INDEX_CACHE_MAX_BYTES)
+    return _disk_cache
+
+
+def index_source(source: str) -> CodeIndex:
+    """Return the index for ``source``, from memory, disk or by parsing it."""
+    key = content_hash(source)
+    index = _memory.get(key)
+    if index is not None:
+        return index
+
+    try:
+        disk_cache = _get_disk_cache()
+        entry = disk_cache.get(key)
+    except OSError:
+        disk_cache, entry = None, None
+
+    if entry is not None:
+        index = CodeIndex.from_dict(entry.value)
+    else:
+        index = build_index(source)
+        if disk_cache is not None:
+            try:
+                disk_cache.put(key, index.to_dict())
+            except OSError:
+                pass
+    _memory[key] = index
+    return index
@@ -0,0 +1,256 @@
+"""Simulate a classroom of students checking their code at the same time.
+
+E.g. medicode loadtest --students 200 --rate 20
+
+Every simulated student sends one of the lesson files under student/ to the
+validate endpoint with its own HTTP connection, exactly as `medicode python`
+does, except that failed requests aren't retried, so every error and timeout
+is counted. Students arrive at --rate per second, or all at once without it, and at
+most --concurrency requests are in flight together. Use --stub to run against
+a local stand-in server instead of the real one."""
+
+import contextlib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+import click
+
+import medicode_cli.dev_utils as du
+from medicode_cli import constants
+from medicode_cli.auth import AuthManager
+from medicode_cli.console import console
+from medicode_cli.lessons import Lesson, discover_lessons
+from medicode_cli.medicode_api import MedicodeAPI, ServerTimeout
+from medicode_cli.profiler import percentile
+
+OK = "ok"
+ERROR = "error"
+TIMEOUT = "timeout"
+
+# Upper bounds of the latency histogram's buckets, in milliseconds
+HISTOGRAM_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+HISTOGRAM_WIDTH = 40
+
+
+@dataclass
+class Outcome:
+    lesson: Lesson
+    status: str
+    latency: float
+    error: Optional[str] = None
+    # HTTP requests sent, more than one only if the body was resent in another form
+    attempts: int = 1
+
+
+@click.command()
+@click.option("--students", default=200, show_default=True, help="Students to simulate")
+@click.option(
+    "--concurrency",
+    type=int,
+    help="Requests in flight at once  [default: --students]",
+)
+@click.option(
+    "--rate",
+    type=float,
+    default=0.0,
+    help="Students arriving per second; all at once if not given",
+)
+@click.option("--tutorial_id", help="Only replay this tutorial's lessons")
+@click.option("--task_id", default="1", show_default=True, help="The task ID sent with each lesson")
+@click.option(
+    "--timeout",
+    default=float(constants.HTTP_READ_TIMEOUT),
+    show_default=True,
+    help="Seconds to wait for each response",
+)
+@click.option("--stub", is_flag=True, help="Run against a local stand-in server")
+@click.option(
+    "--stub-latency",
+    default=0.05,
+    show_default=True,
+    help="Seconds the stand-in server takes to answer",
+)
+def loadtest(
+    students: int,
+    concurrency: Optional[int],
+    rate: float,
+    tutorial_id: Optional[str],
+    task_id: str,
+    timeout: float,
+    stub: bool,
+    stub_latency: float,
+):
+    """Simulate a classroom against the validate endpoint."""
+    lessons = [lesson for lesson in discover_lessons(tutorial_id) if lesson.path.exists()]
+    if not lessons:
+        du.print_error("No lesson files found to replay")
+        return
+
+    with contextlib.ExitStack() as stack:
+        auth_manager = AuthManager()
+        base_url = None
+        if stub:
+            from medicode_cli.stub_server import StubServer
+
+            server = stack.enter_context(StubServer(latency=stub_latency))
+            base_url = server.base_url
+            # The stand-in accepts any token, so sign in with a throwaway one
+            auth_manager.config_dir = Path(
+                stack.enter_context(tempfile.TemporaryDirectory(prefix="medicode-"))
+            )
+            auth_manager.config_file = auth_manager.config_dir / "config.json"
+            auth_manager._save_config(
+                {"access_token": "loadtest", "refresh_token": "loadtest", "expires_at": time.time() + 86400}
+            )
+        elif not auth_manager.is_authenticated():
+            du.print_error("Not authenticated. Please run 'medicode login' first.")
+            return
+
+        target = base_url or constants.BASE_URL
+        du.print_info(
+            f"Simulating {students} students on {len(lessons)} lessons against {target}..."
+        )
+        outcomes, elapsed = run_load(
+            lessons,
+            students,
+            concurrency or students,
+            rate,
+            task_id,
+            timeout,
+            auth_manager,
+            base_url,
+        )
+
+    report(outcomes, elapsed)
+
+
+def make_client(auth_manager: AuthManager, timeout: float, base_url: Optional[str]) -> MedicodeAPI:
+    """A client with a connection of its own, like a student's CLI.
+
+    Its requests are never retried: a retry would hide the error or timeout
+    from the report, add its backoff to the latency and load the server
+    under test with requests no student sent.
+    """
+    from medicode_cli.transport import Transport
+
+    api = MedicodeAPI(
+        transport=Transport(pool_maxsize=1, read_timeout=timeout, max_retries=0)
+    )
+    api.auth_manager = auth_manager
+    if base_url:
+        api.base_url = base_url
+    return api
+
+
+def simulate_student(api: MedicodeAPI, lesson: Lesson, code: str, task_id: str) -> Outcome:
+    start = time.perf_counter()
+    try:
+        api.validate_code(code, lesson.tutorial_id, lesson.lesson_id, task_id)
+        outcome = Outcome(lesson, OK, time.perf_counter() - start)
+    except ServerTimeout as e:
+        outcome = Outcome(lesson, TIMEOUT, time.perf_counter() - start, str(e))
+    except Exception as e:  # noqa: BLE001
+        outcome = Outcome(lesson, ERROR, time.perf_counter() - start, str(e))
+    finally:
+        api.transport.close()
+    outcome.attempts = max(1, sum(timing.attempts for timing in api.transport.timings))
+    return outcome
+
+
+def run_load(
+    lessons: List[Lesson],
+    students: int,
+    concurrency: int,
+    rate: float,
+    task_id: str,
+    timeout: float,
+    auth_manager: AuthManager,
+    base_url: Optional[str] = None,
+):
+    """Send one validate request per student, returning the outcomes and the elapsed time."""
+    codes = {lesson: lesson.read_code() for lesson in lessons}
+    outcomes: List[Outcome] = []
+    outcomes_lock = threading.Lock()
+
+    def student(i: int):
+        lesson = lessons[i % len(lessons)]
+        outcome = simulate_student(
+            make_client(auth_manager, timeout, base_url), lesson, codes[lesson], task_id
+        )
+        with outcomes_lock:
+            outcomes.append(outcome)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="medicode-loadtest") as executor:
+        for i in range(students):
+            if rate:
+                # Students arrive at a steady rate
+                delay = start + i / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(student, i)
+    elapsed = time.perf_counter() - start
+    return outcomes, elapsed
+
+
+def histogram(latencies: List[float]) -> List[tuple]:
+    """Latencies counted into HISTOGRAM_BUCKETS_MS, as (label, count) pairs."""
+    counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+    for latency in latencies:
+        milliseconds = latency * 1000
+        bucket = next(
+            (i for i, bound in enumerate(HISTOGRAM_BUCKETS_MS) if milliseconds <= bound),
+            len(HISTOGRAM_BUCKETS_MS),
+        )
+        counts[bucket] += 1
+    labels = [f"≤ {bound} ms" for bound in HISTOGRAM_BUCKETS_MS]
+    labels.append(f"> {HISTOGRAM_BUCKETS_MS[-1]} ms")
+    return list(zip(labels, counts))
+
+
+def report(outcomes: List[Outcome], elapsed: float):
+    from rich.table import Table
+
+    total = len(outcomes)
+    if not total:
+        du.print_error("No requests were sent")
+        return
+    by_status = {status: [o for o in outcomes if o.status == status] for status in (OK, ERROR, TIMEOUT)}
+    latencies = [outcome.latency for outcome in outcomes]
+
+    summary = Table(title="Load test")
+    summary.add_column("Metric")
+    summary.add_column("Value", justify="right")
+    summary.add_row("Students", str(total))
+    summary.add_row("Requests sent", str(sum(outcome.attempts for outcome in outcomes)))
+    summary.add_row("Duration", f"{elapsed:.2f}s")
+    summary.add_row("Throughput", f"{len(by_status[OK]) / elapsed:.1f} req/s")
+    summary.add_row("Error rate", f"{len(by_status[ERROR]) / total:.1%}")
+    summary.add_row("Timeout rate", f"{len(by_status[TIMEOUT]) / total:.1%}")
+    for q in (50, 95, 99):
+        summary.add_row(f"p{q} latency", f"{percentile(latencies, q) * 1000:.1f} ms")
+    summary.add_row("Max latency", f"{max(latencies) * 1000:.1f} ms")
+    console.print(summary)
+
+    buckets = histogram(latencies)
+    peak = max(count for _, count in buckets)
+    table = Table(title="Latency")
+    table.add_column("Latency")
+    table.add_column("Requests", justify="right")
+    table.add_column("")
+    for label, count in buckets:
+        table.add_row(label, str(count), "█" * round(count / peak * HISTOGRAM_WIDTH))
+    console.print(table)
+
+    failures = by_status[ERROR] + by_status[TIMEOUT]
+    if failures:
+        messages = {}
+        for outcome in failures:
+            messages[outcome.error] = messages.get(outcome.error, 0) + 1
+        for message, count in sorted(messages.items(), key=lambda item: -item[1])[:5]:
+            du.print_error(f"{count} x {message}")
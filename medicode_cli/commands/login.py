@@ -1,8 +1,6 @@
 import click
-from rich.console import Console
 from ..auth import AuthManager
-
-console = Console()
+from ..console import console
 
 @click.command()
 def login():
@@ -1,139 +1,560 @@
 """This command checks the code in {tutorial_id}-{lesson_id}.py
 
 
-E.g. medicode python --tutorial_id tut-4 --lesson_id 1"""
+E.g. medicode python --tutorial_id tut-4 --lesson_id 1
 
-import os
-import re
-import subprocess
-import sys
+A notebook lesson, lesson-<n>.ipynb, runs in a kernel that stays up between
+runs, so the modules it imports stay loaded. Only the cells a change can
+affect run again, the others show their output from the last run.
+
+Use --all to check every lesson at once, or --all --tutorial_id tut-4 for one
+tutorial. Use --watch to re-run the lesson (or the whole tutorial when no
+--lesson_id is given) every time it is saved.
+
+The tests for the next few lessons are fetched along with the lesson's own,
+so running them doesn't wait for the server. A lesson whose result is shown
+from the cache fetches them in the background once it passes.
+
+Code with a syntax error, a missing function the lesson asks for or a
+`while True` loop that never ends is reported straight away, without
+running it or contacting the server.
+
+The result of each run is kept, keyed by the student code, the tests and
+the Python version. Re-running an unchanged lesson shows that result again
+without running anything, and says so; use --no-cache to run it anyway.
+Code that reads input or files, or uses random numbers or the time, is
+always run."""
+
+import logging
 import time
-from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional
 
 import click
 
 import medicode_cli.dev_utils as du
-from medicode_cli.medicode_api import MedicodeAPI
+from medicode_cli import constants
+from medicode_cli.console import console
+from medicode_cli.lessons import Lesson, discover_lessons, get_lesson
+
+# The rest is imported where it is used, so `medicode python --help` stays fast
+if TYPE_CHECKING:
+    from medicode_cli.cache import VerdictCache
+    from medicode_cli.executor import WorkerPool
+    from medicode_cli.medicode_api import MedicodeAPI
+    from medicode_cli.validation import LessonResult
+
+logger = logging.getLogger(__name__)
+
+STATUS_STYLES = {
+    "passed": "green",
+    "failed": "red",
+    "error": "red",
+    "timeout": "yellow",
+}
+
 
 @click.command()
-@click.option("--tutorial_id", required=True, help="The tutorial ID")
-@click.option("--lesson_id", required=True, help="The lesson ID")
-@click.option("--task_id", required=True, help="The task ID")
-def python(tutorial_id: str, lesson_id: str, task_id: str):
+@click.option("--tutorial_id", help="The tutorial ID")
+@click.option("--lesson_id", help="The lesson ID")
+@click.option("--task_id", help="The task ID")
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="Run the tests with cached driver code only, without contacting the server",
+)
+@click.option(
+    "--all",
+    "check_all",
+    is_flag=True,
+    help="Check every lesson, or every lesson in --tutorial_id, concurrently",
+)
+@click.option(
+    "--workers",
+    default=constants.BATCH_WORKERS,
+    show_default=True,
+    help="Lessons checked at once with --all",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    help="Re-run whenever the lesson changes; without --lesson_id, watch the whole tutorial",
+)
+@click.option(
+    "--delta",
+    is_flag=True,
+    help="Upload only the changes since the code the server last received",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Run the lesson even if the code and tests haven't changed since the last run",
+)
+@click.option(
+    "--fail-fast",
+    is_flag=True,
+    help="Stop at the first failing test case instead of running them all",
+)
+def python(
+    tutorial_id: Optional[str],
+    lesson_id: Optional[str],
+    task_id: Optional[str],
+    offline: bool,
+    check_all: bool,
+    workers: int,
+    watch: bool,
+    delta: bool,
+    no_cache: bool,
+    fail_fast: bool,
+):
     """Run the code in {tutorial_id}-{lesson_id}.py"""
+    from medicode_cli.cache import VerdictCache
+    from medicode_cli.executor import WorkerPool
 
-    # Initialize API client
+    verdicts = None if no_cache else VerdictCache()
+
+    if check_all:
+        run_all(tutorial_id, task_id, offline, workers, delta, verdicts, fail_fast)
+        return
+
+    if watch:
+        if not tutorial_id:
+            raise click.UsageError("--tutorial_id is required with --watch")
+        run_watch(tutorial_id, lesson_id, task_id, offline, delta, verdicts, fail_fast)
+        return
+
+    if not (tutorial_id and lesson_id and task_id):
+        raise click.UsageError("--tutorial_id, --lesson_id and --task_id are required without --all")
+
+    lesson = get_lesson(tutorial_id, lesson_id)
+    if reject_lesson(lesson):
+        return
+    if (
+        verdicts is not None
+        and not offline
+        and replay_lesson(lesson, task_id, verdicts, fail_fast)
+    ):
+        return
+
+    # Start the worker first so it warms up while we authenticate and
+    # fetch the driver code
+    with WorkerPool(size=1, recycle=False) as pool:
+        run_lesson(pool, lesson, task_id, offline, delta, verdicts, fail_fast)
+
+
+def reject_lesson(lesson: Lesson) -> bool:
+    """Report the problems the pre-flight checks find in the lesson, if there are any.
+
+    Returns:
+        bool: Whether the lesson has problems and shouldn't be run
+    """
+    from medicode_cli.manifest import record_results
+    from medicode_cli.validation import preflight_result
+
+    if not lesson.path.exists():
+        return False
+    student_code = lesson.read_code()
+    result = preflight_result(lesson, student_code)
+    if result is None:
+        return False
+    record_results([(result, student_code)])
+    du.print_error(f"{lesson.name} was not run or sent:")
+    for line in result.message.splitlines():
+        console.print(f"  {line}")
+    return True
+
+
+def replay_lesson(
+    lesson: Lesson, task_id: Optional[str], verdicts: "VerdictCache", fail_fast: bool = False
+) -> bool:
+    """Show the cached result of an unchanged lesson, without the worker or waiting on the server.
+
+    The submission is still sent, in the background. Only possible while the cached driver code is fresh, otherwise the
+    server has to be asked whether the tests changed.
+
+    Returns:
+        bool: Whether there was a result to show
+    """
+    from medicode_cli.cache import DriverCache, driver_key
+    from medicode_cli.manifest import record_results
+    from medicode_cli.medicode_api import MedicodeAPI
+    from medicode_cli.prefetch import prefetch_in_background
+    from medicode_cli.validation import cached_result
+
+    entry = DriverCache().get_fresh(driver_key(lesson.tutorial_id, lesson.lesson_id, task_id))
+    if entry is None or not lesson.path.exists():
+        return False
     api = MedicodeAPI()
+    if not api.auth_manager.is_authenticated():
+        return False
+    student_code = lesson.read_code()
+    result = cached_result(verdicts, lesson, student_code, entry.value, fail_fast=fail_fast)
+    if result is None:
+        return False
+    # The server still gets the submission, just not on the way to the result
+    api.queue_submission(student_code, lesson.tutorial_id, lesson.lesson_id, task_id, quiet=True)
+    api.flush_outbox_in_background()
+    show_result(result, entry.value)
+    record_results([(result, student_code)])
+    if result.passed:
+        prefetch_in_background(lesson, task_id)
+    return True
+
+
+def run_lesson(
+    pool: "WorkerPool",
+    lesson: Lesson,
+    task_id: Optional[str],
+    offline: bool,
+    delta: bool = False,
+    verdicts: Optional["VerdictCache"] = None,
+    fail_fast: bool = False,
+):
+    """Run the student's lesson file once and the server's tests against that run."""
+    from medicode_cli.cache import DriverCache
+    from medicode_cli.log import dump_recent
+    from medicode_cli.manifest import record_results
+    from medicode_cli.medicode_api import MedicodeAPI
+    from medicode_cli.validation import check_lesson
+
+    # Initialize API client
+    api = MedicodeAPI(delta=delta)
     # Validate authentication before doing anything else
-    api.check_authenticated()
+    if not offline:
+        api.check_authenticated()
 
     du.debug_print("Debug mode enabled")
 
-    # Get the absolute path to the student directory
-    script_dir = Path(__file__).resolve().parent.parent.parent
-    student_dir = script_dir / "student"
-    file_path = student_dir / tutorial_id / f"lesson-{lesson_id}.py"
+    file_path = lesson.path
 
     # Check if the file exists
     if not file_path.exists():
         du.print_error(f"Error: File not found at {file_path}")
         return
 
-    du.debug_print(f"Found student file at: {file_path}")
+    du.debug_print("Found student file at: %s", file_path)
+
+    # Read the code file, or a notebook's code cells
+    student_code = lesson.read_code()
 
-    # Execute the code in the student file first
+    # Fetch the driver code first so the student code only has to run once
+    response = {}
+    try:
+        # Make API request with loading message
+        du.print_info("Validating your code...")
+
+        du.debug_print("Student code length: %d characters", len(student_code))
+        du.debug_print("Making API request to validate code...")
+
+        # Get the driver code from the cache, or from the server if it is stale
+        if offline:
+            response = api.fetch_driver(
+                student_code,
+                lesson.tutorial_id,
+                lesson.lesson_id,
+                task_id,
+                cache=DriverCache(),
+                offline=True,
+            )
+        else:
+            response = fetch_tests(api, lesson, student_code, task_id)
+
+        du.debug_print("API response received: %s", response.keys())
+    except Exception as e:  # noqa: BLE001
+        du.print_error("Something went wrong")
+        logger.warning("Error during validation: %s", e, exc_info=True)
+        dump_recent()
+
+    # Run the student code once, followed by the tests against that same run
     try:
         du.debug_print("Executing student code...")
+        result = check_lesson(
+            pool,
+            lesson,
+            student_code,
+            response,
+            stream=True,
+            verdicts=verdicts,
+            fail_fast=fail_fast,
+        )
+    except Exception as e:  # noqa: BLE001
+        du.print_error(f"Error: {str(e)}")
+        logger.error("Error running the lesson", exc_info=True)
+        dump_recent()
+        return
+
+    show_result(result, response)
+    record_results([(result, student_code)])
+
+
+def fetch_tests(
+    api: "MedicodeAPI", lesson: Lesson, student_code: str, task_id: Optional[str]
+) -> dict:
+    """Fetch the lesson's tests, and the next few lessons' tests alongside them.
+
+    Both requests go out together on the async client, so fetching ahead
+    doesn't add to the wait for this lesson's tests.
+
+    Returns:
+        dict: The lesson's validate response
+    """
+    import asyncio
+
+    from medicode_cli.async_api import AsyncMedicodeAPI
+    from medicode_cli.cache import DriverCache
+    from medicode_cli.prefetch import stale_lessons, submissions_for, upcoming_lessons
 
-        result = subprocess.run(
-            ["python", str(file_path)],
-            capture_output=True,
-            text=True,
-            check=True,
+    cache = DriverCache()
+    upcoming = submissions_for(stale_lessons(upcoming_lessons(lesson), task_id, cache), task_id)
+
+    async def fetch() -> dict:
+        async with AsyncMedicodeAPI(api) as client:
+
+            async def prefetch():
+                try:
+                    await client.fetch_drivers(upcoming, cache=cache, submit=False)
+                except Exception:  # noqa: BLE001
+                    # Those lessons fetch their own tests when they run
+                    logger.info("Prefetching failed", exc_info=True)
+
+            response, _ = await asyncio.gather(
+                client.fetch_driver(
+                    student_code, lesson.tutorial_id, lesson.lesson_id, task_id, cache=cache
+                ),
+                prefetch() if upcoming else asyncio.sleep(0),
+            )
+            return response
+
+    return asyncio.run(fetch())
+
+
+def show_result(result: "LessonResult", response: dict):
+    """Report a single lesson checked with streamed output, or replayed from the cache."""
+    from medicode_cli.sandbox import format_usage
+
+    if result.cached:
+        du.print_info(
+            "Your code and the tests haven't changed since the last run, so this is "
+            "its result. Use --no-cache to run it again."
         )
-        print(result.stdout)
+    report_lesson(result, response, streamed=not result.cached)
+    if not result.cached and result.execution.usage:
+        console.print(f"[dim]Used {format_usage(result.execution.usage)}[/dim]")
 
+
+def report_lesson(result: "LessonResult", response: dict, streamed: bool = False):
+    """Print the student's output and the test results for a single lesson.
+
+    With ``streamed``, the student's output has already been shown as it ran.
+    """
+    execution = result.execution
+    student_run = execution.student
+    if student_run is None:
+        # The worker died before the student code finished
+        du.print_error(result.message)
+        return
+
+    if not streamed:
+        print(student_run["stdout"])
+    if student_run["success"]:
         # Show success message
         du.print_success("Code executed successfully!")
-    except subprocess.CalledProcessError as e:
-        du.print_error(f"Error executing code: {e.stderr}")
-        print(e.stdout)  # Print any stdout even if there was an error
-    except Exception as e:
-        du.print_error(f"Error: {str(e)}")
+    elif streamed:
+        # The traceback was streamed with the rest of the output
+        du.print_error("Error executing code, see the traceback above")
+    else:
+        du.print_error(f"Error executing code: {student_run['stderr']}")
 
-    # Continue with validation regardless of execution success
-    try:
-        # Make API request with loading message
-        du.print_info("Validating your code...")
-
-        # Read the code file
-        with open(file_path) as f:
-            student_code = f.read()
+    if execution.limit_exceeded:
+        # Stopped for going over its CPU or memory budget, so the tests didn't run
+        du.print_error(result.message)
+        return
 
-        du.debug_print(f"Student code length: {len(student_code)} characters")
-        du.debug_print("Making API request to validate code...")
+    # If the server indicates allow_error is true, we should just pass the student
+    if response.get("allow_error"):
+        du.print_success(result.message)
+        return
 
-        # Make API request to get the formatted code from the server
-        response = api.validate_code(student_code, tutorial_id, lesson_id, task_id)
-    
-        du.debug_print(f"API response received: {response.keys()}")
-
-        # If the server indicates allow_error is true, we should just pass the student
-        if response.get("allow_error"):
-            du.print_success("Code validated successfully!")
-            return
-
-        # Check if we got code components back (driver code)
-        if response.get("success") and response.get("code_components"):
-            driver_code = response["code_components"]["driver_code"]
-            student_code = response["code_components"]["student_code"]
-            
-            # Create a combined code string that uses the StudentCodeAnalyzer
-            combined_code = du.combine_code(driver_code, student_code)
-            du.debug_print(f"Creating combined code with driver code:\n{combined_code}")
-
-            # Run the combined code directly
-            try:
-                du.print_info("Running tests...")
-                
-                # Get the path to the medicode_cli directory to make it available in PYTHONPATH
-                medicode_cli_dir = Path(__file__).resolve().parent.parent
-                
-                # Set up environment to make dev_utils available to the subprocess
-                env = os.environ.copy()
-                # Add the parent directory of medicode_cli to PYTHONPATH so dev_utils can be imported
-                if "PYTHONPATH" in env:
-                    env["PYTHONPATH"] = f"{medicode_cli_dir.parent}:{env['PYTHONPATH']}"
-                else:
-                    env["PYTHONPATH"] = str(medicode_cli_dir.parent)
-                
-                du.debug_print(f"Setting PYTHONPATH: {env.get('PYTHONPATH')}")
-                
-                # Execute the combined code with the updated environment
-                result = subprocess.run(
-                    [sys.executable, "-c", combined_code],
-                    capture_output=True,
-                    text=True,
-                    timeout=5,
-                    env=env
-                )
-
-                if result.returncode == 0:
-                    print(result.stdout)
-                    du.print_success("✓ Tests passed!")
-                else:
-                    print(result.stdout)
-                    du.debug_print("code has an error")
-
-            except subprocess.TimeoutExpired:
-                du.print_error("Test execution timed out. Your code might contain an infinite loop.")
-            except Exception as e:  # noqa: BLE001
-                du.print_error("Something went wrong")
-                du.debug_print(f"Unexpected error running tests: {str(e)}")
-        else:
+    if not response.get("success") or not response.get("code_components"):
+        if response:
             # If we didn't get required code, display the error message
-            du.print_error(f"Error: {response.get('message', 'Unknown error')}")
+            du.print_error(f"Error: {result.message}")
+        return
 
-    except Exception as e:  # noqa: BLE001
-        du.print_error("Something went wrong")
-        du.debug_print(f"Error during validation: {str(e)}")
+    du.print_info("Running tests...")
+    if result.status == "timeout":
+        du.print_error("Test execution timed out. Your code might contain an infinite loop.")
+    elif execution.output_limit_exceeded:
+        du.print_error(result.message)
+    elif result.passed:
+        print(execution.stdout)
+        du.print_success("✓ Tests passed!")
+    else:
+        print(execution.stdout)
+        du.debug_print("code has an error")
+
+
+def run_watch(
+    tutorial_id: str,
+    lesson_id: Optional[str],
+    task_id: Optional[str],
+    offline: bool,
+    delta: bool = False,
+    verdicts: Optional["VerdictCache"] = None,
+    fail_fast: bool = False,
+):
+    """Validate the lesson, or every lesson in the tutorial, each time it changes."""
+    from medicode_cli.executor import WorkerPool
+    from medicode_cli.watch import watch as watch_files
+
+    if lesson_id:
+        lessons = [get_lesson(tutorial_id, lesson_id)]
+    else:
+        lessons = discover_lessons(tutorial_id)
+    lessons = [lesson for lesson in lessons if lesson.path.exists()]
+    if not lessons:
+        du.print_error(f"No lessons found for {tutorial_id}")
+        return
+    by_path = {lesson.path.resolve(): lesson for lesson in lessons}
+
+    # The pool, the HTTP connection and the driver cache stay warm between runs
+    with WorkerPool(size=1) as pool:
+        if len(lessons) == 1 and not reject_lesson(lessons[0]):
+            run_lesson(pool, lessons[0], task_id, offline, delta, verdicts, fail_fast)
+
+        def on_change(path):
+            lesson = by_path[path]
+            console.rule(f"{lesson.name} changed")
+            if not reject_lesson(lesson):
+                run_lesson(pool, lesson, task_id, offline, delta, verdicts, fail_fast)
+
+        du.print_info(f"Watching {len(lessons)} lesson(s) for changes. Press Ctrl+C to stop.")
+        try:
+            watch_files(by_path, on_change)
+        except KeyboardInterrupt:
+            pass
+
+
+def run_all(
+    tutorial_id: Optional[str],
+    task_id: Optional[str],
+    offline: bool,
+    workers: int,
+    delta: bool = False,
+    verdicts: Optional["VerdictCache"] = None,
+    fail_fast: bool = False,
+):
+    """Check every lesson concurrently and print a summary table."""
+    from medicode_cli.manifest import record_results
+    from medicode_cli.medicode_api import MedicodeAPI
+    from medicode_cli.validation import preflight_result
+
+    start = time.perf_counter()
+    lessons = discover_lessons(tutorial_id)
+    if not lessons:
+        du.print_error(f"No lessons found in {tutorial_id or 'student/'}")
+        return
+
+    api = MedicodeAPI(delta=delta)
+    # One auth check for the whole batch
+    if not offline:
+        api.check_authenticated()
+
+    codes = [lesson.read_code() for lesson in lessons]
+    # Lessons the pre-flight checks reject already have their result
+    results = [preflight_result(lesson, code) for lesson, code in zip(lessons, codes)]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        check_pending(
+            api, lessons, codes, results, pending, task_id, offline, workers, verdicts, fail_fast
+        )
+
+    print_summary(results, time.perf_counter() - start)
+    record_results(zip(results, codes))
+
+
+def check_pending(
+    api: "MedicodeAPI",
+    lessons: List[Lesson],
+    codes: List[str],
+    results: List[Optional["LessonResult"]],
+    pending: List[int],
+    task_id: Optional[str],
+    offline: bool,
+    workers: int,
+    verdicts: Optional["VerdictCache"],
+    fail_fast: bool,
+):
+    """Fetch the tests for the lessons at the ``pending`` indexes and fill in their results."""
+    import subprocess
+    from concurrent.futures import ThreadPoolExecutor
+
+    from medicode_cli.cache import DriverCache
+    from medicode_cli.executor import WorkerPool
+    from medicode_cli.validation import check_lesson
+
+    workers = max(1, min(workers, len(pending)))
+    # Unattended runs must not wait for input() on the terminal
+    with WorkerPool(size=workers, stdin=subprocess.DEVNULL) as pool:
+        du.print_info(f"Fetching tests for {len(pending)} lessons...")
+        responses = api.fetch_drivers(
+            [
+                {
+                    "code": codes[i],
+                    "tutorial_id": lessons[i].tutorial_id,
+                    "lesson_id": lessons[i].lesson_id,
+                    "task_id": task_id,
+                }
+                for i in pending
+            ],
+            cache=DriverCache(),
+            offline=offline,
+            max_workers=workers,
+        )
+
+        def check(i: int, response: dict) -> "LessonResult":
+            return check_lesson(
+                pool, lessons[i], codes[i], response, verdicts=verdicts, fail_fast=fail_fast
+            )
+
+        du.print_info(f"Running {len(pending)} lessons with {workers} workers...")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for i, result in zip(pending, executor.map(check, pending, responses)):
+                results[i] = result
+
+
+def print_summary(results: List["LessonResult"], elapsed: float):
+    from rich.table import Table
+
+    from medicode_cli.validation import PASSED
+
+    table = Table(title="MediCode progress")
+    table.add_column("Lesson")
+    table.add_column("Result")
+    table.add_column("Time", justify="right")
+    table.add_column("CPU", justify="right")
+    table.add_column("Memory", justify="right")
+    table.add_column("Details", overflow="fold")
+
+    for result in results:
+        style = STATUS_STYLES.get(result.status, "white")
+        details = "" if result.passed else result.message
+        if result.cached:
+            details = " ".join(filter(None, ["(cached)", details]))
+        usage = result.execution.usage if result.execution else None
+        table.add_row(
+            result.lesson.name,
+            f"[{style}]{result.status}[/{style}]",
+            f"{result.duration:.2f}s",
+            f"{usage['cpu_seconds']:.2f}s" if usage else "-",
+            f"{usage['peak_rss_bytes'] / (1024 * 1024):.0f} MB" if usage else "-",
+            details,
+        )
+
+    console.print(table)
+    passed = sum(1 for result in results if result.status == PASSED)
+    console.print(f"{passed}/{len(results)} lessons passed in {elapsed:.2f}s")
+    if any(result.cached for result in results):
+        console.print(
+            "[dim](cached) lessons haven't changed since their last run, so they "
+            "weren't run again. Use --no-cache to run them.[/dim]"
+        )
@@ -0,0 +1,123 @@
+"""Show progress through the tutorials from the lesson manifest.
+
+E.g. medicode status, or medicode status --tutorial_id tut-3 for each lesson
+
+Nothing is run or sent: the verdicts are the ones `medicode python` recorded.
+A lesson edited since its last check is shown as changed."""
+
+import time
+from typing import List, Optional
+
+import click
+
+import medicode_cli.dev_utils as du
+from medicode_cli.console import console
+from medicode_cli.manifest import CHANGED, NOT_RUN, LessonEntry, Manifest
+
+STATE_STYLES = {
+    "passed": "green",
+    "failed": "red",
+    "error": "red",
+    "timeout": "yellow",
+    CHANGED: "cyan",
+    NOT_RUN: "dim",
+}
+PROGRESS_WIDTH = 12
+
+
+@click.command()
+@click.option("--tutorial_id", help="Show each lesson in this tutorial")
+def status(tutorial_id: Optional[str]):
+    """Show your progress through the tutorials."""
+    try:
+        with Manifest.update() as manifest:
+            entries = manifest.refresh(tutorial_id)
+    except OSError:
+        # Read-only home directory, show the lessons without saving the hashes
+        manifest = Manifest.load()
+        entries = manifest.refresh(tutorial_id)
+
+    if not entries:
+        du.print_error(f"No lessons found in {tutorial_id or 'student/'}")
+        return
+    if tutorial_id:
+        print_lessons(tutorial_id, entries)
+    else:
+        print_tutorials(entries)
+
+
+def _ago(timestamp: Optional[float]) -> str:
+    if timestamp is None:
+        return "-"
+    seconds = max(0, time.time() - timestamp)
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size:
+            return f"{int(seconds // size)}{unit} ago"
+    return "just now"
+
+
+def _styled(state: str) -> str:
+    style = STATE_STYLES.get(state, "white")
+    return f"[{style}]{state}[/{style}]"
+
+
+def print_tutorials(entries: List[LessonEntry]):
+    from rich.table import Table
+
+    tutorials = {}
+    for entry in entries:
+        tutorials.setdefault(entry.tutorial_id, []).append(entry)
+
+    table = Table(title="MediCode progress")
+    table.add_column("Tutorial")
+    table.add_column("Passed", justify="right")
+    table.add_column("Failed", justify="right")
+    table.add_column("Changed", justify="right")
+    table.add_column("Not run", justify="right")
+    table.add_column("Progress", min_width=PROGRESS_WIDTH, no_wrap=True)
+    table.add_column("Last checked", justify="right")
+
+    for tutorial_id, lessons in tutorials.items():
+        states = [entry.state for entry in lessons]
+        passed = states.count("passed")
+        filled = round(passed / len(lessons) * PROGRESS_WIDTH)
+        checked = [entry.checked_at for entry in lessons if entry.checked_at]
+        table.add_row(
+            tutorial_id,
+            f"{passed}/{len(lessons)}",
+            str(sum(state in ("failed", "error", "timeout") for state in states)),
+            str(states.count(CHANGED)),
+            str(states.count(NOT_RUN)),
+            f"[green]{'█' * filled}[/green][dim]{'░' * (PROGRESS_WIDTH - filled)}[/dim]",
+            _ago(max(checked) if checked else None),
+        )
+
+    console.print(table)
+    passed = sum(entry.state == "passed" for entry in entries)
+    console.print(f"{passed}/{len(entries)} lessons passed")
+
+
+def print_lessons(tutorial_id: str, entries: List[LessonEntry]):
+    from rich.table import Table
+
+    table = Table(title=f"MediCode progress: {tutorial_id}")
+    table.add_column("Lesson")
+    table.add_column("Result")
+    table.add_column("Time", justify="right")
+    table.add_column("Checked", justify="right")
+    table.add_column("Details", overflow="fold")
+
+    for entry in entries:
+        state = entry.state
+        result = _styled(state)
+        if state == CHANGED:
+            result += f" (was {entry.status})"
+        table.add_row(
+            entry.name,
+            result,
+            f"{entry.duration:.2f}s" if entry.duration is not None else "-",
+            _ago(entry.checked_at),
+            "" if entry.status in (None, "passed") else entry.message,
+        )
+
+    console.print(table)
@@ -0,0 +1,33 @@
+import click
+
+import medicode_cli.dev_utils as du
+from medicode_cli.log import dump_recent
+from medicode_cli.medicode_api import MedicodeAPI
+from medicode_cli.outbox import Outbox
+
+
+@click.command()
+def sync():
+    """Send submissions queued while offline."""
+    if not Outbox.exists():
+        du.print_success("Nothing to sync")
+        return
+    with Outbox() as outbox:
+        pending = len(outbox)
+    if not pending:
+        du.print_success("Nothing to sync")
+        return
+
+    api = MedicodeAPI()
+    api.check_authenticated()
+
+    du.print_info(f"Sending {pending} queued submission(s)...")
+    try:
+        sent = api.flush_outbox()
+    except Exception as e:  # noqa: BLE001
+        with Outbox() as outbox:
+            remaining = len(outbox)
+        du.print_error(f"Sync stopped, {remaining} submission(s) still queued: {e}")
+        dump_recent()
+        return
+    du.print_success(f"Sent {sent} submission(s)")
@@ -0,0 +1,24 @@
+"""Shared rich consoles, created on first use.
+
+Importing rich.console costs more than the rest of the CLI's startup, so the
+consoles are proxies that only import it when something is printed.
+"""
+
+
+class _LazyConsole:
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._console = None
+
+    def __getattr__(self, name):
+        if self._console is None:
+            from rich.console import Console
+
+            self._console = Console(**self._kwargs)
+        return getattr(self._console, name)
+
+
+# Regular output
+console = _LazyConsole()
+# Status and error messages, kept apart from the student's program output
+err_console = _LazyConsole(stderr=True)
@@ -1,4 +1,5 @@
 import os
+from pathlib import Path
 
 # Check if we're running in a dev container
 IS_DEV_CONTAINER = os.environ.get('CODESPACES') == 'true'
@@ -8,11 +9,99 @@ DEVCONTAINER_HOST = "host.docker.internal"
 LOCAL_HOST = "localhost"
 DEVCONTAINER_PORT = 3000
 
-BASE_URL = f"http://{DEVCONTAINER_HOST}:{DEVCONTAINER_PORT}/api/medicode-cli"
+# MEDICODE_BASE_URL points the CLI at another server, e.g. the stand-in the
+# benchmarks run against
+BASE_URL = os.environ.get(
+    "MEDICODE_BASE_URL", f"http://{DEVCONTAINER_HOST}:{DEVCONTAINER_PORT}/api/medicode-cli"
+)
 PYTHON_VALIDATE_CODE_ENDPOINT = "validate"
+PYTHON_VALIDATE_BATCH_ENDPOINT = "validate/batch"
+HEALTH_CHECK_ENDPOINT = "health"
+SUBMISSIONS_BULK_ENDPOINT = "submissions/bulk"
 
 # OAuth configuration
 OAUTH_CLIENT_ID = "medicode-cli"
 OAUTH_AUTHORIZE_URL = f"http://{LOCAL_HOST}:{DEVCONTAINER_PORT}/api/auth/cli/authorize"
 OAUTH_CALLBACK_PORT = 3001
-OAUTH_CALLBACK_URL = f"http://{LOCAL_HOST}:{OAUTH_CALLBACK_PORT}/callback"
\ No newline at end of file
+OAUTH_CALLBACK_URL = f"http://{LOCAL_HOST}:{OAUTH_CALLBACK_PORT}/callback"
+OAUTH_REFRESH_URL = f"http://{DEVCONTAINER_HOST}:{DEVCONTAINER_PORT}/api/auth/cli/refresh"
+TOKEN_REFRESH_MARGIN = 5 * 60  # Seconds before expiry to refresh the access token
+TOKEN_REFRESH_EXIT_WAIT = 10  # Seconds the CLI waits on exit for a background refresh to finish
+
+# HTTP transport configuration
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = 16
+HTTP_CONNECT_TIMEOUT = 3.05  # Seconds to establish the TCP connection
+HTTP_READ_TIMEOUT = 15  # Seconds to wait for the server between bytes
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.3  # Sleep 0.3s, 0.6s, 1.2s, ... between retries
+HTTP_BACKOFF_MAX = 5
+HTTP_RETRY_STATUSES = (429, 502, 503, 504)
+# Gzip JSON request bodies of at least HTTP_COMPRESS_MIN_BYTES. Off by default,
+# as a server that can't decode them tends to answer 400 or 500 rather than 415
+HTTP_COMPRESS_REQUESTS = os.environ.get("MEDICODE_COMPRESS_REQUESTS") == "1"
+HTTP_COMPRESS_MIN_BYTES = 1024
+HTTP_TIMINGS_KEPT = 256  # Most recent request timings kept by the transport
+ASYNC_MAX_CONCURRENCY = HTTP_POOL_MAXSIZE  # Requests in flight at once from the async client
+
+# Local cache configuration
+CACHE_DIR = Path.home() / ".medicode" / "cache"
+DRIVER_CACHE_TTL = 24 * 60 * 60  # Seconds before cached driver code is revalidated
+DRIVER_CACHE_MAX_BYTES = 5 * 1024 * 1024
+DRIVER_CACHE_MAX_ENTRIES = 500
+AST_INDEX_CACHE_MAX_BYTES = 5 * 1024 * 1024
+SUBMITTED_CACHE_MAX_BYTES = 5 * 1024 * 1024  # Last acknowledged code per lesson, for deltas
+SERVER_CACHE_TTL = 7 * 24 * 60 * 60  # Seconds before a server's refusal of gzip bodies is retried
+PREFETCH_LESSONS = 3  # Upcoming lessons whose tests are fetched after a lesson passes
+VERDICT_CACHE_MAX_BYTES = 20 * 1024 * 1024  # Last verdict and output per code and driver
+VERDICT_CACHE_MAX_ENTRIES = 500
+
+# Lesson manifest configuration
+MANIFEST_PATH = Path.home() / ".medicode" / "manifest.json"  # Lesson hashes and last verdicts
+
+# Offline submission queue configuration
+OUTBOX_PATH = Path.home() / ".medicode" / "outbox.sqlite3"
+OUTBOX_BATCH_SIZE = 50  # Submissions per bulk request
+OUTBOX_CLAIM_LEASE = 60  # Seconds a flush may hold submissions before others retry them
+OUTBOX_FLUSH_EXIT_WAIT = 3  # Seconds the CLI waits on exit for a background flush to deliver
+
+# Execution worker configuration
+WORKER_POOL_SIZE = 2  # Warm workers kept ready, each runs one job before recycling
+WORKER_PRELOAD = (
+    "ast",
+    "io",
+    "json",
+    "re",
+    "traceback",
+    "IPython.display",
+    "medicode_cli.code_index",
+    "medicode_cli.student_code_utils",
+)
+BATCH_WORKERS = min(8, os.cpu_count() or 1)  # Lessons validated at once by --all
+TEST_CASE_WORKERS = min(4, os.cpu_count() or 1)  # Driver test cases run at once per lesson
+TEST_CASE_TIMEOUT_SECONDS = 5  # For driver test cases that don't set their own timeout
+WORKER_KILL_GRACE = 1  # Seconds to wait for a killed job's pipes to close
+
+# Default per-lesson budgets, which the validate response can override
+LESSON_WALL_SECONDS = 10  # Wall-clock time for the student code and the tests together
+LESSON_CPU_SECONDS = 5
+LESSON_MEMORY_MB = 512  # Address space on top of the preloaded worker's
+LESSON_MAX_PROCESSES = 32  # Processes the lesson may start
+
+# Notebook lesson configuration
+NOTEBOOK_KERNEL_DIR = Path.home() / ".medicode" / "kernels"  # Connection and state files
+NOTEBOOK_KERNEL_IDLE_SECONDS = 30 * 60  # A kernel unused for this long shuts itself down
+NOTEBOOK_KERNEL_START_TIMEOUT = 30
+
+# Output capture configuration
+OUTPUT_LIMIT_BYTES = 10 * 1024 * 1024  # Output before a run is killed
+OUTPUT_HEAD_BYTES = 64 * 1024  # Start of the output kept for the checks
+OUTPUT_TAIL_BYTES = 64 * 1024  # End of the output kept for the checks
+OUTPUT_READ_SIZE = 64 * 1024
+
+# Logging configuration
+LOG_RING_BUFFER_SIZE = 200  # Recent log records kept to show when a command fails
+
+# Watch mode configuration
+WATCH_DEBOUNCE = 0.15  # Seconds without file events before re-running
+WATCH_POLL_INTERVAL = 0.5  # Seconds between mtime checks without inotify
@@ -0,0 +1,62 @@
+"""Line-based deltas between two versions of a student's code.
+
+A delta rebuilds the new version from the base by copying runs of the
+base's lines and inserting new ones, so a one-line edit to a long lesson
+costs a few bytes instead of the whole file. It carries the hashes of both
+versions, so the receiver can tell it holds a different base and ask for
+the full code instead.
+
+A delta is ``{"base_hash": ..., "hash": ..., "ops": [...]}``, where each op
+is either ``["=", start, end]`` to copy ``base_lines[start:end]`` or
+``["+", text]`` to insert ``text``.
+"""
+
+import difflib
+import json
+from typing import Optional
+
+from .outbox import code_hash
+
+
+class DeltaMismatch(Exception):
+    """The delta doesn't apply to the given base."""
+
+
+def make_delta(base: str, new: str) -> Optional[dict]:
+    """Encode ``new`` relative to ``base``.
+
+    Returns:
+        dict: The delta, or None if it wouldn't be smaller than ``new`` itself
+    """
+    base_lines = base.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, base_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(["=", i1, i2])
+        elif j2 > j1:
+            # Replaced and inserted lines, deleted lines are simply not copied
+            ops.append(["+", "".join(new_lines[j1:j2])])
+
+    delta = {"base_hash": code_hash(base), "hash": code_hash(new), "ops": ops}
+    if len(json.dumps(delta)) >= len(json.dumps(new)):
+        return None
+    return delta
+
+
+def apply_delta(base: str, delta: dict) -> str:
+    """Rebuild the new version from ``base``, checking both hashes."""
+    if code_hash(base) != delta["base_hash"]:
+        raise DeltaMismatch("The delta was made against a different base")
+    base_lines = base.splitlines(keepends=True)
+    parts = []
+    for op in delta["ops"]:
+        if op[0] == "=":
+            parts.extend(base_lines[op[1] : op[2]])
+        else:
+            parts.append(op[1])
+    new = "".join(parts)
+    if code_hash(new) != delta["hash"]:
+        raise DeltaMismatch("The rebuilt code doesn't match the delta's hash")
+    return new
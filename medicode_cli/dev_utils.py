@@ -1,35 +1,36 @@
 # Enable/disable debug mode
+import logging
 import os
-import sys
 
-from rich.console import Console
+from medicode_cli import profiler
+from medicode_cli.console import err_console as console
 
 DEBUG = os.environ.get("MEDICODE_DEBUG", "0") == "1"
 
-console = Console()
+# Named explicitly, drivers import this file as the top-level dev_utils
+_logger = logging.getLogger("medicode_cli.dev_utils")
 
-def debug_print(message):
-    """Print a debug message if debug mode is enabled"""
-    if DEBUG:
-        console.print(f"[DEBUG:UTILS] {message}", file=sys.stderr)
+def debug_print(message, *args, **kwargs):
+    """Log a debug message, formatted with %-style args only if debug logging is on"""
+    _logger.debug(message, *args, **kwargs)
 
 def print_success(message):
     """Print a success message"""
-    console.print(f"[green]✅ {message}[/green]", file=sys.stderr)
+    console.print(f"[green]✅ {message}[/green]")
 
 def print_error(message):
     """Print an error message"""
-    console.print(f"[red]❌ {message}[/red]", file=sys.stderr)
+    console.print(f"[red]❌ {message}[/red]")
 
 def print_info(message):
     """Print an info message"""
-    console.print(f"[cyan]🔎 {message}[/cyan]", file=sys.stderr)
+    console.print(f"[cyan]🔎 {message}[/cyan]")
 
 def combine_code(driver_code: str) -> str:
     """Combine the utils code and driver code into a single file that will import student code"""
     # Read the student_code_utils.py content
     utils_path = os.path.join(os.path.dirname(__file__), "student_code_utils.py")
-    with open(utils_path) as f:
+    with profiler.span("combine_code"), open(utils_path) as f:
         utils_code = f.read()
     
     # Combine utils and driver code, with student code being imported
@@ -0,0 +1,370 @@
+"""Run student and driver code in pre-forked worker processes.
+
+Starting a fresh interpreter for every run costs interpreter startup plus
+the imports each lesson needs. Instead, the pool starts one
+``medicode_cli.worker`` server that pays for those imports once, and keeps a
+few job processes forked from it ahead of time. Each job is handed to one of
+them and a replacement is forked immediately. A job runs the student's code
+once and then the driver tests against that same execution. Every job
+process runs exactly one job and exits, so jobs stay isolated from each other
+and a crash or timeout only takes down that one process.
+"""
+
+import json
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from . import constants, profiler
+from .capture import PipeCapture, binary_stream
+
+PACKAGE_PARENT = Path(__file__).resolve().parent.parent
+
+
+@dataclass
+class ExecutionResult:
+    returncode: int
+    stdout: str
+    stderr: str
+    timed_out: bool = False
+    # Killed for printing more than OUTPUT_LIMIT_BYTES
+    output_limit_exceeded: bool = False
+    duration: float = 0.0
+    error: Optional[str] = None
+    # The student's own run: success, stdout, stderr and variables
+    student: Optional[dict] = None
+    # Measured cpu_seconds, peak_rss_bytes and wall_seconds of the job process
+    usage: Optional[dict] = None
+    # sandbox.CPU_LIMIT or MEMORY_LIMIT if the run went over its budget
+    limit_exceeded: Optional[str] = None
+
+    @property
+    def success(self) -> bool:
+        return self.returncode == 0 and not (self.timed_out or self.output_limit_exceeded)
+
+
+def worker_env() -> dict:
+    """Environment for processes that run lessons, with the package importable."""
+    env = os.environ.copy()
+    if "PYTHONPATH" in env:
+        env["PYTHONPATH"] = f"{PACKAGE_PARENT}{os.pathsep}{env['PYTHONPATH']}"
+    else:
+        env["PYTHONPATH"] = str(PACKAGE_PARENT)
+    return env
+
+
+def _open_pidfd(pid: int) -> Optional[int]:
+    """A pidfd for ``pid``, which tells when that exact process exits, or None if unsupported."""
+    try:
+        return os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return None
+
+
+def _pid_in_use(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ForkServer:
+    """The preloaded process that job processes are forked from."""
+
+    @profiler.profiled("start worker server")
+    def __init__(self):
+        self._control, child_control = socket.socketpair()
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, "-m", "medicode_cli.worker", str(child_control.fileno())],
+                stdin=subprocess.DEVNULL,
+                env=worker_env(),
+                pass_fds=(child_control.fileno(),),
+            )
+        finally:
+            child_control.close()
+        self._replies = self._control.makefile("rb")
+        self._lock = threading.Lock()
+
+    @profiler.profiled("fork job process")
+    def fork(self, fds: List[int]) -> int:
+        """Fork a job process wired to ``fds`` and return its pid.
+
+        Args:
+            fds (list): stdin, stdout, stderr, job pipe and result pipe for the child
+        """
+        with self._lock:
+            socket.send_fds(self._control, [b"fork"], fds)
+            reply = self._replies.readline()
+        if not reply:
+            raise RuntimeError("The execution worker server exited unexpectedly")
+        return int(reply)
+
+    def close(self):
+        # The server exits when the control socket is closed
+        self._replies.close()
+        self._control.close()
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class Worker:
+    """A single forked job process waiting for its job."""
+
+    def __init__(self, server: ForkServer, stdin_fd: int = 0):
+        self._stdout_r, stdout_w = os.pipe()
+        self._stderr_r, stderr_w = os.pipe()
+        job_r, self._job_w = os.pipe()
+        self._result_r, result_w = os.pipe()
+        child_fds = [stdout_w, stderr_w, job_r, result_w]
+        try:
+            self.pid = server.fork([stdin_fd, *child_fds])
+        except BaseException:
+            for fd in (self._stdout_r, self._stderr_r, self._job_w, self._result_r):
+                os.close(fd)
+            raise
+        finally:
+            # The child has its own copies, ours would hide EOF
+            for fd in child_fds:
+                os.close(fd)
+        # The job blocks until it gets its job, so this is still our process
+        self._pidfd = _open_pidfd(self.pid)
+
+    @profiler.profiled("run job")
+    def run(
+        self, job: dict, timeout: Optional[float] = None, stream: bool = False
+    ) -> ExecutionResult:
+        """Send the job and wait for the process to finish it.
+
+        With ``stream``, the student's output is copied to our stdout and
+        stderr as it is produced.
+        """
+        start = time.perf_counter()
+
+        capture = PipeCapture(
+            {"stdout": self._stdout_r, "stderr": self._stderr_r},
+            on_limit=self.kill,
+            echo={"stdout": binary_stream(sys.stdout), "stderr": binary_stream(sys.stderr)}
+            if stream
+            else None,
+        ).start()
+        outputs = {}
+        result_reader = threading.Thread(
+            target=self._drain, args=(self._result_r, "result", outputs), daemon=True
+        )
+        result_reader.start()
+
+        try:
+            with os.fdopen(self._job_w, "wb") as f:
+                f.write(json.dumps(job).encode("utf-8"))
+
+            deadline = None if timeout is None else start + timeout
+            finished = capture.wait(deadline)
+            if finished:
+                result_reader.join(
+                    None if deadline is None else max(0, deadline - time.perf_counter())
+                )
+        except BaseException:
+            # E.g. Ctrl-C, which the job doesn't see in its own session
+            self.kill()
+            self._close_pidfd()
+            raise
+        timed_out = not finished or result_reader.is_alive()
+        if timed_out:
+            self.kill()
+        # Anything still holding the pipes open after the kill is abandoned
+        grace = time.perf_counter() + constants.WORKER_KILL_GRACE
+        capture.wait(grace)
+        result_reader.join(max(0, grace - time.perf_counter()))
+        self._close_pidfd()
+
+        try:
+            result = json.loads(outputs.get("result") or b"{}")
+        except json.JSONDecodeError:
+            result = {}
+
+        active = profiler.get_profiler()
+        if active is not None:
+            # Show the job process's own phases inside this run
+            for phase in result.get("timings", ()):
+                active.add_span(
+                    phase["name"],
+                    phase["start"],
+                    phase["duration"],
+                    pid=self.pid,
+                    peak_rss_bytes=phase.get("peak_rss_bytes"),
+                )
+
+        if "returncode" in result:
+            returncode = result["returncode"]
+        else:
+            # The process died before reporting, e.g. it was killed
+            returncode = -signal.SIGKILL if timed_out or capture.limit_exceeded else 1
+
+        return ExecutionResult(
+            returncode=returncode,
+            # The driver's output, or whatever the process wrote if it died first
+            stdout=result.get("stdout", capture.text("stdout")),
+            stderr=result.get("stderr", capture.text("stderr")),
+            timed_out=timed_out,
+            output_limit_exceeded=capture.limit_exceeded,
+            duration=time.perf_counter() - start,
+            error=result.get("error"),
+            student=result.get("student"),
+            usage=result.get("usage"),
+            limit_exceeded=result.get("limit_exceeded"),
+        )
+
+    @staticmethod
+    def _drain(fd: int, name: str, outputs: dict):
+        with os.fdopen(fd, "rb") as f:
+            outputs[name] = f.read()
+
+    def kill(self):
+        """Kill the job process and everything it started.
+
+        The job leads its own session, so its process group keeps its pid
+        while anything the job started is still running. Once the job itself
+        has exited and been reaped, a process with its pid is someone else's
+        and its group is left alone.
+        """
+        if self._job_exited() and _pid_in_use(self.pid):
+            return
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _job_exited(self) -> bool:
+        """Whether the job process has exited, False if that can't be told."""
+        pidfd = self._pidfd
+        if pidfd is None:
+            return False
+        poller = select.poll()
+        poller.register(pidfd, select.POLLIN)
+        return bool(poller.poll(0))
+
+    def _close_pidfd(self):
+        if self._pidfd is not None:
+            os.close(self._pidfd)
+            self._pidfd = None
+
+    def close(self):
+        """Stop an idle process by closing its job pipe."""
+        self._close_pidfd()
+        for fd in (self._job_w, self._stdout_r, self._stderr_r, self._result_r):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class WorkerPool:
+    """A pool of warm, single-use job processes.
+
+    With ``recycle`` off, used processes are not replaced, which suits
+    callers that know they only need ``size`` jobs. ``stdin`` follows the
+    ``subprocess`` convention: None shares our stdin with the jobs and
+    ``subprocess.DEVNULL`` is for jobs that run unattended.
+    """
+
+    def __init__(
+        self, size: int = constants.WORKER_POOL_SIZE, recycle: bool = True, stdin=None
+    ):
+        self.size = size
+        self.recycle = recycle
+        self._stdin_fd = os.open(os.devnull, os.O_RDONLY) if stdin == subprocess.DEVNULL else 0
+        self._server = ForkServer()
+        self._idle: List[Worker] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        # Forking waits for the server to finish its imports, which happens
+        # in the background so the caller can get on with other work
+        self._prefork = threading.Thread(target=self._fill, daemon=True)
+        self._prefork.start()
+
+    def _fill(self):
+        with self._lock:
+            while not self._closed and len(self._idle) < self.size:
+                self._idle.append(Worker(self._server, self._stdin_fd))
+
+    def _acquire(self) -> Worker:
+        """Take a warm process and fork its replacement."""
+        with profiler.span("wait for worker"):
+            self._prefork.join()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Worker pool is closed")
+            worker = self._idle.pop(0) if self._idle else Worker(self._server, self._stdin_fd)
+            if self.recycle and len(self._idle) < self.size:
+                self._idle.append(Worker(self._server, self._stdin_fd))
+        return worker
+
+    def run_lesson(
+        self,
+        student_path: str,
+        student_code: str,
+        driver_code: Optional[str] = None,
+        timeout: Optional[float] = None,
+        stream: bool = False,
+        limits: Optional[dict] = None,
+        fail_fast: bool = False,
+    ) -> ExecutionResult:
+        """Run the student code once and, if given, the driver tests against it.
+
+        Args:
+            student_path (str): The lesson file, used as ``__file__`` and in tracebacks
+            student_code (str): The contents of the lesson file
+            driver_code (str, optional): Combined driver code, which sees the
+                student run as ``import student_code``
+            timeout (float, optional): Seconds before the process is killed
+            stream (bool): Show the student's output on our stdout and stderr
+                as it is produced
+            limits (dict, optional): ``ResourceLimits.to_dict()`` rlimits for
+                the job process
+            fail_fast (bool): Stop the driver's test cases at the first failure
+
+        Returns:
+            ExecutionResult: The student run under ``student`` and the
+                driver's exit status and output
+        """
+        job = {
+            "student_path": student_path,
+            "student_code": student_code,
+            "driver_code": driver_code,
+            "driver_filename": str(Path(student_path).parent / "<medicode-driver>"),
+            "limits": limits,
+            "fail_fast": fail_fast,
+        }
+        return self._acquire().run(job, timeout=timeout, stream=stream)
+
+    def close(self):
+        self._prefork.join()
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.close()
+        self._server.close()
+        if self._stdin_fd != 0:
+            os.close(self._stdin_fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,81 @@
+"""Locate the student's lesson files under student/<tutorial>/lesson-<n>.py.
+
+A lesson may also be a notebook, lesson-<n>.ipynb; if both exist the .py
+file is used.
+"""
+
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+STUDENT_DIR = Path(__file__).resolve().parent.parent / "student"
+
+_TUTORIAL_PATTERN = re.compile(r"^tut-(\d+)$")
+_LESSON_PATTERN = re.compile(r"^lesson-(\d+)\.(py|ipynb)$")
+
+
+@dataclass(frozen=True)
+class Lesson:
+    tutorial_id: str
+    lesson_id: str
+    path: Path
+
+    @property
+    def name(self) -> str:
+        return f"{self.tutorial_id}/lesson-{self.lesson_id}"
+
+    @property
+    def sort_key(self):
+        return (_number(self.tutorial_id), _number(self.lesson_id))
+
+    @property
+    def is_notebook(self) -> bool:
+        return self.path.suffix == ".ipynb"
+
+    def read_code(self) -> str:
+        """The lesson's code, which for a notebook is its code cells in order."""
+        if self.is_notebook:
+            from .notebook import read_cells, notebook_source
+
+            return notebook_source(read_cells(self.path))
+        return self.path.read_text()
+
+
+def _number(identifier: str) -> int:
+    digits = re.search(r"\d+", identifier)
+    return int(digits.group()) if digits else 0
+
+
+def lesson_path(tutorial_id: str, lesson_id: str, student_dir: Path = STUDENT_DIR) -> Path:
+    path = student_dir / tutorial_id / f"lesson-{lesson_id}.py"
+    notebook = path.with_suffix(".ipynb")
+    if not path.exists() and notebook.exists():
+        return notebook
+    return path
+
+
+def get_lesson(tutorial_id: str, lesson_id: str, student_dir: Path = STUDENT_DIR) -> Lesson:
+    return Lesson(tutorial_id, str(lesson_id), lesson_path(tutorial_id, lesson_id, student_dir))
+
+
+def discover_lessons(
+    tutorial_id: Optional[str] = None, student_dir: Path = STUDENT_DIR
+) -> List[Lesson]:
+    """Find every lesson file, optionally within one tutorial, in course order."""
+    lessons = {}
+    if not student_dir.is_dir():
+        return []
+    for tutorial_dir in student_dir.iterdir():
+        if not tutorial_dir.is_dir() or not _TUTORIAL_PATTERN.match(tutorial_dir.name):
+            continue
+        if tutorial_id is not None and tutorial_dir.name != tutorial_id:
+            continue
+        for path in tutorial_dir.iterdir():
+            match = _LESSON_PATTERN.match(path.name)
+            if not match or not path.is_file():
+                continue
+            key = (tutorial_dir.name, match.group(1))
+            if key not in lessons or match.group(2) == "py":
+                lessons[key] = Lesson(tutorial_dir.name, match.group(1), path)
+    return sorted(lessons.values(), key=lambda lesson: lesson.sort_key)
@@ -0,0 +1,146 @@
+"""Leveled, structured logging for the CLI.
+
+Modules log with the standard library under the ``medicode_cli`` logger,
+passing %-style arguments so nothing is formatted unless a record is
+emitted, and keyword fields through ``extra``:
+
+    logger = logging.getLogger(__name__)
+    logger.debug("Response body: %.500s", response.text)
+    logger.info("POST %s -> %s", url, status, extra={"elapsed_ms": 12.5})
+
+``setup_logging`` keeps the most recent records in a ring buffer, which
+``dump_recent`` writes to stderr when a command fails. With MEDICODE_DEBUG=1
+every record is also written to stderr as it happens.
+
+Records are captured from MEDICODE_LOG_LEVEL (INFO by default, DEBUG with
+MEDICODE_DEBUG=1); below that a log call is a single level check. Tokens,
+cookies and authorization headers are redacted when a record is formatted.
+MEDICODE_LOG_FORMAT=json writes one JSON object per record instead of text.
+"""
+
+import collections
+import json
+import logging
+import os
+import re
+import sys
+from typing import Deque, Optional, TextIO
+
+from .constants import LOG_RING_BUFFER_SIZE
+
+LOGGER_NAME = "medicode_cli"
+
+_SECRET_PATTERNS = [
+    re.compile(r"(Bearer\s+)[^\s'\",;}]+", re.IGNORECASE),
+    re.compile(r"((?:sb-)?(?:access|refresh)[-_]token['\"]?\s*[=:]\s*['\"]?)[^\s'\",;}]+"),
+    re.compile(r"(['\"]?(?:Authorization|Cookie)['\"]?\s*:\s*['\"])[^'\"]*", re.IGNORECASE),
+]
+
+# Attributes every record has, anything else came from ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+}
+
+_ring_buffer: Optional["RingBufferHandler"] = None
+
+
+def redact(text: str) -> str:
+    for pattern in _SECRET_PATTERNS:
+        text = pattern.sub(r"\1***", text)
+    return text
+
+
+def _fields(record: logging.LogRecord) -> dict:
+    return {
+        name: value for name, value in vars(record).items() if name not in _RECORD_ATTRIBUTES
+    }
+
+
+class RedactingFormatter(logging.Formatter):
+    """``time level logger: message key=value ...`` with secrets removed."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = _fields(record)
+        if fields:
+            text += " " + " ".join(f"{name}={value!r}" for name, value in fields.items())
+        return redact(text)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with secrets removed."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return redact(json.dumps(data, default=repr))
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the most recent records, unformatted, until they are dumped."""
+
+    def __init__(self, capacity: int = LOG_RING_BUFFER_SIZE):
+        super().__init__()
+        self.records: Deque[logging.LogRecord] = collections.deque(maxlen=capacity)
+
+    def emit(self, record: logging.LogRecord):
+        self.records.append(record)
+
+    def dump(self, stream: TextIO):
+        with self.lock:
+            records, self.records = list(self.records), collections.deque(
+                maxlen=self.records.maxlen
+            )
+        for record in records:
+            stream.write(self.format(record) + "\n")
+        stream.flush()
+
+
+def setup_logging() -> logging.Logger:
+    """Configure the ``medicode_cli`` logger from the environment, once per process."""
+    global _ring_buffer
+    logger = logging.getLogger(LOGGER_NAME)
+    if _ring_buffer is not None:
+        return logger
+
+    debug = os.environ.get("MEDICODE_DEBUG", "0") == "1"
+    level = os.environ.get("MEDICODE_LOG_LEVEL", "DEBUG" if debug else "INFO").upper()
+    logger.setLevel(level)
+    logger.propagate = False
+
+    formatter = (
+        JsonFormatter() if os.environ.get("MEDICODE_LOG_FORMAT") == "json" else RedactingFormatter()
+    )
+    if debug:
+        stderr = logging.StreamHandler(sys.stderr)
+        stderr.setFormatter(formatter)
+        logger.addHandler(stderr)
+
+    _ring_buffer = RingBufferHandler()
+    _ring_buffer.setFormatter(formatter)
+    logger.addHandler(_ring_buffer)
+    return logger
+
+
+def dump_recent(stream: Optional[TextIO] = None):
+    """Write out the buffered records after a failure, unless they were already shown."""
+    if _ring_buffer is None or not _ring_buffer.records:
+        return
+    if os.environ.get("MEDICODE_DEBUG", "0") == "1":
+        # Every record went to stderr already
+        return
+    stream = stream or sys.stderr
+    stream.write("--- Recent MediCode log ---\n")
+    _ring_buffer.dump(stream)
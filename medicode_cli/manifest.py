@@ -0,0 +1,176 @@
+"""Persisted index of the student's lessons and their latest results.
+
+The manifest at ~/.medicode/manifest.json records, for every lesson under
+student/, the hash of its code and the verdict, message and duration of its
+last check, along with the hash of the code that was checked. ``refresh``
+brings it up to date with the files: a lesson whose mtime and size haven't
+changed keeps its hash, so only edited lessons are read again. Comparing
+the two hashes tells whether the last verdict is still current.
+
+``medicode python`` records its results here and ``medicode status`` reads
+them, so progress can be shown without running or uploading anything.
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from . import constants
+from .lessons import STUDENT_DIR, Lesson, discover_lessons
+from .outbox import code_hash
+
+# Bump when the layout changes so old manifests are rebuilt
+MANIFEST_VERSION = 1
+
+NOT_RUN = "not run"
+CHANGED = "changed"
+
+
+@dataclass
+class LessonEntry:
+    tutorial_id: str
+    lesson_id: str
+    path: str
+    mtime_ns: int = 0
+    size: int = 0
+    # Hash of the lesson's code as it is now, None if it can't be read
+    code_hash: Optional[str] = None
+    # The last check, and the hash of the code it checked
+    status: Optional[str] = None
+    message: str = ""
+    duration: Optional[float] = None
+    checked_at: Optional[float] = None
+    checked_hash: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.tutorial_id}/lesson-{self.lesson_id}"
+
+    @property
+    def state(self) -> str:
+        """The last verdict if it is for the current code, else NOT_RUN or CHANGED."""
+        if self.status is None:
+            return NOT_RUN
+        if self.checked_hash != self.code_hash:
+            return CHANGED
+        return self.status
+
+
+class Manifest:
+    """The lesson index, loaded from and saved to ``path``.
+
+    Changes are made inside ``Manifest.update()``, which holds a lock on the
+    file so concurrent commands don't overwrite each other's results.
+    """
+
+    def __init__(self, path: Optional[Path] = None, student_dir: Path = STUDENT_DIR):
+        self.path = path or constants.MANIFEST_PATH
+        self.student_dir = student_dir
+        self.entries: Dict[str, LessonEntry] = {}
+
+    @classmethod
+    def load(cls, path: Optional[Path] = None, student_dir: Path = STUDENT_DIR) -> "Manifest":
+        manifest = cls(path, student_dir)
+        try:
+            with open(manifest.path) as f:
+                document = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return manifest
+        if document.get("version") != MANIFEST_VERSION:
+            return manifest
+        for name, entry in document.get("lessons", {}).items():
+            manifest.entries[name] = LessonEntry(**entry)
+        return manifest
+
+    @classmethod
+    @contextlib.contextmanager
+    def update(cls, path: Optional[Path] = None, student_dir: Path = STUDENT_DIR):
+        """Load the manifest for changes and save it afterwards, locked throughout."""
+        path = path or constants.MANIFEST_PATH
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path.with_suffix(".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest = cls.load(path, student_dir)
+            yield manifest
+            manifest.save()
+
+    def save(self):
+        """Atomically write the manifest."""
+        document = {
+            "version": MANIFEST_VERSION,
+            "lessons": {name: asdict(entry) for name, entry in self.entries.items()},
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(document, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _refresh_entry(self, lesson: Lesson) -> LessonEntry:
+        """The lesson's entry, with its code hashed again only if the file changed."""
+        entry = self.entries.get(lesson.name)
+        if entry is None or entry.path != str(lesson.path):
+            entry = LessonEntry(lesson.tutorial_id, lesson.lesson_id, str(lesson.path))
+            self.entries[lesson.name] = entry
+        try:
+            stat = lesson.path.stat()
+        except OSError:
+            entry.code_hash = None
+            return entry
+        if (stat.st_mtime_ns, stat.st_size) != (entry.mtime_ns, entry.size):
+            entry.mtime_ns, entry.size = stat.st_mtime_ns, stat.st_size
+            try:
+                entry.code_hash = code_hash(lesson.read_code())
+            except (OSError, UnicodeDecodeError, ValueError):
+                entry.code_hash = None
+        return entry
+
+    def refresh(self, tutorial_id: Optional[str] = None) -> List[LessonEntry]:
+        """Bring the entries in line with the lesson files, optionally for one tutorial.
+
+        Returns:
+            list: The entries of the lessons that exist, in course order
+        """
+        lessons = discover_lessons(tutorial_id, self.student_dir)
+        names = {lesson.name for lesson in lessons}
+        for name, entry in list(self.entries.items()):
+            if name not in names and tutorial_id in (None, entry.tutorial_id):
+                del self.entries[name]
+        return [self._refresh_entry(lesson) for lesson in lessons]
+
+    def record(
+        self,
+        lesson: Lesson,
+        code: str,
+        status: str,
+        message: str = "",
+        duration: Optional[float] = None,
+    ):
+        """Store the verdict for ``code``, the lesson's code when it was checked."""
+        entry = self._refresh_entry(lesson)
+        entry.status = status
+        entry.message = message
+        entry.duration = duration
+        entry.checked_at = time.time()
+        entry.checked_hash = code_hash(code)
+
+
+def record_results(checked: Iterable[tuple]):
+    """Record ``(LessonResult, code)`` pairs in the manifest, ignoring a manifest that can't be written."""
+    try:
+        with Manifest.update() as manifest:
+            for result, code in checked:
+                manifest.record(
+                    result.lesson, code, result.status, result.message, result.duration
+                )
+    except OSError:
+        pass
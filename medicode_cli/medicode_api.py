@@ -1,54 +1,169 @@
-import requests
+import atexit
 import os
 import sys
 import json
-from typing import Optional
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Optional
+from . import profiler
 from .auth import AuthManager
-from rich.console import Console
+from .cache import CacheEntry, DiskCache, DriverCache, driver_key
+from .console import console
+from .delta import make_delta
+from .outbox import Outbox, QueuedSubmission, code_hash
+
+if TYPE_CHECKING:
+    from .transport import Transport
 
 # Add the parent directory to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from .constants import BASE_URL, PYTHON_VALIDATE_CODE_ENDPOINT
+from .constants import (
+    BASE_URL,
+    BATCH_WORKERS,
+    HEALTH_CHECK_ENDPOINT,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_FLUSH_EXIT_WAIT,
+    PYTHON_VALIDATE_BATCH_ENDPOINT,
+    PYTHON_VALIDATE_CODE_ENDPOINT,
+    SUBMISSIONS_BULK_ENDPOINT,
+    SUBMITTED_CACHE_MAX_BYTES,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ServerUnreachable(Exception):
+    """The request could not be completed because the server can't be reached."""
+
+
+class ServerTimeout(ServerUnreachable):
+    """The server didn't answer in time."""
+
+
+def _etag(entry: Optional[CacheEntry]) -> Optional[str]:
+    return entry.value.get("etag") if entry is not None else None
+
+
+# Background outbox flushes, which are waited for briefly before the CLI exits
+_flush_threads: List[threading.Thread] = []
+
+
+def _wait_for_flushes():
+    """Give flushes in flight a moment to deliver, anything unsent stays queued."""
+    deadline = time.monotonic() + OUTBOX_FLUSH_EXIT_WAIT
+    for thread in _flush_threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+
 
-console = Console()
+atexit.register(_wait_for_flushes)
 
 
 class MedicodeAPI:
-    def __init__(self):
+    def __init__(self, transport: Optional["Transport"] = None, delta: bool = False):
+        """
+        Args:
+            transport (Transport, optional): HTTP transport, the shared one by default
+            delta (bool): Send only the changes since the last code the server
+                acknowledged for the lesson
+        """
         self.base_url = BASE_URL
         self.auth_manager = AuthManager()
+        self.delta = delta
+        self._submitted: Optional[DiskCache] = None
+        self._transport = transport
+        self._batch_supported = True
+        self._bulk_supported = True
+        self._flush_thread: Optional[threading.Thread] = None
+        self._headers = None
+        self._headers_lock = threading.Lock()
+
+    @property
+    def transport(self) -> "Transport":
+        """The HTTP transport, which imports requests only once it is needed."""
+        if self._transport is None:
+            from .transport import get_transport
+
+            # Share one pooled session across every client in the process
+            self._transport = get_transport()
+        return self._transport
+
+    @property
+    def submitted(self) -> DiskCache:
+        """The last code the server acknowledged for each lesson."""
+        if self._submitted is None:
+            self._submitted = DiskCache("submitted", max_bytes=SUBMITTED_CACHE_MAX_BYTES)
+        return self._submitted
+
+    def _delta_for(self, key: str, code: str) -> Optional[dict]:
+        """A delta against the last acknowledged code for the lesson, if it's worth sending."""
+        entry = self.submitted.get(key)
+        if entry is None:
+            return None
+        return make_delta(entry.value["code"], code)
+
+    def _acknowledge(self, key: str, code: str):
+        """Remember the code the server now holds for the lesson, as the next delta's base."""
+        self.submitted.put(key, {"code": code, "hash": code_hash(code)})
+
+    def check_authenticated(self):
+        """Raise if the user is not logged in."""
+        if not self.auth_manager.is_authenticated():
+            raise Exception("Not authenticated. Please run 'medicode login' first.")
 
     def _get_headers(self) -> dict:
-        """Get headers with authentication token and session cookies."""
-        token = self.auth_manager.get_token()
-        headers = {"Content-Type": "application/json"}
+        """Get headers with authentication token and session cookies.
 
+        The headers are built once and shared by every request, concurrent
+        ones included, until the tokens change.
+        """
+        token = self.auth_manager.get_token()
         # Get the config which contains the session info
         config = self.auth_manager._load_config()
-        if config:
-            # Add the session cookies that Supabase expects
-            headers["Cookie"] = (
-                f"sb-access-token={config.get('access_token')}; sb-refresh-token={config.get('refresh_token')}"
-            )
-            # Also keep the Bearer token for backward compatibility
-            headers["Authorization"] = f"Bearer {token}"
+        stamp = (token, config.get("access_token"), config.get("refresh_token"))
+
+        with self._headers_lock:
+            if self._headers is None or self._headers[0] != stamp:
+                headers = {"Content-Type": "application/json"}
+                if config:
+                    # Add the session cookies that Supabase expects
+                    headers["Cookie"] = (
+                        f"sb-access-token={config.get('access_token')}; sb-refresh-token={config.get('refresh_token')}"
+                    )
+                    # Also keep the Bearer token for backward compatibility
+                    headers["Authorization"] = f"Bearer {token}"
+                self._headers = (stamp, headers)
+            # Callers add per-request headers to their copy
+            headers = dict(self._headers[1])
 
-        console.print(f"[yellow]Headers: {headers}[/yellow]")
+        logger.debug("Headers: %s", headers)
         return headers
 
-    def validate_code(self, code: str, tutorial_id: str, lesson_id: str) -> dict:
+    @profiler.profiled("validate_code")
+    def validate_code(
+        self,
+        code: str,
+        tutorial_id: str,
+        lesson_id: str,
+        task_id: Optional[str] = None,
+        etag: Optional[str] = None,
+    ) -> dict:
         """Validate code using the medicode API.
 
         Args:
             code (str): The code to validate
             tutorial_id (str): The tutorial ID
             lesson_id (str): The lesson ID
+            task_id (str, optional): The task ID
+            etag (str, optional): ETag of the driver code we already have cached
 
         Returns:
-            dict: The API response
+            dict: The API response, with the driver ETag under "etag" if the
+                server sent one, or {"not_modified": True} if the cached
+                driver code is still current
         """
-        if not self.auth_manager.is_authenticated():
-            raise Exception("Not authenticated. Please run 'medicode login' first.")
+        self.check_authenticated()
 
         # Gather the data
         data = {
@@ -56,23 +171,405 @@ class MedicodeAPI:
             "tutorialId": tutorial_id,
             "lessonId": lesson_id,
         }
+        if task_id is not None:
+            data["taskId"] = task_id
         url = f"{self.base_url}/{PYTHON_VALIDATE_CODE_ENDPOINT}"
         headers = self._get_headers()
+        if etag:
+            headers["If-None-Match"] = etag
+
+        key = driver_key(tutorial_id, lesson_id, task_id)
+        delta = self._delta_for(key, code) if self.delta else None
 
-        console.print(f"[yellow]Making request to: {url}[/yellow]")
-        console.print(f"[yellow]With data: {data}[/yellow]")
+        import requests
+
+        logger.debug(
+            "Validating %s/lesson-%s task %s, %d characters of code%s",
+            tutorial_id,
+            lesson_id,
+            task_id,
+            len(code),
+            " as a delta" if delta is not None else "",
+        )
 
         try:
-            response = requests.post(url, json=data, headers=headers, timeout=5)
-            console.print(f"[yellow]Response status: {response.status_code}[/yellow]")
-            console.print(f"[yellow]Response headers: {response.headers}[/yellow]")
-            console.print(f"[yellow]Response body: {response.text}[/yellow]")
+            if delta is not None:
+                delta_data = {k: v for k, v in data.items() if k != "student_code"}
+                delta_data["student_code_delta"] = delta
+                response = self.transport.post(
+                    url, json=delta_data, headers=headers, idempotent=True
+                )
+                if response.status_code in (409, 412):
+                    # The server holds a different base, send the whole code
+                    logger.info("Delta rejected with %s, sending the full code", response.status_code)
+                    delta = None
+            if delta is None:
+                # Validation only fetches driver code, so it is safe to retry
+                response = self.transport.post(url, json=data, headers=headers, idempotent=True)
+            logger.info("%s", self.transport.last_timing)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Response headers: %s", response.headers)
+                # Driver code can be long, the start is enough to tell what came back
+                logger.debug("Response body: %.500s", response.text)
+
+            if self.delta and (response.ok or response.status_code == 304):
+                self._acknowledge(key, code)
+
+            if response.status_code == 304:
+                return {"success": True, "not_modified": True}
 
             response.raise_for_status()
-            return response.json()
+            result = response.json()
+            if response.headers.get("ETag"):
+                result.setdefault("etag", response.headers["ETag"])
+            return result
         except requests.exceptions.Timeout:
-            raise Exception("Request timed out. The server might not be running or accessible.")
+            raise ServerTimeout(
+                "Request timed out. The server might not be running or accessible."
+            )
+        except requests.exceptions.ConnectionError as e:
+            raise ServerUnreachable(f"Could not connect to the server: {e}")
         except requests.exceptions.HTTPError as e:
             if response.status_code == 401:
                 raise Exception("Authentication failed. Please run 'medicode login' again.")
             raise e
+
+    @profiler.profiled("fetch_driver")
+    def fetch_driver(
+        self,
+        code: str,
+        tutorial_id: str,
+        lesson_id: str,
+        task_id: Optional[str] = None,
+        cache: Optional[DriverCache] = None,
+        offline: bool = False,
+        submit: bool = True,
+    ) -> dict:
+        """Get the validate response for a lesson, going through the driver cache.
+
+        Fresh cache entries are returned without waiting on the network, and
+        the code is queued and sent in the background. Stale entries are
+        revalidated with If-None-Match, so an unchanged driver only costs an
+        empty 304 response.
+
+        Args:
+            code (str): The student code to validate
+            tutorial_id (str): The tutorial ID
+            lesson_id (str): The lesson ID
+            task_id (str, optional): The task ID
+            cache (DriverCache, optional): Cache to read from and populate
+            offline (bool): Only use the cache, even if the entry is stale
+            submit (bool): Whether the code is the student's submission, which
+                is queued if the server can't take it now, rather than only
+                fetching the tests ahead of time
+
+        Returns:
+            dict: The validate response, without the server's copy of the student code
+        """
+        key = driver_key(tutorial_id, lesson_id, task_id)
+        entry = cache.get(key) if cache is not None else None
+
+        if offline:
+            if submit:
+                self.queue_submission(code, tutorial_id, lesson_id, task_id)
+            if entry is None:
+                raise Exception(
+                    f"No cached driver code for {key}. Run once while online first."
+                )
+            return entry.value
+        if entry is not None and entry.is_fresh(cache.ttl):
+            if submit:
+                # The tests come from the cache, but the server still gets the code
+                self.queue_submission(code, tutorial_id, lesson_id, task_id, quiet=True)
+                self.flush_outbox_in_background()
+            return entry.value
+
+        try:
+            response = self.validate_code(
+                code, tutorial_id, lesson_id, task_id, etag=_etag(entry)
+            )
+        except ServerUnreachable as e:
+            if submit:
+                self.queue_submission(code, tutorial_id, lesson_id, task_id, error=str(e))
+            if entry is None:
+                raise
+            # Keep working with the tests we have rather than blocking on the server
+            console.print(
+                "[yellow]Server unreachable, using cached tests. "
+                "Your submission will be sent later.[/yellow]"
+            )
+            return entry.value
+
+        self.flush_outbox_in_background()
+        return self._store_driver(cache, key, entry, response)
+
+    def _store_driver(
+        self, cache: Optional[DriverCache], key: str, entry: Optional[CacheEntry], response: dict
+    ) -> dict:
+        """Resolve a (possibly 304) validate response against the cache and store it."""
+        if response.get("not_modified") and entry is not None:
+            cache.touch(key)
+            return entry.value
+
+        cacheable = response.get("allow_error") or (
+            response.get("success") and response.get("code_components")
+        )
+        if cache is not None and cacheable:
+            entry_value = dict(response)
+            code_components = dict(entry_value.get("code_components") or {})
+            # The student code changes every run, only the driver is reusable
+            code_components.pop("student_code", None)
+            entry_value["code_components"] = code_components
+            cache.put(key, entry_value)
+        return response
+
+    @profiler.profiled("fetch_drivers")
+    def fetch_drivers(
+        self,
+        submissions: List[dict],
+        cache: Optional[DriverCache] = None,
+        offline: bool = False,
+        max_workers: int = BATCH_WORKERS,
+        submit: bool = True,
+    ) -> List[dict]:
+        """Get validate responses for many lessons at once.
+
+        Fresh cache entries are used as-is. The rest are sent in a single
+        batched request when the server supports it, otherwise as concurrent
+        individual requests over the shared connection pool. A lesson whose
+        request fails gets an unsuccessful response with the error message
+        rather than failing the whole batch.
+
+        Args:
+            submissions (list): Dicts with code, tutorial_id, lesson_id and task_id
+            cache (DriverCache, optional): Cache to read from and populate
+            offline (bool): Only use the cache, even if entries are stale
+            max_workers (int): Concurrent requests when the server can't batch
+            submit (bool): Whether the code is the student's submission, see
+                ``fetch_driver``
+
+        Returns:
+            list: One validate response per submission, in the same order
+        """
+        responses: List[Optional[dict]] = [None] * len(submissions)
+        entries: List[Optional[CacheEntry]] = [None] * len(submissions)
+        pending = []
+        for i, submission in enumerate(submissions):
+            key = driver_key(
+                submission["tutorial_id"], submission["lesson_id"], submission.get("task_id")
+            )
+            entries[i] = cache.get(key) if cache is not None else None
+            if offline:
+                if submit:
+                    self.queue_submission(
+                        submission["code"],
+                        submission["tutorial_id"],
+                        submission["lesson_id"],
+                        submission.get("task_id"),
+                    )
+                responses[i] = entries[i].value if entries[i] is not None else {
+                    "success": False,
+                    "message": f"No cached driver code for {key}. Run once while online first.",
+                }
+            elif entries[i] is not None and entries[i].is_fresh(cache.ttl):
+                if submit:
+                    self.queue_submission(
+                        submission["code"],
+                        submission["tutorial_id"],
+                        submission["lesson_id"],
+                        submission.get("task_id"),
+                        quiet=True,
+                    )
+                responses[i] = entries[i].value
+            else:
+                pending.append(i)
+
+        if not pending:
+            if submit and not offline:
+                self.flush_outbox_in_background()
+            return responses
+
+        batched = None
+        if self._batch_supported:
+            try:
+                batched = self._validate_batch(
+                    [dict(submissions[i], etag=_etag(entries[i])) for i in pending]
+                )
+            except Exception as e:  # noqa: BLE001
+                logger.info("Batch request failed, retrying individually: %s", e)
+
+        if batched is not None:
+            for i, response in zip(pending, batched):
+                submission = submissions[i]
+                key = driver_key(
+                    submission["tutorial_id"], submission["lesson_id"], submission.get("task_id")
+                )
+                responses[i] = self._store_driver(cache, key, entries[i], response)
+            self.flush_outbox_in_background()
+            return responses
+
+        def fetch(i: int) -> dict:
+            submission = submissions[i]
+            try:
+                return self.fetch_driver(
+                    submission["code"],
+                    submission["tutorial_id"],
+                    submission["lesson_id"],
+                    submission.get("task_id"),
+                    cache=cache,
+                    submit=submit,
+                )
+            except Exception as e:  # noqa: BLE001
+                return {"success": False, "message": str(e)}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for i, response in zip(pending, executor.map(fetch, pending)):
+                responses[i] = response
+        return responses
+
+    def _validate_batch(self, submissions: List[dict]) -> Optional[List[dict]]:
+        """Validate several lessons in one request.
+
+        Returns:
+            list: One response per submission, or None if the server has no
+                batch endpoint
+        """
+        self.check_authenticated()
+
+        data = {
+            "submissions": [
+                {
+                    "student_code": submission["code"],
+                    "tutorialId": submission["tutorial_id"],
+                    "lessonId": submission["lesson_id"],
+                    "taskId": submission.get("task_id"),
+                    "etag": submission.get("etag"),
+                }
+                for submission in submissions
+            ]
+        }
+        url = f"{self.base_url}/{PYTHON_VALIDATE_BATCH_ENDPOINT}"
+        response = self.transport.post(
+            url, json=data, headers=self._get_headers(), idempotent=True
+        )
+        logger.info("%s", self.transport.last_timing)
+
+        if response.status_code in (404, 405, 501):
+            self._batch_supported = False
+            return None
+        response.raise_for_status()
+        return response.json()["results"]
+
+    def queue_submission(
+        self,
+        code: str,
+        tutorial_id: str,
+        lesson_id: str,
+        task_id: Optional[str] = None,
+        error: Optional[str] = None,
+        quiet: bool = False,
+    ):
+        """Record a submission the server didn't receive, to be sent by ``flush_outbox``.
+
+        ``quiet`` skips the notice, for submissions that are sent right away
+        in the background rather than waiting for 'medicode sync'.
+        """
+        with Outbox() as outbox:
+            if outbox.add(code, tutorial_id, lesson_id, task_id, error=error) and not quiet:
+                console.print(
+                    f"[yellow]Queued {tutorial_id}/lesson-{lesson_id} for 'medicode sync'[/yellow]"
+                )
+
+    def flush_outbox(self, batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+        """Send queued submissions in compressed bulk batches.
+
+        Stops at the first batch that fails, leaving it and the rest queued.
+
+        Returns:
+            int: The number of submissions sent
+        """
+        if not Outbox.exists():
+            return 0
+
+        sent = 0
+        with Outbox() as outbox:
+            while True:
+                batch = outbox.claim(batch_size)
+                if not batch:
+                    return sent
+                try:
+                    self._submit_bulk(batch)
+                except Exception as e:
+                    outbox.release(batch, error=str(e))
+                    raise
+                outbox.remove(batch)
+                sent += len(batch)
+
+    def flush_outbox_in_background(self):
+        """Flush the queue on a daemon thread, now that the server is reachable.
+
+        The CLI waits a few seconds on exit for the flush, anything not sent
+        by then stays queued for next time.
+        """
+        if not Outbox.exists():
+            return
+        if self._flush_thread is not None and self._flush_thread.is_alive():
+            return
+
+        def flush():
+            try:
+                self.flush_outbox()
+            except Exception:  # noqa: BLE001
+                pass
+
+        self._flush_thread = threading.Thread(target=flush, daemon=True)
+        self._flush_thread.start()
+        _flush_threads.append(self._flush_thread)
+
+    def _submit_bulk(self, batch: List[QueuedSubmission]):
+        """Send a batch of queued submissions in one gzip-compressed request."""
+        self.check_authenticated()
+        submissions = [submission.to_payload() for submission in batch]
+
+        if self._bulk_supported:
+            url = f"{self.base_url}/{SUBMISSIONS_BULK_ENDPOINT}"
+            # Every submission carries an ID the server deduplicates on
+            response = self.transport.post(
+                url,
+                json={"submissions": submissions},
+                headers=self._get_headers(),
+                idempotent=True,
+                compress=True,
+            )
+            if response.status_code not in (404, 405, 501):
+                response.raise_for_status()
+                return
+            self._bulk_supported = False
+
+        # No bulk endpoint, so fall back to one validate request each
+        for submission in batch:
+            self.validate_code(
+                submission.code, submission.tutorial_id, submission.lesson_id, submission.task_id
+            )
+
+    def health_check(self) -> bool:
+        """Check that the MediCode server is reachable.
+
+        Returns:
+            bool: True if the server responded successfully
+        """
+        import requests
+
+        url = f"{self.base_url}/{HEALTH_CHECK_ENDPOINT}"
+        try:
+            response = self.transport.get(url)
+        except requests.exceptions.RequestException as e:
+            console.print(f"[red]Server unreachable: {e}[/red]")
+            return False
+
+        logger.info("%s", self.transport.last_timing)
+        if response.ok:
+            console.print("[green]Server is up![/green]")
+            return True
+        console.print(f"[red]Server responded with status {response.status_code}[/red]")
+        return False
@@ -0,0 +1,824 @@
+"""Notebook (.ipynb) lessons, run in a persistent Jupyter kernel.
+
+A notebook lesson's code is its code cells in order, and that is what the
+server validates. When jupyter_client and ipykernel are installed, each
+notebook gets a kernel that outlives the CLI, so the modules its cells
+import stay loaded from one run to the next, and only the cells a change
+can affect run again.
+
+Each cell is indexed by the top-level names it mentions, anywhere in its
+code, and which of them it only reads. A changed, added or removed cell
+makes every cell sharing a name with it run again, and so on from those
+cells, before and after it alike: an earlier cell may have built what the
+old version of the cell changed. A name a cell only reads doesn't tie it to
+the cells before it unless a later cell may change that name. The names
+involved are removed from the namespace and those cells run again in
+order, while the rest keep the effects and the saved outputs of the last
+run, which a fresh run would reproduce. Builtins and modules only ever
+imported don't tie cells together. A cell the index can't follow, such as
+one using magics, ``exec`` or ``globals()``, makes the whole namespace reset
+and every cell run again.
+
+The driver tests run in a fork of the kernel, against its namespace, so
+they can't change the state the next run starts from. A kernel shuts
+itself down after NOTEBOOK_KERNEL_IDLE_SECONDS without a run.
+
+Runs are held to the lesson's CPU, memory and process budgets and to the
+output limits, as .py lessons are.
+
+Without jupyter_client the notebook runs from scratch as one script in the
+execution worker, like a .py lesson.
+"""
+
+import ast
+import builtins
+import contextlib
+import difflib
+import hashlib
+import importlib.util
+import json
+import os
+import selectors
+import signal
+import subprocess
+import sys
+import time
+import types
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from . import constants, profiler
+from .capture import BoundedBuffer, BoundedTextIO
+from .executor import ExecutionResult, worker_env
+from .sandbox import CPU_LIMIT, MEMORY_LIMIT, apply_renewable_limits, restore_limits
+
+# Names IPython puts in the kernel's namespace, not the student's
+_IPYTHON_NAMES = frozenset({"In", "Out", "get_ipython", "exit", "quit", "open"})
+
+# Names that can reach any variable, so a cell using them can't be indexed
+_DYNAMIC_NAMES = frozenset(
+    {"exec", "eval", "globals", "locals", "vars", "get_ipython", "__import__", "builtins"}
+)
+
+# Names that don't tie cells together unless a cell assigns them
+_SHARED_NAMES = frozenset(dir(builtins)) | {"display"}
+
+# Builtins that only read their positional arguments and return a new value
+_PURE_CALLS = frozenset(
+    {
+        "abs", "ascii", "bin", "bool", "callable", "chr", "float", "format", "hash",
+        "hex", "id", "int", "isinstance", "len", "oct", "ord", "print", "repr", "round", "str",
+    }
+)
+
+
+@dataclass
+class Cell:
+    index: int
+    source: str
+    # Hash of the cell's source
+    fingerprint: str = ""
+    # Every top-level name the cell mentions, or None if it can't be indexed,
+    # those it only reads the value of, those it assigns or defines and
+    # those it imports
+    names: Optional[FrozenSet[str]] = None
+    reads: FrozenSet[str] = frozenset()
+    assigns: FrozenSet[str] = frozenset()
+    imports: FrozenSet[str] = frozenset()
+
+
+@dataclass
+class CellOutput:
+    stdout: str = ""
+    stderr: str = ""
+    # The traceback and exception name if the cell raised
+    error: Optional[str] = None
+    error_name: Optional[str] = None
+    # The value of the last expression, as text
+    result: Optional[str] = None
+    timed_out: bool = False
+    # The run printed more than OUTPUT_LIMIT_BYTES
+    output_limit_exceeded: bool = False
+
+    def to_dict(self) -> dict:
+        return {"stdout": self.stdout, "stderr": self.stderr, "error": self.error}
+
+
+def _python_source(source: str) -> str:
+    """The cell with IPython magics and shell commands commented out."""
+    return "\n".join(
+        f"# {line}" if line.lstrip().startswith(("%", "!")) else line
+        for line in source.splitlines()
+    )
+
+
+def read_cells(path: Path) -> List[Cell]:
+    """The notebook's non-empty code cells, fingerprinted."""
+    with open(path, encoding="utf-8") as f:
+        notebook = json.load(f)
+    cells = []
+    for cell in notebook.get("cells", []):
+        if cell.get("cell_type") != "code":
+            continue
+        source = cell.get("source", "")
+        if isinstance(source, list):
+            source = "".join(source)
+        if source.strip():
+            cells.append(_index_cell(Cell(len(cells), source)))
+    return cells
+
+
+def _index_cell(cell: Cell) -> Cell:
+    """Fill in the cell's fingerprint and the names it mentions, reads, assigns and imports."""
+    cell.fingerprint = hashlib.sha256(cell.source.encode("utf-8")).hexdigest()
+    if any(line.lstrip().startswith(("%", "!")) for line in cell.source.splitlines()):
+        # Magics and shell commands can do anything
+        return cell
+    try:
+        tree = ast.parse(cell.source)
+    except (SyntaxError, ValueError):
+        return cell
+
+    parents = {child: node for node in ast.walk(tree) for child in ast.iter_child_nodes(node)}
+    names, assigns, imports, changes = set(), set(), set(), set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+            if not isinstance(node.ctx, ast.Load):
+                assigns.add(node.id)
+            if not _only_read(node, parents):
+                changes.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+            assigns.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+            assigns.update(node.names)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name == "*":
+                    return cell
+                name = alias.asname or alias.name.split(".")[0]
+                names.add(name)
+                imports.add(name)
+    if names & _DYNAMIC_NAMES:
+        return cell
+    cell.names = frozenset(names)
+    cell.reads = frozenset(names - changes - assigns - imports)
+    cell.assigns, cell.imports = frozenset(assigns), frozenset(imports)
+    return cell
+
+
+def _only_read(name: ast.Name, parents: dict) -> bool:
+    """Whether this use of a name can't change or keep hold of its value.
+
+    E.g. ``x + 1``, ``print(x[0])`` or ``f"{x.y}"``, but not ``x.append(1)``,
+    ``y = x``, ``f(x)`` or ``for i in x``, which might change it or keep it
+    for later cells to change.
+    """
+    node, parent = name, parents.get(name)
+    while (
+        isinstance(parent, (ast.Attribute, ast.Subscript))
+        and parent.value is node
+        and isinstance(parent.ctx, ast.Load)
+    ):
+        node, parent = parent, parents.get(parent)
+    if isinstance(parent, (ast.BinOp, ast.UnaryOp, ast.FormattedValue, ast.Expr)):
+        return True
+    if isinstance(parent, ast.Compare):
+        # ``in`` consumes iterators
+        return not any(isinstance(op, (ast.In, ast.NotIn)) for op in parent.ops)
+    if isinstance(parent, ast.Subscript):
+        return parent.slice is node
+    if isinstance(parent, ast.Call):
+        return (
+            node in parent.args
+            and isinstance(parent.func, ast.Name)
+            and parent.func.id in _PURE_CALLS
+        )
+    return False
+
+
+def notebook_source(cells: List[Cell]) -> str:
+    """The code cells as one script."""
+    return "\n\n".join(_python_source(cell.source) for cell in cells) + "\n"
+
+
+def kernel_available() -> bool:
+    return all(importlib.util.find_spec(name) for name in ("jupyter_client", "ipykernel"))
+
+
+class Kernel:
+    """The persistent kernel for one notebook, started or reconnected to on demand.
+
+    How to reach it and the outputs of the cells it has run are kept in a
+    state file in NOTEBOOK_KERNEL_DIR, named after the notebook's path.
+    """
+
+    def __init__(self, notebook_path: Path):
+        name = hashlib.sha256(str(notebook_path.resolve()).encode("utf-8")).hexdigest()[:16]
+        self.notebook_path = notebook_path
+        self.state_file = constants.NOTEBOOK_KERNEL_DIR / f"{name}.json"
+        self.client = None
+        # The kernel's pid and connection info, and the index and output of
+        # each cell in the last run, in order
+        self.state: dict = {"pid": None, "cells": []}
+        # Output received in the current run, for the output limit
+        self.output_bytes = 0
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {"pid": None, "cells": []}
+
+    def save_state(self):
+        tmp_path = self.state_file.with_suffix(".tmp")
+        # The connection info holds the kernel's signing key, so only the user may read it
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_file)
+
+    def _alive(self, pid: Optional[int]) -> bool:
+        if not pid:
+            return False
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        return True
+
+    @profiler.profiled("connect to kernel")
+    def connect(self) -> bool:
+        """Connect to the notebook's kernel, starting one if it isn't running.
+
+        Returns:
+            bool: True if a new kernel was started, so every cell has to run
+        """
+        from jupyter_client import BlockingKernelClient, KernelManager
+
+        constants.NOTEBOOK_KERNEL_DIR.mkdir(parents=True, exist_ok=True)
+        state = self._load_state()
+        if self._alive(state.get("pid")) and state.get("connection"):
+            client = BlockingKernelClient()
+            client.load_connection_info(state["connection"])
+            client.start_channels()
+            try:
+                client.wait_for_ready(timeout=constants.NOTEBOOK_KERNEL_START_TIMEOUT)
+                self.client, self.state = client, state
+                return False
+            except RuntimeError:
+                client.stop_channels()
+                self.kill(state.get("pid"))
+
+        manager = KernelManager(kernel_name="python3")
+        # Independent, so the kernel keeps its variables after we exit. Cell
+        # output comes over the kernel's sockets; its own stdout and stderr
+        # mustn't hold on to ours
+        manager.start_kernel(
+            independent=True,
+            env=worker_env(),
+            cwd=str(self.notebook_path.parent),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        provisioner = getattr(manager, "provisioner", None)
+        process = getattr(provisioner, "process", None) or getattr(manager, "kernel", None)
+        self.client = manager.client()
+        self.client.start_channels()
+        self.client.wait_for_ready(timeout=constants.NOTEBOOK_KERNEL_START_TIMEOUT)
+        # jupyter_client deletes its connection file when the manager goes
+        # away, so keep the ports and key ourselves
+        connection = manager.get_connection_info()
+        connection["key"] = connection["key"].decode("ascii")
+        self.state = {"pid": getattr(process, "pid", None), "connection": connection, "cells": []}
+        self.save_state()
+        return True
+
+    def execute(self, code: str, timeout: Optional[float] = None, echo=None) -> CellOutput:
+        """Run code in the kernel and collect what it printed and displayed.
+
+        Only the start and end of the output are kept. Once the run's output
+        goes over OUTPUT_LIMIT_BYTES the cell is abandoned with
+        ``output_limit_exceeded`` set, for the caller to kill the kernel.
+
+        Args:
+            echo (callable, optional): Called with (stream name, text) as output arrives
+        """
+        from queue import Empty
+
+        output = CellOutput()
+        streams = {"stdout": BoundedBuffer(empty=""), "stderr": BoundedBuffer(empty="")}
+
+        def write(name: str, text: str):
+            self.output_bytes += len(text.encode("utf-8"))
+            if self.output_bytes > constants.OUTPUT_LIMIT_BYTES:
+                output.output_limit_exceeded = True
+                return
+            streams[name].write(text)
+            if echo is not None:
+                echo(name, text)
+
+        msg_id = self.client.execute(code, store_history=False, allow_stdin=False)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while not output.output_limit_exceeded:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    output.timed_out = True
+                    return output
+                try:
+                    message = self.client.get_iopub_msg(timeout=remaining)
+                except Empty:
+                    continue
+                if message["parent_header"].get("msg_id") != msg_id:
+                    continue
+                kind, content = message["msg_type"], message["content"]
+                if kind == "stream":
+                    write("stdout" if content["name"] == "stdout" else "stderr", content["text"])
+                elif kind == "clear_output":
+                    streams["stdout"] = BoundedBuffer(empty="")
+                elif kind in ("execute_result", "display_data"):
+                    text = content.get("data", {}).get("text/plain")
+                    if text is None:
+                        continue
+                    if kind == "execute_result":
+                        output.result = text
+                    else:
+                        write("stdout", text + "\n")
+                elif kind == "error":
+                    output.error = "\n".join(content["traceback"])
+                    output.error_name = content.get("ename")
+                    write("stderr", output.error + "\n")
+                elif kind == "status" and content["execution_state"] == "idle":
+                    return output
+            return output
+        finally:
+            output.stdout = streams["stdout"].getvalue()
+            output.stderr = streams["stderr"].getvalue()
+
+    def kill(self, pid: Optional[int] = None):
+        """Stop the kernel, e.g. when a cell doesn't finish in time, and forget its state."""
+        pid = pid or self.state.get("pid")
+        if self._alive(pid):
+            os.kill(pid, signal.SIGKILL)
+        if self.client is not None:
+            self.client.stop_channels()
+            self.client = None
+        if self.state_file.exists():
+            self.state_file.unlink()
+
+    def close(self):
+        if self.client is not None:
+            self.client.stop_channels()
+            self.client = None
+
+
+@dataclass
+class NotebookRun:
+    """What happened to each cell in a run."""
+
+    outputs: List[CellOutput] = field(default_factory=list)
+    executed: List[int] = field(default_factory=list)
+    timed_out: bool = False
+    output_limit_exceeded: bool = False
+
+
+def _saved_entry(cell: Cell, output: Optional[CellOutput] = None) -> dict:
+    """What the state file keeps about a cell, and its output if it ran."""
+    return {
+        "fingerprint": cell.fingerprint,
+        "names": None if cell.names is None else sorted(cell.names),
+        "reads": sorted(cell.reads),
+        "assigns": sorted(cell.assigns),
+        "imports": sorted(cell.imports),
+        "ran": output is not None,
+        **(output or CellOutput()).to_dict(),
+    }
+
+
+def _saved_cell(entry: dict) -> Cell:
+    names = entry.get("names")
+    return Cell(
+        -1,
+        "",
+        entry.get("fingerprint", ""),
+        None if names is None else frozenset(names),
+        frozenset(entry.get("reads", ())),
+        frozenset(entry.get("assigns", ())),
+        frozenset(entry.get("imports", ())),
+    )
+
+
+def plan_rerun(
+    saved: List[dict], cells: List[Cell]
+) -> Optional[Tuple[Set[int], Set[str], Dict[int, dict]]]:
+    """Work out which cells have to run again since the last run, ``saved``.
+
+    Returns:
+        tuple: The indexes of the cells to run, the names to remove from the
+            namespace before they do and the saved entries of the cells to
+            replay, by index. None if every cell has to run again in a fresh
+            namespace
+    """
+    if not saved or not isinstance(saved, list):
+        return None
+    matcher = difflib.SequenceMatcher(
+        None,
+        [entry.get("fingerprint") for entry in saved],
+        [cell.fingerprint for cell in cells],
+        autojunk=False,
+    )
+    replay: Dict[int, dict] = {}
+    rerun: Set[int] = set()
+    # The old versions of changed and removed cells, whose effects are in the namespace
+    undone: List[Cell] = []
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == "equal":
+            for old, new in zip(range(old_start, old_end), range(new_start, new_end)):
+                entry = saved[old]
+                if entry.get("ran") and entry.get("error") is None:
+                    replay[new] = entry
+                    continue
+                # It didn't run, or stopped partway
+                rerun.add(new)
+                if entry.get("ran"):
+                    undone.append(_saved_cell(entry))
+        else:
+            undone.extend(
+                _saved_cell(entry) for entry in saved[old_start:old_end] if entry.get("ran")
+            )
+            rerun.update(range(new_start, new_end))
+
+    changed = undone + [cells[index] for index in rerun]
+    if any(cell.names is None for cell in changed):
+        return None
+    # Builtins and modules that are only ever imported are the same in every
+    # cell, unless a cell assigns them or a changed cell imports them
+    everything = undone + cells
+    shared = (_SHARED_NAMES | set().union(*(cell.imports for cell in everything))) - set().union(
+        *(cell.assigns for cell in everything), *(cell.imports for cell in changed)
+    )
+    # The old versions only need their changes undoing
+    forget = set().union(*(cell.names - cell.reads - shared for cell in undone))
+    for index in rerun:
+        forget |= _to_forget(cells, index, shared)
+    if forget and any(cell.names is None for cell in cells):
+        return None
+
+    # A cell sharing a name with one that runs again has to run again too
+    grew = bool(forget)
+    while grew:
+        grew = False
+        for index in list(replay):
+            if (cells[index].names - shared) & forget:
+                del replay[index]
+                rerun.add(index)
+                forget |= _to_forget(cells, index, shared)
+                grew = True
+    return rerun, forget - _IPYTHON_NAMES, replay
+
+
+def _to_forget(cells: List[Cell], index: int, shared: Set[str]) -> Set[str]:
+    """The names to reset before the cell at ``index`` runs again.
+
+    A name the cell only reads keeps its value, unless a later cell may
+    change it: this cell would see the later cell's change, not the value
+    it had when the cell first ran.
+    """
+    cell = cells[index]
+    changed_later = set().union(*(later.names - later.reads for later in cells[index + 1 :]))
+    return (cell.names - cell.reads | cell.reads & changed_later) - shared
+
+
+def _execute_cells(
+    kernel: Kernel,
+    cells: List[Cell],
+    rerun: Set[int],
+    replay: Dict[int, dict],
+    deadline: Optional[float],
+    echo,
+) -> NotebookRun:
+    """Run the ``rerun`` cells in order and replay the saved outputs of the rest."""
+    run = NotebookRun()
+    saved = []
+    failed = False
+    for cell in cells:
+        if failed:
+            run.outputs.append(CellOutput())
+            saved.append(_saved_entry(cell))
+            continue
+        if cell.index in replay:
+            entry = replay[cell.index]
+            output = CellOutput(entry["stdout"], entry["stderr"])
+            if echo is not None:
+                echo("stdout", output.stdout)
+                echo("stderr", output.stderr)
+        else:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            with profiler.span("run cell", cell=cell.index):
+                output = kernel.execute(cell.source, timeout=remaining, echo=echo)
+            run.executed.append(cell.index)
+            if output.timed_out or output.output_limit_exceeded:
+                run.outputs.append(output)
+                run.timed_out = output.timed_out
+                run.output_limit_exceeded = output.output_limit_exceeded
+                return run
+        run.outputs.append(output)
+        saved.append(_saved_entry(cell, output))
+        failed = output.error is not None
+    kernel.state["cells"] = saved
+    return run
+
+
+def run_cells(
+    kernel: Kernel, cells: List[Cell], deadline: Optional[float] = None, echo=None
+) -> NotebookRun:
+    """Run the cells a change affects, see ``plan_rerun``, and replay the outputs of the rest.
+
+    Cells after one that raised aren't run, as in "Run All" in Jupyter.
+    """
+    plan = plan_rerun(kernel.state.get("cells"), cells)
+    if plan is not None:
+        rerun, forget, replay = plan
+        if forget:
+            kernel.execute(
+                "import medicode_cli.notebook\n"
+                f"medicode_cli.notebook.kernel_forget(get_ipython().user_ns, {sorted(forget)!r})",
+                timeout=5,
+            )
+        run = _execute_cells(kernel, cells, rerun, replay, deadline, echo)
+        failed = next((i for i, output in enumerate(run.outputs) if output.error), None)
+        if failed is None or not any(index > failed for index in replay):
+            return run
+        # The cells after the one that raised wouldn't have run in a fresh
+        # run, but their effects are still in the namespace. Start over,
+        # without showing the output again
+        echo = None
+
+    # Forget the last run's variables, keeping the loaded modules
+    kernel.state["cells"] = []
+    kernel.execute("get_ipython().reset(new_session=False)", timeout=5)
+    return _execute_cells(kernel, cells, set(range(len(cells))), {}, deadline, echo)
+
+
+def _student_module(user_ns: dict, run: str) -> types.ModuleType:
+    """The notebook's namespace as the ``student_code`` module the driver imports."""
+    from medicode_cli import worker
+
+    student_run = json.loads(run)
+    module = types.ModuleType("student_code")
+    module.__dict__.update(
+        {
+            name: value
+            for name, value in user_ns.items()
+            if not name.startswith("_") and name not in _IPYTHON_NAMES
+        }
+    )
+    module.__file__ = student_run.pop("path")
+    student_run["variables"] = worker.summarise_globals(module.__dict__)
+    module.__medicode_run__ = student_run
+    return module
+
+
+def _run_driver(
+    user_ns: dict, run: str, driver_code: str, filename: str, fail_fast: bool
+) -> int:
+    from medicode_cli import worker
+
+    worker.expose_helpers()
+    sys.modules["student_code"] = _student_module(user_ns, run)
+    namespace = {"__name__": "__main__", "__file__": filename, "__builtins__": builtins}
+    returncode, _ = worker.execute_driver(driver_code, filename, namespace, fail_fast)
+    return returncode
+
+
+def kernel_run_driver(
+    user_ns: dict,
+    run: str,
+    driver_code: str,
+    filename: str,
+    fail_fast: bool = False,
+    timeout: Optional[float] = None,
+) -> int:
+    """Run the driver tests in a fork of the kernel against the notebook's namespace.
+
+    Called by the code ``run_notebook`` sends to the kernel. The namespace is
+    exposed to the driver as ``import student_code``, like the worker does
+    for .py lessons. The fork keeps the driver's changes to it out of the
+    kernel and is killed, along with anything it started, after ``timeout``.
+
+    Returns:
+        int: The driver's exit code, or -SIGKILL if it timed out
+    """
+    if not hasattr(os, "fork"):
+        return _run_driver(user_ns, run, driver_code, filename, fail_fast)
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            os.setsid()
+            stdout, stderr = BoundedTextIO(), BoundedTextIO()
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                returncode = _run_driver(user_ns, run, driver_code, filename, fail_fast)
+            data = {
+                "returncode": returncode,
+                "stdout": stdout.getvalue(),
+                "stderr": stderr.getvalue(),
+            }
+            with os.fdopen(write_fd, "w") as f:
+                json.dump(data, f)
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    chunks = []
+    with selectors.DefaultSelector() as selector, os.fdopen(read_fd, "rb", buffering=0) as f:
+        selector.register(f, selectors.EVENT_READ)
+        while True:
+            wait = None if deadline is None else deadline - time.monotonic()
+            if (wait is not None and wait <= 0) or not selector.select(wait):
+                with contextlib.suppress(ProcessLookupError, PermissionError):
+                    os.killpg(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+                print("The tests timed out", file=sys.stderr)
+                return -signal.SIGKILL
+            chunk = f.read(constants.OUTPUT_READ_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    os.waitpid(pid, 0)
+
+    try:
+        data = json.loads(b"".join(chunks))
+    except json.JSONDecodeError:
+        print("The tests exited without a result", file=sys.stderr)
+        return 1
+    sys.stdout.write(data["stdout"])
+    sys.stderr.write(data["stderr"])
+    return data["returncode"]
+
+
+def kernel_forget(user_ns: dict, names: List[str]):
+    """Remove the variables of the cells that are about to run again."""
+    for name in names:
+        user_ns.pop(name, None)
+
+
+def kernel_begin_run(limits: str):
+    """Hold the kernel to the lesson's budgets until ``kernel_end_run``."""
+    kernel_end_run()
+    builtins._medicode_saved_limits = apply_renewable_limits(json.loads(limits))
+
+
+def kernel_end_run():
+    saved = getattr(builtins, "_medicode_saved_limits", None)
+    if saved is not None:
+        restore_limits(saved)
+        del builtins._medicode_saved_limits
+
+
+def kernel_keep_alive(idle_seconds: float):
+    """Shut the kernel down once it has gone ``idle_seconds`` without a run."""
+    import threading
+
+    timer = getattr(builtins, "_medicode_idle_timer", None)
+    if timer is not None:
+        timer.cancel()
+    timer = threading.Timer(idle_seconds, os._exit, args=(0,))
+    timer.daemon = True
+    timer.start()
+    # Kept outside the student's namespace
+    builtins._medicode_idle_timer = timer
+
+
+def _limit_exceeded(output: CellOutput) -> Optional[str]:
+    """CPU_LIMIT or MEMORY_LIMIT if the cell was stopped for going over its budget."""
+    if output.error_name == "CPUTimeExceeded":
+        return CPU_LIMIT
+    if output.error_name == "MemoryError":
+        # Most likely the address space limit rather than a real shortage
+        return MEMORY_LIMIT
+    return None
+
+
+@profiler.profiled("run notebook")
+def run_notebook(
+    notebook_path: Path,
+    driver_code: Optional[str] = None,
+    timeout: Optional[float] = None,
+    stream: bool = False,
+    fail_fast: bool = False,
+    limits: Optional[dict] = None,
+) -> ExecutionResult:
+    """Run a notebook lesson's cells if any changed, then the driver, in its kernel.
+
+    Args:
+        notebook_path (Path): The .ipynb lesson
+        driver_code (str, optional): Combined driver code, which sees the
+            notebook's namespace as ``import student_code``
+        timeout (float, optional): Seconds for the cells and the tests
+            together before the kernel is killed
+        stream (bool): Show the cells' output on our stdout and stderr
+        fail_fast (bool): Stop the driver's test cases at the first failure
+        limits (dict, optional): ``ResourceLimits.to_dict()`` budgets for the run
+
+    Returns:
+        ExecutionResult: The notebook run under ``student``, with every
+            cell's output, and the driver's exit status and output
+    """
+    start = time.perf_counter()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    cells = read_cells(notebook_path)
+    echo = None
+    if stream:
+
+        def echo(name, text):
+            stream_file = sys.stdout if name == "stdout" else sys.stderr
+            stream_file.write(text)
+            stream_file.flush()
+
+    kernel = Kernel(notebook_path)
+    try:
+        kernel.connect()
+        kernel.execute(
+            f"import medicode_cli.notebook\n"
+            f"medicode_cli.notebook.kernel_keep_alive({constants.NOTEBOOK_KERNEL_IDLE_SECONDS})\n"
+            f"medicode_cli.notebook.kernel_begin_run({json.dumps(limits or {})!r})",
+            timeout=constants.NOTEBOOK_KERNEL_START_TIMEOUT,
+        )
+        run = run_cells(kernel, cells, deadline, echo)
+        if run.timed_out or run.output_limit_exceeded:
+            kernel.kill()
+            return ExecutionResult(
+                returncode=-signal.SIGKILL,
+                stdout="",
+                stderr="",
+                timed_out=run.timed_out,
+                output_limit_exceeded=run.output_limit_exceeded,
+                duration=time.perf_counter() - start,
+            )
+        kernel.save_state()
+
+        failed = next((output for output in run.outputs if output.error), None)
+        error = failed.error if failed else None
+        student_run = {
+            "success": error is None,
+            "stdout": "".join(output.stdout for output in run.outputs).strip(),
+            "stderr": "".join(output.stderr for output in run.outputs),
+            "student_code": notebook_source(cells),
+            "executed_cells": run.executed,
+        }
+        limit_exceeded = _limit_exceeded(failed) if failed else None
+        if driver_code is None or limit_exceeded:
+            return ExecutionResult(
+                returncode=0 if error is None else 1,
+                stdout="",
+                stderr="",
+                error=error,
+                student=student_run,
+                duration=time.perf_counter() - start,
+                limit_exceeded=limit_exceeded,
+            )
+
+        filename = str(notebook_path.parent / "<medicode-driver>")
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        with profiler.span("driver tests"):
+            tests = kernel.execute(
+                "import medicode_cli.notebook\n"
+                "medicode_cli.notebook.kernel_run_driver(get_ipython().user_ns, "
+                f"{json.dumps({**student_run, 'path': str(notebook_path)})!r}, "
+                f"{driver_code!r}, {filename!r}, {fail_fast!r}, {remaining!r})",
+                # The driver's fork times out first, this is for a stuck kernel
+                timeout=None if remaining is None else remaining + constants.WORKER_KILL_GRACE,
+            )
+        if tests.timed_out or tests.output_limit_exceeded:
+            kernel.kill()
+        try:
+            returncode = int(tests.result)
+        except (TypeError, ValueError):
+            returncode = 1
+        return ExecutionResult(
+            returncode=returncode,
+            stdout=tests.stdout,
+            stderr=tests.stderr,
+            timed_out=tests.timed_out or returncode == -signal.SIGKILL,
+            output_limit_exceeded=tests.output_limit_exceeded,
+            error=tests.stderr if returncode else None,
+            student=student_run,
+            duration=time.perf_counter() - start,
+        )
+    finally:
+        if kernel.client is not None:
+            kernel.execute(
+                "import medicode_cli.notebook\nmedicode_cli.notebook.kernel_end_run()", timeout=5
+            )
+        kernel.close()
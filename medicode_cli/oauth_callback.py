@@ -0,0 +1,62 @@
+"""The local HTTP handler that receives the OAuth redirect during ``medicode login``.
+
+Kept apart from ``auth`` so that only login pays for importing http.server.
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+
+class OAuthCallbackHandler(BaseHTTPRequestHandler):
+    def __init__(self, *args, **kwargs):
+        self.auth_manager = kwargs.pop("auth_manager")
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        if self.path.startswith("/callback"):
+            query = parse_qs(urlparse(self.path).query)
+
+            # Verify state
+            if query.get("state", [""])[0] != self.auth_manager.state:
+                self.send_response(400)
+                self.send_header("Content-type", "text/html")
+                self.end_headers()
+                self.wfile.write(b"Invalid state parameter")
+                return
+
+            # Get tokens from query parameters
+            access_token = query.get("access_token", [""])[0]
+            refresh_token = query.get("refresh_token", [""])[0]
+            expires_in = int(query.get("expires_in", ["3600"])[0])
+
+            if access_token:
+                # Store tokens
+                self.auth_manager._save_config(
+                    {
+                        "access_token": access_token,
+                        "refresh_token": refresh_token,
+                        "expires_at": time.time() + expires_in,
+                    }
+                )
+
+                # Send success response
+                self.send_response(200)
+                self.send_header("Content-type", "text/html")
+                self.end_headers()
+                self.wfile.write(
+                    b"Authentication successful! You can close this window."
+                )
+
+                # Stop the server
+                threading.Thread(target=self.server.shutdown).start()
+            else:
+                self.send_response(400)
+                self.send_header("Content-type", "text/html")
+                self.end_headers()
+                self.wfile.write(b"Authentication failed")
+
+    def log_message(self, format, *args):
+        # Suppress HTTP server logs
+        pass
@@ -0,0 +1,146 @@
+"""Durable queue of submissions that could not be sent to the server.
+
+Submissions made while offline, or while the server is unreachable, are
+recorded in a SQLite database under ~/.medicode and sent later in bulk by
+``medicode sync`` or in the background once the server is reachable again.
+Each submission is identified by the hash of its lesson and code, so saving
+and re-running unchanged code doesn't queue it twice, and the server can
+discard a submission it already received.
+"""
+
+import hashlib
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from . import constants
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY,
+    submission_id TEXT NOT NULL UNIQUE,
+    code_hash TEXT NOT NULL,
+    tutorial_id TEXT NOT NULL,
+    lesson_id TEXT NOT NULL,
+    task_id TEXT,
+    code TEXT NOT NULL,
+    queued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    claimed_until REAL NOT NULL DEFAULT 0
+)
+"""
+
+
+def code_hash(code: str) -> str:
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class QueuedSubmission:
+    id: int
+    submission_id: str
+    code_hash: str
+    tutorial_id: str
+    lesson_id: str
+    task_id: Optional[str]
+    code: str
+    queued_at: float
+    attempts: int
+
+    def to_payload(self) -> dict:
+        """The submission in the shape of a validate request."""
+        return {
+            "submissionId": self.submission_id,
+            "codeHash": self.code_hash,
+            "student_code": self.code,
+            "tutorialId": self.tutorial_id,
+            "lessonId": self.lesson_id,
+            "taskId": self.task_id,
+            "queuedAt": self.queued_at,
+        }
+
+
+class Outbox:
+    """The queue of unsent submissions, safe to share between CLI processes."""
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path or constants.OUTBOX_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(_SCHEMA)
+
+    @staticmethod
+    def exists(path: Optional[Path] = None) -> bool:
+        """Whether anything was ever queued, without opening the database."""
+        return Path(path or constants.OUTBOX_PATH).exists()
+
+    def add(
+        self,
+        code: str,
+        tutorial_id: str,
+        lesson_id: str,
+        task_id: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> bool:
+        """Queue a submission.
+
+        Returns:
+            bool: False if the same code for the same lesson is already queued
+        """
+        digest = code_hash(code)
+        submission_id = hashlib.sha256(
+            f"{tutorial_id}\0{lesson_id}\0{task_id or ''}\0{digest}".encode("utf-8")
+        ).hexdigest()
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO submissions"
+            " (submission_id, code_hash, tutorial_id, lesson_id, task_id, code, queued_at, last_error)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (submission_id, digest, tutorial_id, lesson_id, task_id, code, time.time(), error),
+        )
+        return cursor.rowcount == 1
+
+    def claim(self, limit: int, lease: float = constants.OUTBOX_CLAIM_LEASE) -> List[QueuedSubmission]:
+        """Take up to ``limit`` of the oldest submissions for sending.
+
+        Claimed submissions are skipped by other processes for ``lease``
+        seconds, or until they are released, so two flushes running at
+        once don't send the same submissions.
+        """
+        now = time.time()
+        rows = self._db.execute(
+            "UPDATE submissions SET claimed_until = ?, attempts = attempts + 1"
+            " WHERE id IN (SELECT id FROM submissions WHERE claimed_until < ? ORDER BY id LIMIT ?)"
+            " RETURNING id, submission_id, code_hash, tutorial_id, lesson_id, task_id, code,"
+            " queued_at, attempts",
+            (now + lease, now, limit),
+        ).fetchall()
+        return sorted((QueuedSubmission(*row) for row in rows), key=lambda s: s.id)
+
+    def remove(self, submissions: List[QueuedSubmission]):
+        """Delete submissions the server has accepted."""
+        self._db.executemany(
+            "DELETE FROM submissions WHERE id = ?", [(s.id,) for s in submissions]
+        )
+
+    def release(self, submissions: List[QueuedSubmission], error: Optional[str] = None):
+        """Put claimed submissions back to be retried later."""
+        self._db.executemany(
+            "UPDATE submissions SET claimed_until = 0, last_error = ? WHERE id = ?",
+            [(error, s.id) for s in submissions],
+        )
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,122 @@
+"""Fetch the tests for the lessons a student is likely to run next.
+
+After a lesson passes, the next command is almost always for the following
+lesson. ``prefetch_in_background`` starts a detached process that fetches
+the driver code for the next few lessons into the driver cache, so their
+first run finds fresh tests and skips the network wait. The process is not
+waited for, so the command exits as soon as it is done, and a failed
+prefetch only means the lesson fetches its tests itself when it runs.
+
+Usage: python -m medicode_cli.prefetch TASK_ID TUTORIAL_ID/LESSON_ID...
+"""
+
+import logging
+import subprocess
+import sys
+from typing import List, Optional
+
+from . import constants, profiler
+from .cache import DriverCache, driver_key
+from .lessons import Lesson, discover_lessons, get_lesson
+
+logger = logging.getLogger(__name__)
+
+
+def upcoming_lessons(lesson: Lesson, count: int = constants.PREFETCH_LESSONS) -> List[Lesson]:
+    """The ``count`` lessons after ``lesson`` in course order, into the next tutorial if need be."""
+    return [
+        other for other in discover_lessons() if other.sort_key > lesson.sort_key
+    ][:count]
+
+
+def stale_lessons(
+    lessons: List[Lesson], task_id: Optional[str], cache: DriverCache
+) -> List[Lesson]:
+    """The lessons without fresh driver code in the cache."""
+    return [
+        lesson
+        for lesson in lessons
+        if cache.get_fresh(driver_key(lesson.tutorial_id, lesson.lesson_id, task_id)) is None
+    ]
+
+
+@profiler.profiled("start prefetch")
+def prefetch_in_background(lesson: Lesson, task_id: Optional[str]) -> Optional[subprocess.Popen]:
+    """Start fetching the tests for the lessons after ``lesson``, without waiting for them.
+
+    Returns:
+        Popen: The detached prefetch process, or None if every upcoming
+            lesson's tests are already cached
+    """
+    lessons = stale_lessons(upcoming_lessons(lesson), task_id, DriverCache())
+    if not lessons:
+        return None
+    from .executor import worker_env
+
+    logger.info("Prefetching tests for %s", ", ".join(lesson.name for lesson in lessons))
+    try:
+        return subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "medicode_cli.prefetch",
+                task_id or "",
+                *(f"{lesson.tutorial_id}/{lesson.lesson_id}" for lesson in lessons),
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env=worker_env(),
+            # Not killed with the CLI's process group when it exits
+            start_new_session=True,
+        )
+    except OSError as e:
+        logger.warning("Could not start prefetching: %s", e)
+        return None
+
+
+def submissions_for(lessons: List[Lesson], task_id: Optional[str]) -> List[dict]:
+    """``fetch_drivers`` submissions for the lessons whose files exist, with their current code."""
+    return [
+        {
+            "code": lesson.read_code(),
+            "tutorial_id": lesson.tutorial_id,
+            "lesson_id": lesson.lesson_id,
+            "task_id": task_id,
+        }
+        for lesson in lessons
+        if lesson.path.exists()
+    ]
+
+
+def prefetch(lessons: List[Lesson], task_id: Optional[str]):
+    """Fetch the lessons' tests into the driver cache in one batched request."""
+    from .medicode_api import MedicodeAPI
+
+    cache = DriverCache()
+    submissions = submissions_for(stale_lessons(lessons, task_id, cache), task_id)
+    if not submissions:
+        return
+    api = MedicodeAPI()
+    if not api.auth_manager.is_authenticated():
+        return
+    # Only the tests are wanted, the lessons' code isn't a submission yet
+    api.fetch_drivers(submissions, cache=cache, submit=False)
+
+
+def main() -> int:
+    from .log import setup_logging
+
+    setup_logging()
+    task_id = sys.argv[1] or None
+    lessons = [get_lesson(*name.split("/", 1)) for name in sys.argv[2:]]
+    try:
+        prefetch(lessons, task_id)
+    except Exception:  # noqa: BLE001
+        logger.warning("Prefetching failed", exc_info=True)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""Static checks that reject a lesson before anything runs or is uploaded.
+
+Running a lesson costs a worker process, a validate request and the driver
+run. Some mistakes are visible in the code itself, so ``check`` looks for
+them in-process first and in a few milliseconds:
+
+- syntax errors
+- names the starter file asks for with ``# Define <name> below`` that the
+  code doesn't define
+- ``while True`` loops whose body can't do anything, such as
+  ``while True: pass``
+
+The loop check only flags what certainly never ends. Any call can raise,
+yield or exit, as can arithmetic, comparisons and reading a name that may
+be unbound, and an exception handler around the loop may be how it stops.
+So only bodies of ``pass``, bare constants and assignments of constants or
+of names bound before the loop count, and loops in a ``try`` are left alone.
+"""
+
+import ast
+import re
+from dataclasses import dataclass
+from typing import FrozenSet, List, Optional, Set
+
+from . import profiler
+from .code_index import MODULE_SCOPE, CodeIndex, build_index
+
+SYNTAX_ERROR = "syntax_error"
+MISSING_NAME = "missing_name"
+INFINITE_LOOP = "infinite_loop"
+
+_REQUIRED_NAME_PATTERN = re.compile(r"^\s*#\s*Define\s+(\w+)\s+below\b", re.MULTILINE)
+
+# try/except* is new in Python 3.11
+_TRY_STATEMENTS = (ast.Try, getattr(ast, "TryStar", ast.Try))
+
+
+@dataclass
+class Problem:
+    kind: str
+    message: str
+    lineno: Optional[int] = None
+
+    def __str__(self) -> str:
+        return f"Line {self.lineno}: {self.message}" if self.lineno else self.message
+
+
+def required_names(source: str) -> List[str]:
+    """The names the starter code asks for in ``# Define <name> below`` comments."""
+    return list(dict.fromkeys(_REQUIRED_NAME_PATTERN.findall(source)))
+
+
+def _defines(index: CodeIndex, name: str) -> bool:
+    """Whether ``name`` is bound at module level, by a def, class, assignment or import."""
+    if index.defines_function(name) or index.assigns(name) or name in index.imports:
+        return True
+    return name in index.classes and index.classes[name]["scope"] == MODULE_SCOPE
+
+
+def _is_constant_true(test: ast.expr) -> bool:
+    return isinstance(test, ast.Constant) and bool(test.value)
+
+
+def _bound_by(statement: ast.stmt) -> Set[str]:
+    """The names a statement has bound once it completes."""
+    if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return {statement.name}
+    if isinstance(statement, (ast.Import, ast.ImportFrom)):
+        return {
+            (alias.asname or alias.name).split(".")[0]
+            for alias in statement.names
+            if alias.name != "*"
+        }
+    if isinstance(statement, ast.Assign):
+        targets = statement.targets
+    elif isinstance(statement, (ast.AugAssign, ast.AnnAssign)) and statement.value is not None:
+        targets = [statement.target]
+    else:
+        return set()
+    return {
+        node.id
+        for target in targets
+        for node in ast.walk(target)
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store)
+    }
+
+
+def _parameters(arguments: ast.arguments) -> Set[str]:
+    parameters = arguments.posonlyargs + arguments.args + arguments.kwonlyargs
+    parameters += [arg for arg in (arguments.vararg, arguments.kwarg) if arg is not None]
+    return {arg.arg for arg in parameters}
+
+
+def _is_inert_value(node: Optional[ast.expr], bound: FrozenSet[str]) -> bool:
+    """Whether evaluating the expression can't raise: a constant or a bound name."""
+    return isinstance(node, ast.Constant) or (isinstance(node, ast.Name) and node.id in bound)
+
+
+def _is_inert(statement: ast.stmt, bound: FrozenSet[str]) -> bool:
+    """Whether the statement is ``pass``, a constant or an assignment of one to names.
+
+    A name that is already bound in ``bound`` may stand in for the constant.
+    """
+    if isinstance(statement, ast.Pass):
+        return True
+    if isinstance(statement, ast.Expr):
+        return isinstance(statement.value, ast.Constant)
+    if isinstance(statement, ast.Assign):
+        return all(isinstance(target, ast.Name) for target in statement.targets) and (
+            _is_inert_value(statement.value, bound)
+        )
+    if isinstance(statement, ast.AnnAssign):
+        # Module and class level annotations are evaluated too
+        return (
+            isinstance(statement.target, ast.Name)
+            and _is_inert_value(statement.value, bound)
+            and _is_inert_value(statement.annotation, bound)
+        )
+    return False
+
+
+def _is_inert_body(body: List[ast.stmt], bound: FrozenSet[str]) -> bool:
+    for statement in body:
+        if not _is_inert(statement, bound):
+            return False
+        bound = bound | _bound_by(statement)
+    return True
+
+
+def _infinite_loops(tree: ast.Module) -> List[Problem]:
+    problems = []
+    # A del anywhere may unbind a name before the loop reads it
+    deleted = {
+        node.id
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Del)
+    }
+
+    def visit(node: ast.AST, in_try: bool, bound: FrozenSet[str]):
+        if (
+            isinstance(node, ast.While)
+            and not in_try
+            and _is_constant_true(node.test)
+            and _is_inert_body(node.body, bound)
+        ):
+            problems.append(
+                Problem(
+                    INFINITE_LOOP,
+                    "This `while True` loop never stops: nothing in it can end the loop",
+                    node.lineno,
+                )
+            )
+        # A new scope only starts out with its parameters bound
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+            bound = frozenset(_parameters(node.args) - deleted)
+        elif isinstance(node, ast.ClassDef):
+            bound = frozenset()
+        for field, value in ast.iter_fields(node):
+            # Only the try body is covered by its handlers
+            guarded = in_try or (
+                isinstance(node, _TRY_STATEMENTS) and field == "body" and bool(node.handlers)
+            )
+            block_bound = bound
+            for child in value if isinstance(value, list) else [value]:
+                if isinstance(child, ast.AST):
+                    visit(child, guarded, block_bound)
+                if isinstance(child, ast.stmt):
+                    # Later statements in the block run after this one has bound its names
+                    block_bound = block_bound | (_bound_by(child) - deleted)
+
+    visit(tree, False, frozenset())
+    return problems
+
+
+@profiler.profiled("preflight")
+def check(source: str) -> List[Problem]:
+    """Everything wrong with ``source`` that can be seen without running it."""
+    try:
+        tree = ast.parse(source)
+    except SyntaxError as e:
+        return [Problem(SYNTAX_ERROR, f"Syntax error: {e.msg}", e.lineno)]
+
+    problems = []
+    names = required_names(source)
+    if names:
+        index = build_index(source, tree)
+        problems += [
+            Problem(MISSING_NAME, f"`{name}` is not defined, the lesson asks you to define it")
+            for name in names
+            if not _defines(index, name)
+        ]
+    problems += _infinite_loops(tree)
+    return problems
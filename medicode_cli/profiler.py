@@ -0,0 +1,227 @@
+"""Phase profiler for a single CLI invocation, enabled with ``medicode --profile``.
+
+Code marks its phases with ``span``:
+
+    with profiler.span("validate_code", lesson="tut-4/lesson-1"):
+        ...
+
+Spans nest per thread. When profiling is off, ``span`` returns a shared
+no-op context manager, so instrumented code pays one global lookup. When it
+is on, the spans are written as a Chrome trace, which chrome://tracing and
+https://ui.perfetto.dev open, and summarised as an indented table.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+_profiler: Optional["Profiler"] = None
+
+
+class _NullSpan:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    """Collects spans from every thread of the process."""
+
+    def __init__(self):
+        self.events: List[dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+        # Spans reported by other processes are timed with the wall clock
+        self._origin_epoch = time.time()
+
+    def _stack(self) -> List[str]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(
+        self,
+        path: Tuple[str, ...],
+        start: float,
+        duration: float,
+        pid: int,
+        tid: int,
+        args: dict,
+        peak_rss_bytes: Optional[int] = None,
+    ):
+        with self._lock:
+            self.events.append(
+                {
+                    "name": path[-1],
+                    "path": path,
+                    "start": start,
+                    "duration": duration,
+                    "pid": pid,
+                    "tid": tid,
+                    "args": args,
+                    "peak_rss_bytes": peak_rss_bytes,
+                }
+            )
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args):
+        stack = self._stack()
+        stack.append(name)
+        path = tuple(stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            self._record(
+                path,
+                start - self._origin,
+                end - start,
+                os.getpid(),
+                threading.get_ident(),
+                args,
+                peak_rss_bytes(),
+            )
+
+    def add_span(
+        self,
+        name: str,
+        start_epoch: float,
+        duration: float,
+        pid: int,
+        peak_rss_bytes: Optional[int] = None,
+        **args,
+    ):
+        """Record a span timed elsewhere, e.g. in a worker process, under the current span."""
+        self._record(
+            tuple(self._stack()) + (name,),
+            start_epoch - self._origin_epoch,
+            duration,
+            pid,
+            pid,
+            args,
+            peak_rss_bytes,
+        )
+
+    def chrome_trace(self) -> dict:
+        """The spans in Chrome's Trace Event Format."""
+        return {
+            "displayTimeUnit": "ms",
+            "traceEvents": [
+                {
+                    "name": event["name"],
+                    "ph": "X",
+                    "ts": event["start"] * 1e6,
+                    "dur": event["duration"] * 1e6,
+                    "pid": event["pid"],
+                    "tid": event["tid"],
+                    "args": _trace_args(event),
+                }
+                for event in self.events
+            ],
+        }
+
+    def write_chrome_trace(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self) -> str:
+        """Total time and count per span, nested under the span that contained it."""
+        totals: Dict[Tuple[str, ...], List[float]] = {}
+        for event in sorted(self.events, key=lambda event: event["start"]):
+            total = totals.setdefault(event["path"], [0.0, 0])
+            total[0] += event["duration"]
+            total[1] += 1
+
+        elapsed = time.perf_counter() - self._origin
+        lines = [f"Profile: {elapsed * 1000:.1f} ms in total"]
+        width = max((len(path) * 2 + len(path[-1]) for path in totals), default=0)
+        # Children directly follow their parent, in order of first appearance
+        for path in sorted(totals, key=lambda path: _first_start(self.events, path)):
+            duration, count = totals[path]
+            label = "  " * len(path) + path[-1]
+            calls = f"  x{count}" if count > 1 else ""
+            lines.append(f"{label:<{width + 2}} {duration * 1000:9.1f} ms{calls}")
+        return "\n".join(lines)
+
+
+def peak_rss_bytes() -> int:
+    """The most memory this process has had resident so far."""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, q: float) -> float:
+    """The ``q``th percentile of ``values``, interpolating between ranks."""
+    values = sorted(values)
+    rank = (len(values) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def _trace_args(event: dict) -> dict:
+    if event["peak_rss_bytes"] is None:
+        return event["args"]
+    return {**event["args"], "peak_rss_bytes": event["peak_rss_bytes"]}
+
+
+def _first_start(events: List[dict], path: Tuple[str, ...]) -> Tuple[float, ...]:
+    """Sort key that keeps every span path right after its ancestors."""
+    return tuple(
+        min(event["start"] for event in events if event["path"][: i + 1] == path[: i + 1])
+        for i in range(len(path))
+    )
+
+
+def enable() -> Profiler:
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def get_profiler() -> Optional[Profiler]:
+    return _profiler
+
+
+def span(name: str, **args):
+    """Time the enclosed block as ``name``, or do nothing if profiling is off."""
+    if _profiler is None:
+        return _NULL_SPAN
+    return _profiler.span(name, **args)
+
+
+def profiled(name: Optional[str] = None):
+    """Decorator that times every call of the function as a span."""
+
+    def decorator(function):
+        label = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return function(*args, **kwargs)
+            with _profiler.span(label):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
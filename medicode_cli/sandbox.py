@@ -0,0 +1,175 @@
+"""Resource budgets for lesson runs and measurement of what a run used.
+
+Each lesson gets a wall-clock timeout plus CPU time, address space and
+process count rlimits, applied in the job process just before the student
+code runs. The validate response may raise or lower them per lesson under a
+``limits`` key, e.g. ``{"cpu_seconds": 20, "memory_mb": 1024}``; anything it
+leaves out uses the defaults from ``constants``.
+"""
+
+import os
+import resource
+import signal
+import time
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from . import constants
+
+# The reason a run was stopped, reported by the job process
+CPU_LIMIT = "cpu"
+MEMORY_LIMIT = "memory"
+
+
+class CPUTimeExceeded(Exception):
+    """Raised in a long-lived process, such as a notebook kernel, that goes over its CPU budget."""
+
+
+@dataclass
+class ResourceLimits:
+    wall_seconds: Optional[float] = constants.LESSON_WALL_SECONDS
+    cpu_seconds: Optional[int] = constants.LESSON_CPU_SECONDS
+    memory_mb: Optional[int] = constants.LESSON_MEMORY_MB
+    max_processes: Optional[int] = constants.LESSON_MAX_PROCESSES
+
+    @classmethod
+    def from_response(cls, response: dict) -> "ResourceLimits":
+        """The defaults, overridden by the ``limits`` in a validate response."""
+        overrides = response.get("limits") or {}
+        limits = cls()
+        for name in asdict(limits):
+            if name in overrides:
+                setattr(limits, name, overrides[name])
+        return limits
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _address_space_bytes() -> int:
+    """The current size of our address space."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[0]) * resource.getpagesize()
+
+
+def _user_process_count() -> int:
+    """Processes owned by our user, which RLIMIT_NPROC counts against."""
+    uid = os.getuid()
+    count = 0
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                count += os.stat(f"/proc/{entry}").st_uid == uid
+            except OSError:
+                pass
+    return count
+
+
+def _set_limit(kind: int, soft: int, hard: Optional[int] = None):
+    """Lower a limit, never above the existing hard limit."""
+    _, current_hard = resource.getrlimit(kind)
+    hard = soft if hard is None else hard
+    if current_hard != resource.RLIM_INFINITY:
+        soft, hard = min(soft, current_hard), min(hard, current_hard)
+    resource.setrlimit(kind, (soft, hard))
+
+
+def apply_limits(limits: dict):
+    """Apply ``ResourceLimits.to_dict()`` rlimits to the current process.
+
+    The memory and process budgets are on top of what the job process
+    already uses: it inherits the preloaded modules' address space, and
+    RLIMIT_NPROC counts every process the user has, not just ours.
+    SIGXCPU is sent at the CPU limit and SIGKILL a second later.
+    """
+    if limits.get("cpu_seconds"):
+        cpu_seconds = int(limits["cpu_seconds"])
+        _set_limit(resource.RLIMIT_CPU, cpu_seconds, cpu_seconds + 1)
+
+    try:
+        if limits.get("memory_mb"):
+            budget = int(limits["memory_mb"]) * 1024 * 1024
+            _set_limit(resource.RLIMIT_AS, _address_space_bytes() + budget)
+        if limits.get("max_processes"):
+            _set_limit(
+                resource.RLIMIT_NPROC, _user_process_count() + int(limits["max_processes"])
+            )
+    except OSError:
+        # No /proc, e.g. on macOS, so there is no baseline to budget from
+        pass
+
+
+def _raise_cpu_time_exceeded(signum, frame):
+    raise CPUTimeExceeded("CPU time limit exceeded")
+
+
+def apply_renewable_limits(limits: dict) -> dict:
+    """Apply ``ResourceLimits.to_dict()`` budgets on top of what this process has used so far.
+
+    For a process that outlives the run, like a notebook kernel: only the
+    soft limits are lowered, so ``restore_limits`` can lift them again once
+    the run is over, and going over the CPU budget raises CPUTimeExceeded
+    in the main thread instead of killing the process.
+
+    Returns:
+        dict: The previous limits and SIGXCPU handler, for ``restore_limits``
+    """
+    saved = {}
+
+    def lower(kind: int, soft: int):
+        saved[kind] = resource.getrlimit(kind)
+        current_soft, hard = saved[kind]
+        for ceiling in (current_soft, hard):
+            if ceiling != resource.RLIM_INFINITY:
+                soft = min(soft, ceiling)
+        resource.setrlimit(kind, (soft, hard))
+
+    if limits.get("cpu_seconds"):
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        saved["sigxcpu"] = signal.signal(signal.SIGXCPU, _raise_cpu_time_exceeded)
+        lower(resource.RLIMIT_CPU, int(own.ru_utime + own.ru_stime) + 1 + int(limits["cpu_seconds"]))
+    try:
+        if limits.get("memory_mb"):
+            budget = int(limits["memory_mb"]) * 1024 * 1024
+            lower(resource.RLIMIT_AS, _address_space_bytes() + budget)
+        if limits.get("max_processes"):
+            lower(resource.RLIMIT_NPROC, _user_process_count() + int(limits["max_processes"]))
+    except OSError:
+        pass
+    return saved
+
+
+def restore_limits(saved: dict):
+    """Undo ``apply_renewable_limits``."""
+    saved = dict(saved)
+    has_handler = "sigxcpu" in saved
+    handler = saved.pop("sigxcpu", None)
+    for kind, limit in saved.items():
+        resource.setrlimit(kind, limit)
+    if has_handler:
+        signal.signal(signal.SIGXCPU, handler or signal.SIG_DFL)
+
+
+def measure_usage(started: float) -> dict:
+    """CPU time, peak memory and wall time of this process and its children so far.
+
+    Args:
+        started (float): ``time.perf_counter()`` when the run started
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "cpu_seconds": own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_bytes": max(own.ru_maxrss, children.ru_maxrss) * 1024,
+        "wall_seconds": time.perf_counter() - started,
+    }
+
+
+def format_usage(usage: Optional[dict]) -> str:
+    if not usage:
+        return ""
+    return (
+        f"{usage['wall_seconds']:.2f}s wall, {usage['cpu_seconds']:.2f}s CPU, "
+        f"{usage['peak_rss_bytes'] / (1024 * 1024):.1f} MB peak memory"
+    )
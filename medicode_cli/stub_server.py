@@ -0,0 +1,227 @@
+"""A local stand-in for the MediCode API, for benchmarks and load tests.
+
+It serves canned driver code from the validate endpoints, so the real CLI
+code paths can be exercised end to end without the course server:
+
+    with StubServer() as server:
+        env = {**os.environ, "MEDICODE_BASE_URL": server.base_url}
+        subprocess.run(["medicode", "python", ...], env=env)
+
+Driver code is looked up by ``(tutorial_id, lesson_id)`` in ``drivers``,
+falling back to ``default_driver``. Responses carry an ETag, so the CLI's
+driver cache behaves as it does against the real server.
+"""
+
+import gzip
+import hashlib
+import json
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, List, Optional, Tuple
+
+from .constants import (
+    HEALTH_CHECK_ENDPOINT,
+    PYTHON_VALIDATE_BATCH_ENDPOINT,
+    PYTHON_VALIDATE_CODE_ENDPOINT,
+    SUBMISSIONS_BULK_ENDPOINT,
+)
+
+API_PREFIX = "/api/medicode-cli"
+
+# Runs the student code and shows what the driver saw, like a real driver
+DEFAULT_DRIVER = """
+result = run_student_code(student_code.__file__)
+print("Student output:", len(result["stdout"]), "characters")
+print("Variables:", ", ".join(sorted(result["variables"])))
+"""
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "_Server"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self) -> dict:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return json.loads(body) if body else {}
+
+    def _send_json(self, status: int, data: Optional[dict] = None, headers: Optional[dict] = None):
+        body = json.dumps(data).encode("utf-8") if data is not None else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if data is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _endpoint(self) -> Optional[str]:
+        path = self.path.split("?", 1)[0]
+        if not path.startswith(API_PREFIX + "/"):
+            return None
+        return path[len(API_PREFIX) + 1 :]
+
+    def do_GET(self):
+        endpoint = self._endpoint()
+        self.server.stub.record(endpoint)
+        failure = self.server.stub.take_failure(endpoint)
+        if failure is not None:
+            self._send_json(failure, {"error": "Injected failure"})
+        elif endpoint == HEALTH_CHECK_ENDPOINT:
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        endpoint = self._endpoint()
+        self.server.stub.record(endpoint)
+        stub = self.server.stub
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        failure = stub.take_failure(endpoint)
+        if failure is not None:
+            # Read the body anyway, so the kept-alive connection stays usable
+            self._read_json()
+            self._send_json(failure, {"error": "Injected failure"})
+            return
+        if endpoint not in (
+            PYTHON_VALIDATE_CODE_ENDPOINT,
+            PYTHON_VALIDATE_BATCH_ENDPOINT,
+            SUBMISSIONS_BULK_ENDPOINT,
+        ):
+            self._send_json(404, {"error": "Not found"})
+            return
+        if not self.headers.get("Authorization"):
+            self._send_json(401, {"error": "Not authenticated"})
+            return
+        data = self._read_json()
+
+        if endpoint == PYTHON_VALIDATE_CODE_ENDPOINT:
+            if "student_code" not in data:
+                # Deltas need the code from an earlier request, send everything
+                self._send_json(409, {"error": "Unknown base"})
+                return
+            driver_code, etag = stub.driver_for(data.get("tutorialId"), data.get("lessonId"))
+            if self.headers.get("If-None-Match") == etag:
+                self._send_json(304, headers={"ETag": etag})
+                return
+            self._send_json(200, _validate_response(driver_code), headers={"ETag": etag})
+        elif endpoint == PYTHON_VALIDATE_BATCH_ENDPOINT:
+            results = []
+            for submission in data.get("submissions", []):
+                driver_code, etag = stub.driver_for(
+                    submission.get("tutorialId"), submission.get("lessonId")
+                )
+                if submission.get("etag") == etag:
+                    results.append({"success": True, "not_modified": True, "etag": etag})
+                else:
+                    results.append({**_validate_response(driver_code), "etag": etag})
+            self._send_json(200, {"results": results})
+        else:
+            submissions = data.get("submissions", [])
+            stub.accept(submissions)
+            self._send_json(200, {"accepted": len(submissions)})
+
+
+def _validate_response(driver_code: str) -> dict:
+    return {"success": True, "code_components": {"driver_code": driver_code}}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    stub: "StubServer"
+
+    def handle_error(self, request, client_address):
+        # Clients that gave up waiting are expected under load
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubServer:
+    """The stand-in API, serving on a free local port on a background thread.
+
+    Args:
+        drivers (dict, optional): Driver code by ``(tutorial_id, lesson_id)``
+        default_driver (str): Driver code for any other lesson
+        latency (float): Seconds each POST waits before answering, to model
+            the real server's processing time
+
+    ``requests`` counts the requests per endpoint and ``submissions`` holds
+    every submission received in bulk. ``fail`` makes the next requests to
+    an endpoint fail, to exercise the client's retries.
+    """
+
+    def __init__(
+        self,
+        drivers: Optional[Dict[Tuple[str, str], str]] = None,
+        default_driver: str = DEFAULT_DRIVER,
+        latency: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.drivers = dict(drivers or {})
+        self.default_driver = default_driver
+        self.latency = latency
+        self.requests: Counter = Counter()
+        self.submissions: List[dict] = []
+        self._failures: Dict[str, Deque[int]] = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._httpd = _Server((host, port), _Handler)
+        self._httpd.stub = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def driver_for(self, tutorial_id: str, lesson_id: str) -> Tuple[str, str]:
+        """The driver code for a lesson and its ETag."""
+        driver_code = self.drivers.get((tutorial_id, str(lesson_id)), self.default_driver)
+        etag = '"' + hashlib.sha256(driver_code.encode("utf-8")).hexdigest()[:16] + '"'
+        return driver_code, etag
+
+    def record(self, endpoint: Optional[str]):
+        with self._lock:
+            self.requests[endpoint or "unknown"] += 1
+
+    def accept(self, submissions: List[dict]):
+        with self._lock:
+            self.submissions.extend(submissions)
+
+    def fail(self, endpoint: str, status: int = 503, times: int = 1):
+        """Answer the next ``times`` requests to ``endpoint`` with ``status``."""
+        with self._lock:
+            self._failures[endpoint].extend([status] * times)
+
+    def take_failure(self, endpoint: Optional[str]) -> Optional[int]:
+        """The status to fail this request with, if a failure is pending."""
+        with self._lock:
+            pending = self._failures.get(endpoint)
+            return pending.popleft() if pending else None
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
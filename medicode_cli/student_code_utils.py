@@ -2,6 +2,7 @@
 
 # ~~~START CONFIG~~~
 import ast
+import functools
 import io
 import json
 import os
@@ -12,7 +13,10 @@ import time
 import traceback
 from pathlib import Path
 
-from dev_utils import debug_print, DEBUG
+from medicode_cli.dev_utils import debug_print, DEBUG
+from medicode_cli.capture import run_bounded
+from medicode_cli.code_index import CodeIndex, index_source
+from medicode_cli.test_cases import test_case
 
 # ~~~END CONFIG~~~
 
@@ -20,15 +24,21 @@ from dev_utils import debug_print, DEBUG
 
 def run_student_code(student_code_path: str, timeout: int = 5, ):
     """Execute student code as a subprocess and analyze using AST"""
-    debug_print(f"Starting run_student_code with file: {student_code_path}")
+    debug_print("Starting run_student_code with file: %s", student_code_path)
     start_time = time.time()
 
+    # The medicode worker has already run the student code once; reuse that run
+    captured_run = getattr(sys.modules.get("student_code"), "__medicode_run__", None)
+    if captured_run is not None:
+        debug_print("Reusing the captured student code run")
+        return dict(captured_run)
+
     # Path to student code
     student_file = Path(student_code_path)
-    debug_print(f"Student file path: {student_file.absolute()}")
+    debug_print("Student file path: %s", student_file)
     
     if not student_file.exists():
-        debug_print(f"ERROR: Student file does not exist: {student_file.absolute()}")
+        debug_print("ERROR: Student file does not exist: %s", student_file)
         return {
             "success": False,
             "stdout": "",
@@ -38,7 +48,7 @@ def run_student_code(student_code_path: str, timeout: int = 5, ):
 
     # Extract the student code section from the combined file
     combined_content = student_file.read_text()
-    debug_print(f"File size: {len(combined_content)} bytes")
+    debug_print("File size: %d bytes", len(combined_content))
     
     # Extract student code portion (between # <STUDENT_CODE> and # </STUDENT_CODE>)
     student_code_match = re.search(r"# <STUDENT_CODE>\n(.*?)\n# </STUDENT_CODE>", 
@@ -46,39 +56,35 @@ def run_student_code(student_code_path: str, timeout: int = 5, ):
     
     if student_code_match:
         student_code = student_code_match.group(1)
-        debug_print(f"Extracted student code portion: {len(student_code)} bytes")
+        debug_print("Extracted student code portion: %d bytes", len(student_code))
     else:
         student_code = combined_content
         debug_print("Could not find student code markers, using entire file")
 
     # Run the student code as a subprocess
     try:
-        debug_print(f"Executing student code with subprocess: {student_file}")
-        result = subprocess.run(
+        debug_print("Executing student code with subprocess: %s", student_file)
+        # Only the start and end of the output are kept, and a runaway
+        # program is killed once it prints too much
+        result = run_bounded(
             ["python", str(student_file)],
-            capture_output=True,
-            text=True,
-            timeout=5  # Add a timeout to prevent infinite loops
+            timeout=timeout  # Add a timeout to prevent infinite loops
         )
+        if result.timed_out:
+            raise subprocess.TimeoutExpired(str(student_file), timeout)
         
         stdout = result.stdout
         stderr = result.stderr
+        if result.limit_exceeded:
+            stderr += "\nYour code printed too much output and was stopped. It might contain an infinite loop."
         
-        # Parse the student code using AST to extract defined variables
-        debug_print("Parsing student code with AST")
-        parsed_ast = ast.parse(student_code)
-        
-        # Extract top-level variables and their types
-        variables = {}
-        for node in parsed_ast.body:
-            if isinstance(node, ast.Assign):
-                for target in node.targets:
-                    if isinstance(target, ast.Name):
-                        var_name = target.id
-                        # We can only identify the variable name, not its value with static AST
-                        variables[var_name] = {"type": "unknown"}
+        # Look up the top-level variables in the cached analysis of the code
+        debug_print("Indexing student code")
+        index = get_code_index(student_code)
+        # We can only identify the variable name, not its value with static AST
+        variables = {name: {"type": "unknown"} for name in index.top_level_variables()}
         
-        debug_print(f"Execution completed in {time.time() - start_time:.2f} seconds")
+        debug_print("Execution completed in %.2f seconds", time.time() - start_time)
         
         return {
             "success": result.returncode == 0,
@@ -97,8 +103,7 @@ def run_student_code(student_code_path: str, timeout: int = 5, ):
             "student_code": student_code,
         }
     except Exception as e:
-        debug_print(f"Exception during execution: {type(e).__name__}: {str(e)}")
-        debug_print(traceback.format_exc())
+        debug_print("Exception during execution: %s: %s", type(e).__name__, e, exc_info=True)
         
         return {
             "success": False,
@@ -109,21 +114,110 @@ def run_student_code(student_code_path: str, timeout: int = 5, ):
         }
 
 
+def get_code_index(student_code: str) -> CodeIndex:
+    """Get the structural index of the student code, parsed once per version of the code"""
+    return index_source(student_code)
+
+
+# Characters that make a pattern more than a plain substring
+_REGEX_METACHARACTERS = frozenset(".^$*+?{}[]\\|()")
+
+
+@functools.lru_cache(maxsize=512)
+def _compile_pattern(pattern: str) -> re.Pattern:
+    return re.compile(pattern)
+
+
+def _pattern_found(pattern: str, text: str) -> bool:
+    """Whether the pattern occurs in the text"""
+    if not _REGEX_METACHARACTERS.intersection(pattern):
+        # Plain text, so skip the regex engine
+        return pattern in text
+    return _compile_pattern(pattern).search(text) is not None
+
+
+# A pattern that refers to its own groups can't be combined with others
+_GROUP_REFERENCE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(|^\(\?[aiLmsux]+\)")
+
+
+@functools.lru_cache(maxsize=512)
+def _compile_alternation(patterns: tuple):
+    """All the patterns as one regex with a named group each, or None if they can't be combined"""
+    if any(_GROUP_REFERENCE.search(pattern) for pattern in patterns):
+        return None
+    try:
+        return re.compile("|".join(f"(?P<p{i}>{pattern})" for i, pattern in enumerate(patterns)))
+    except re.error:
+        return None
+
+
+def find_failed_checks(text: str, checks: list) -> list:
+    """Return the message of every (pattern, message) check whose pattern is not in the text
+
+    The patterns are searched for together in one pass over the text, which
+    stops as soon as every one has been seen. A match consumes the text it
+    covers, so a pattern that overlaps another's match may be missed by the
+    pass; only those are then searched for on their own.
+    """
+    patterns = tuple(dict.fromkeys(pattern for pattern, _ in checks))
+    found = set()
+    combined = _compile_alternation(patterns)
+    if combined is not None:
+        for match in combined.finditer(text):
+            found.add(patterns[int(match.lastgroup[1:])])
+            if len(found) == len(patterns):
+                break
+    found.update(
+        pattern for pattern in patterns if pattern not in found and _pattern_found(pattern, text)
+    )
+    failures = [message for pattern, message in checks if pattern not in found]
+    debug_print("Checked %d patterns, %d failed", len(checks), len(failures))
+    return failures
+
+
+def check_text_has_patterns(text: str, checks: list) -> bool:
+    """Check that the text, e.g. stdout or student_code, matches every (pattern, message) check
+
+    Unlike separate asserts, every failing check is reported, one message per line
+    """
+    failures = find_failed_checks(text, checks)
+    assert not failures, "\n".join(failures)
+
+
 def check_std_has_expected_output(std: str, expected_output: str, error_message: str) -> bool:
     """Check if the stderr or stdout contains the expected output"""
-    if DEBUG:
-        debug_print(f"Checking if '{expected_output}' is in '{std}'")
-    match = re.search(expected_output, std) is not None
-    if DEBUG:
-        debug_print(f"Match result: {match}")
+    debug_print("Checking if %r is in %r", expected_output, std)
+    match = _pattern_found(expected_output, std)
+    debug_print("Match result: %s", match)
     assert match, error_message
 
 
 def check_student_code_has_pattern(student_code: str, pattern: str, error_message: str) -> bool:
     """Check if the student_code contains the pattern"""
-    if DEBUG:
-        debug_print(f"Checking if pattern '{pattern}' exists in student code")
-    match = re.search(pattern, student_code) is not None
-    if DEBUG:
-        debug_print(f"Match result: {match}")
+    debug_print("Checking if pattern %r exists in student code", pattern)
+    match = _pattern_found(pattern, student_code)
+    debug_print("Match result: %s", match)
+    assert match, error_message
+
+
+def check_student_code_assigns(student_code: str, name: str, error_message: str) -> bool:
+    """Check if the student_code assigns the variable at the top level"""
+    match = get_code_index(student_code).assigns(name)
+    debug_print("Checking if %r is assigned: %s", name, match)
+    assert match, error_message
+
+
+def check_student_code_defines_function(
+    student_code: str, function_name: str, error_message: str, args: list = None
+) -> bool:
+    """Check if the student_code defines the function, optionally with these arguments"""
+    match = get_code_index(student_code).defines_function(function_name, args)
+    debug_print("Checking if function %r is defined: %s", function_name, match)
+    assert match, error_message
+
+
+def check_student_code_calls(student_code: str, function_name: str, error_message: str) -> bool:
+    """Check if the student_code calls the function, e.g. 'print' or 'math.sqrt'"""
+    match = get_code_index(student_code).calls_function(function_name)
+    debug_print("Checking if %r is called: %s", function_name, match)
     assert match, error_message
@@ -0,0 +1,298 @@
+"""Independent driver test cases, run concurrently against the student's run.
+
+A driver can declare its checks as separate test cases instead of a single
+script of asserts:
+
+    @test_case
+    def prints_the_mean():
+        check_std_has_expected_output(run["stdout"], "Mean: 3", "Print the mean")
+
+    @test_case("mean is a float", timeout=2)
+    def mean_type():
+        assert isinstance(student_code.mean, float), "mean should be a float"
+
+Once the driver's top-level code has run, ``run_declared`` forks a process
+per case from the job process, a few at a time. Each case therefore starts
+from the same snapshot of the student module and can't affect the others.
+Every case is reported, not just the first failure, unless ``fail_fast``
+is set, in which case the first failure stops the cases still running and
+skips the rest. A case without its own timeout gets
+``constants.TEST_CASE_TIMEOUT_SECONDS``.
+"""
+
+import contextlib
+import json
+import os
+import selectors
+import signal
+import sys
+import time
+import traceback
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional
+
+from . import constants
+from .capture import BoundedTextIO
+
+PASSED = "passed"
+FAILED = "failed"
+ERROR = "error"
+TIMEOUT = "timeout"
+SKIPPED = "skipped"
+
+_SYMBOLS = {PASSED: "✓", FAILED: "✗", ERROR: "✗", TIMEOUT: "✗", SKIPPED: "-"}
+
+
+@dataclass
+class TestCase:
+    name: str
+    function: Callable[[], None]
+    timeout: Optional[float] = None
+
+
+@dataclass
+class CaseResult:
+    name: str
+    status: str
+    message: str = ""
+    traceback: Optional[str] = None
+    stdout: str = ""
+    duration: float = 0.0
+
+    @property
+    def passed(self) -> bool:
+        return self.status == PASSED
+
+
+_registry: List[TestCase] = []
+
+
+def test_case(name=None, timeout: Optional[float] = None):
+    """Declare a driver function as an independent test case.
+
+    Usable bare, ``@test_case``, or with a name and a timeout in seconds,
+    ``@test_case("prints the mean", timeout=2)``. The function takes no
+    arguments and fails by raising, usually an AssertionError.
+    """
+    if callable(name):
+        _registry.append(TestCase(name.__name__, name, timeout))
+        return name
+
+    def register(function):
+        _registry.append(TestCase(name or function.__name__, function, timeout))
+        return function
+
+    return register
+
+
+def collect() -> List[TestCase]:
+    """Take the declared test cases, leaving the registry empty for the next driver."""
+    cases = list(_registry)
+    _registry.clear()
+    return cases
+
+
+def _run_case(case: TestCase) -> CaseResult:
+    stdout = BoundedTextIO()
+    start = time.perf_counter()
+    result = CaseResult(case.name, PASSED)
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stdout):
+        try:
+            case.function()
+        except AssertionError as e:
+            result.status = FAILED
+            result.message = str(e) or "Assertion failed"
+            result.traceback = traceback.format_exc()
+        except BaseException as e:  # noqa: BLE001
+            result.status = ERROR
+            result.message = f"{type(e).__name__}: {e}"
+            result.traceback = traceback.format_exc()
+    result.stdout = stdout.getvalue()
+    result.duration = time.perf_counter() - start
+    return result
+
+
+def _detach_stdio():
+    """Point stdin, stdout and stderr at /dev/null.
+
+    The case's own output is captured in-process. Left open, the inherited
+    output pipes would keep the parent waiting on a case that outlives its job.
+    """
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for target in (0, 1, 2):
+        os.dup2(devnull, target)
+    os.close(devnull)
+
+
+def _fork_case(case: TestCase):
+    """Start the case in a child process, returning its pid and the read end of its result pipe."""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        # The job process's handler reports on the job's result pipe
+        signal.signal(signal.SIGXCPU, signal.SIG_DFL)
+        with contextlib.suppress(OSError):
+            _detach_stdio()
+        try:
+            data = json.dumps(asdict(_run_case(case)), default=repr).encode("utf-8")
+            with os.fdopen(write_fd, "wb") as f:
+                f.write(data)
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    return pid, read_fd
+
+
+def run_test_cases(
+    cases: List[TestCase],
+    fail_fast: bool = False,
+    max_workers: int = constants.TEST_CASE_WORKERS,
+) -> List[CaseResult]:
+    """Run each case in a process of its own, at most ``max_workers`` at once.
+
+    Returns:
+        list: A CaseResult per case, in the order they were declared
+    """
+    if not hasattr(os, "fork"):
+        return _run_in_process(cases, fail_fast)
+
+    results: Dict[int, CaseResult] = {}
+    pending = deque(enumerate(cases))
+    # Keyed by the read end of each running case's result pipe
+    running: Dict[int, dict] = {}
+    selector = selectors.DefaultSelector()
+    stopping = False
+
+    def finish(fd: int, result: CaseResult):
+        nonlocal stopping
+        state = running.pop(fd)
+        selector.unregister(fd)
+        os.close(fd)
+        with contextlib.suppress(ChildProcessError):
+            os.waitpid(state["pid"], 0)
+        results[state["index"]] = result
+        if fail_fast and not result.passed:
+            stopping = True
+
+    try:
+        while pending or running:
+            while pending and not stopping and len(running) < max_workers:
+                index, case = pending.popleft()
+                pid, fd = _fork_case(case)
+                deadline = time.monotonic() + _timeout(case)
+                running[fd] = {
+                    "index": index,
+                    "case": case,
+                    "pid": pid,
+                    "start": time.perf_counter(),
+                    "deadline": deadline,
+                    "data": b"",
+                }
+                selector.register(fd, selectors.EVENT_READ)
+
+            if stopping:
+                for fd, state in list(running.items()):
+                    _kill(state["pid"])
+                    finish(fd, CaseResult(state["case"].name, SKIPPED, "Stopped after a failure"))
+                while pending:
+                    index, case = pending.popleft()
+                    results[index] = CaseResult(case.name, SKIPPED, "Skipped after a failure")
+                break
+
+            deadlines = [state["deadline"] for state in running.values()]
+            wait = max(0.0, min(deadlines) - time.monotonic()) if deadlines else 0.0
+            for key, _ in selector.select(wait):
+                state = running[key.fd]
+                chunk = os.read(key.fd, constants.OUTPUT_READ_SIZE)
+                if chunk:
+                    state["data"] += chunk
+                    continue
+                try:
+                    result = CaseResult(**json.loads(state["data"]))
+                except (json.JSONDecodeError, TypeError):
+                    # The process died before reporting, e.g. it ran out of memory
+                    result = CaseResult(
+                        state["case"].name,
+                        ERROR,
+                        "The test case exited without a result",
+                        duration=time.perf_counter() - state["start"],
+                    )
+                finish(key.fd, result)
+
+            now = time.monotonic()
+            for fd, state in list(running.items()):
+                if now >= state["deadline"]:
+                    _kill(state["pid"])
+                    finish(
+                        fd,
+                        CaseResult(
+                            state["case"].name,
+                            TIMEOUT,
+                            f"Timed out after {_timeout(state['case'])}s",
+                            duration=time.perf_counter() - state["start"],
+                        ),
+                    )
+    finally:
+        for fd, state in list(running.items()):
+            _kill(state["pid"])
+            finish(fd, CaseResult(state["case"].name, SKIPPED, "Interrupted"))
+        selector.close()
+
+    return [results[index] for index in range(len(cases))]
+
+
+def _timeout(case: TestCase) -> float:
+    return case.timeout or constants.TEST_CASE_TIMEOUT_SECONDS
+
+
+def _run_in_process(cases: List[TestCase], fail_fast: bool) -> List[CaseResult]:
+    """One after another in this process, where fork isn't available."""
+    results = []
+    for case in cases:
+        if fail_fast and results and not results[-1].passed:
+            results.append(CaseResult(case.name, SKIPPED, "Skipped after a failure"))
+        else:
+            results.append(_run_case(case))
+    return results
+
+
+def _kill(pid: int):
+    with contextlib.suppress(ProcessLookupError):
+        os.kill(pid, signal.SIGKILL)
+
+
+def print_results(results: List[CaseResult], stream=None):
+    """One line per case with its outcome, then the totals."""
+    stream = stream or sys.stdout
+    for result in results:
+        line = f"{_SYMBOLS[result.status]} {result.name}"
+        if result.status != PASSED:
+            line += f": {result.message}"
+        stream.write(f"{line} ({result.duration:.2f}s)\n")
+        for output_line in result.stdout.splitlines():
+            stream.write(f"    {output_line}\n")
+    counts = {}
+    for result in results:
+        counts[result.status] = counts.get(result.status, 0) + 1
+    stream.write(", ".join(f"{count} {status}" for status, count in counts.items()) + "\n")
+
+
+def run_declared(fail_fast: bool = False):
+    """Run the test cases the driver declared, if it declared any.
+
+    Returns:
+        tuple: The exit code and, if a case didn't pass, the first failure's
+            traceback, or None without test cases
+    """
+    cases = collect()
+    if not cases:
+        return None
+    results = run_test_cases(cases, fail_fast=fail_fast)
+    print_results(results)
+    failures = [result for result in results if result.status not in (PASSED, SKIPPED)]
+    if not failures:
+        return 0, None
+    first = failures[0]
+    return 1, first.traceback or f"{first.name}: {first.message}"
@@ -0,0 +1,300 @@
+"""Shared HTTP transport used by the MediCode API client.
+
+A single long-lived ``requests.Session`` is kept per process so that repeated
+requests reuse pooled keep-alive connections instead of paying a fresh TCP
+connect each time. Transient failures are retried with bounded exponential
+backoff, and every request records how long was spent connecting, waiting
+for the server and transferring the body.
+"""
+
+import collections
+import gzip
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import Deque, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+from . import constants, profiler
+
+# Methods that are safe to send twice
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+# Connect time is accumulated per thread while a request is in flight
+_connect_timer = threading.local()
+
+
+def _never_sent(exc: Exception) -> bool:
+    """Whether a failed request is known not to have reached the server."""
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class _TimedConnectMixin:
+    """Record how long establishing a new connection takes."""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            elapsed = time.perf_counter() - start
+            _connect_timer.elapsed = getattr(_connect_timer, "elapsed", 0.0) + elapsed
+
+
+class _TimedHTTPConnection(_TimedConnectMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools use connections that report connect time."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+@dataclass
+class RequestTiming:
+    """Timing breakdown for a single HTTP request, in seconds."""
+
+    method: str
+    url: str
+    status: Optional[int] = None
+    attempts: int = 0
+    connect: float = 0.0  # Establishing new connections (0 when reused)
+    wait: float = 0.0  # Sending the request and waiting for the headers
+    transfer: float = 0.0  # Reading the response body
+    backoff: float = 0.0  # Sleeping between retries
+    total: float = 0.0
+    sent_bytes: int = 0  # Request body as sent, after any compression
+
+    def __str__(self) -> str:
+        return self.summary()
+
+    def summary(self) -> str:
+        return (
+            f"{self.method} {self.url} -> {self.status} "
+            f"(attempts={self.attempts}, connect={self.connect * 1000:.1f}ms, "
+            f"wait={self.wait * 1000:.1f}ms, transfer={self.transfer * 1000:.1f}ms, "
+            f"backoff={self.backoff * 1000:.1f}ms, total={self.total * 1000:.1f}ms, "
+            f"sent={self.sent_bytes}B)"
+        )
+
+
+@dataclass
+class Transport:
+    """Pooled, keep-alive HTTP transport with retries and timings."""
+
+    pool_connections: int = constants.HTTP_POOL_CONNECTIONS
+    pool_maxsize: int = constants.HTTP_POOL_MAXSIZE
+    connect_timeout: float = constants.HTTP_CONNECT_TIMEOUT
+    read_timeout: float = constants.HTTP_READ_TIMEOUT
+    max_retries: int = constants.HTTP_MAX_RETRIES
+    backoff_factor: float = constants.HTTP_BACKOFF_FACTOR
+    backoff_max: float = constants.HTTP_BACKOFF_MAX
+    retry_statuses: tuple = constants.HTTP_RETRY_STATUSES
+    compress_requests: bool = constants.HTTP_COMPRESS_REQUESTS
+    compress_min_bytes: int = constants.HTTP_COMPRESS_MIN_BYTES
+    timings_kept: int = constants.HTTP_TIMINGS_KEPT
+
+    def __post_init__(self):
+        self.session = requests.Session()
+        # Retries are handled in request() so they can be timed and gated
+        # on idempotency, so the adapter itself never retries
+        adapter = _TimedHTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=0,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Connection"] = "keep-alive"
+        # Ask for compressed responses, which requests decodes transparently
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        # The most recent timings from every thread, oldest dropped first
+        self.timings: Deque[RequestTiming] = collections.deque(maxlen=self.timings_kept)
+        self._timings_lock = threading.Lock()
+        # Each thread's own last request, see last_timing
+        self._thread_timing = threading.local()
+        # Hosts known to refuse gzip request bodies, also kept in the ServerCache
+        self._no_gzip_hosts = set()
+
+    def _backoff(self, attempt: int) -> float:
+        """Seconds to sleep before retry number ``attempt`` (1-based)."""
+        return min(self.backoff_max, self.backoff_factor * (2 ** (attempt - 1)))
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        idempotent: Optional[bool] = None,
+        compress: Optional[bool] = None,
+        **kwargs,
+    ) -> requests.Response:
+        """Send a request, retrying transient failures.
+
+        Failures to connect are always retried because the request never
+        reached the server. Other network errors, read timeouts and retryable
+        status codes are only retried when the request is idempotent, which
+        defaults to the HTTP method's semantics but can be forced by the
+        caller.
+
+        A ``json`` body is gzip-compressed when ``compress`` is True, or, if
+        ``compress_requests`` is on, by default when it is at least
+        ``compress_min_bytes``. A server that answers 400 or 415 gets the
+        body again uncompressed. If that is accepted, or the answer was 415,
+        the host is remembered in the ServerCache and isn't sent compressed
+        bodies again until the entry expires.
+
+        Returns:
+            requests.Response: The response with its body already read
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+
+        host = urlsplit(url).netloc
+        wanted = compress or (compress is None and self.compress_requests)
+        if "json" in kwargs and wanted and not self._refuses_gzip(host):
+            body = json.dumps(kwargs["json"]).encode("utf-8")
+            if compress or len(body) >= self.compress_min_bytes:
+                plain_kwargs = dict(kwargs)
+                kwargs.pop("json")
+                kwargs["data"] = gzip.compress(body)
+                kwargs["headers"] = {
+                    **(kwargs.get("headers") or {}),
+                    "Content-Type": "application/json",
+                    "Content-Encoding": "gzip",
+                }
+                response = self._request(method, url, idempotent, **kwargs)
+                if response.status_code not in (400, 415):
+                    return response
+                refused = response.status_code
+                response = self._request(method, url, idempotent, **plain_kwargs)
+                if refused == 415 or response.ok:
+                    self._remember_no_gzip(host)
+                return response
+        return self._request(method, url, idempotent, **kwargs)
+
+    def _refuses_gzip(self, host: str) -> bool:
+        if host in self._no_gzip_hosts:
+            return True
+        from .cache import ServerCache
+
+        try:
+            entry = ServerCache().get_fresh(host)
+        except OSError:
+            return False
+        if entry is not None and entry.value.get("gzip_requests") is False:
+            self._no_gzip_hosts.add(host)
+            return True
+        return False
+
+    def _remember_no_gzip(self, host: str):
+        from .cache import ServerCache
+
+        self._no_gzip_hosts.add(host)
+        try:
+            ServerCache().put(host, {"gzip_requests": False})
+        except OSError:
+            pass
+
+    def _request(
+        self, method: str, url: str, idempotent: bool, **kwargs
+    ) -> requests.Response:
+        timing = RequestTiming(method=method, url=url)
+        start = time.perf_counter()
+        with profiler.span(f"HTTP {method}", url=url):
+            try:
+                while True:
+                    timing.attempts += 1
+                    retries_left = timing.attempts <= self.max_retries
+                    _connect_timer.elapsed = 0.0
+                    sent = time.perf_counter()
+                    try:
+                        response = self.session.request(method, url, stream=True, **kwargs)
+                        headers_received = time.perf_counter()
+                        # Reading the body here separates transfer time from waiting
+                        response.content
+                        timing.transfer += time.perf_counter() - headers_received
+                        timing.wait += headers_received - sent - _connect_timer.elapsed
+                    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                        timing.wait += time.perf_counter() - sent - _connect_timer.elapsed
+                        if retries_left and (idempotent or _never_sent(e)):
+                            timing.backoff += self._sleep(timing.attempts)
+                            continue
+                        raise
+                    finally:
+                        timing.connect += _connect_timer.elapsed
+
+                    timing.status = response.status_code
+                    timing.sent_bytes = len(response.request.body or b"")
+                    if retries_left and idempotent and response.status_code in self.retry_statuses:
+                        response.close()
+                        timing.backoff += self._sleep(timing.attempts)
+                        continue
+                    return response
+            finally:
+                timing.total = time.perf_counter() - start
+                self._thread_timing.last = timing
+                with self._timings_lock:
+                    self.timings.append(timing)
+
+    def _sleep(self, attempt: int) -> float:
+        delay = self._backoff(attempt)
+        time.sleep(delay)
+        return delay
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    @property
+    def last_timing(self) -> Optional[RequestTiming]:
+        """The timing of the last request made by the calling thread."""
+        return getattr(self._thread_timing, "last", None)
+
+    def close(self):
+        self.session.close()
+
+
+_transport: Optional[Transport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> Transport:
+    """Return the process-wide shared transport, creating it on first use."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = Transport()
+    return _transport
@@ -0,0 +1,312 @@
+"""Run a lesson's student code and driver tests and classify the outcome."""
+
+import itertools
+import time
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+import medicode_cli.dev_utils as du
+from medicode_cli import constants, notebook, preflight, profiler
+from medicode_cli.cache import VerdictCache, verdict_key
+from medicode_cli.code_index import index_source
+from medicode_cli.executor import ExecutionResult, WorkerPool
+from medicode_cli.lessons import Lesson
+from medicode_cli.sandbox import CPU_LIMIT, MEMORY_LIMIT, ResourceLimits
+
+PASSED = "passed"
+FAILED = "failed"
+ERROR = "error"
+TIMEOUT = "timeout"
+
+
+@dataclass
+class LessonResult:
+    lesson: Lesson
+    status: str
+    message: str = ""
+    execution: Optional[ExecutionResult] = None
+    duration: float = 0.0
+    # Replayed from the verdict cache rather than run
+    cached: bool = False
+
+    @property
+    def passed(self) -> bool:
+        return self.status == PASSED
+
+
+def driver_code_from(response: dict) -> Optional[str]:
+    """Build the combined driver script from a validate response, if it has one."""
+    if response.get("allow_error") or not response.get("success"):
+        return None
+    code_components = response.get("code_components") or {}
+    if not code_components.get("driver_code"):
+        return None
+    # The worker exposes the student run as `import student_code`
+    return du.combine_code(code_components["driver_code"])
+
+
+# The verdict a lesson would get for each kind of pre-flight problem
+PREFLIGHT_STATUSES = {
+    preflight.SYNTAX_ERROR: ERROR,
+    preflight.MISSING_NAME: FAILED,
+    preflight.INFINITE_LOOP: TIMEOUT,
+}
+
+
+def preflight_result(lesson: Lesson, student_code: str) -> Optional[LessonResult]:
+    """A result rejecting the lesson if its code has problems visible without running it."""
+    start = time.perf_counter()
+    problems = preflight.check(student_code)
+    if not problems:
+        return None
+    return LessonResult(
+        lesson=lesson,
+        status=PREFLIGHT_STATUSES[problems[0].kind],
+        message="\n".join(str(problem) for problem in problems),
+        duration=time.perf_counter() - start,
+    )
+
+
+# Verdicts that only depend on the code and the tests; timeouts and resource
+# limits also depend on how busy the machine was
+CACHEABLE_STATUSES = (PASSED, FAILED)
+
+# Code that calls these, or uses anything in these modules, can give a
+# different result each run, so its verdicts aren't cached. hash() and id()
+# change with the hash seed and memory layout
+UNCACHEABLE_CALLS = frozenset({"input", "open", "breakpoint", "hash", "id"})
+# Sets iterate in an order that changes with the hash seed
+SET_CALLS = frozenset({"set", "frozenset"})
+UNCACHEABLE_MODULES = frozenset(
+    {
+        "random",
+        "secrets",
+        "uuid",
+        "time",
+        "datetime",
+        "os",
+        "pathlib",
+        "shutil",
+        "glob",
+        "tempfile",
+        "io",
+        "csv",
+        "sqlite3",
+        "socket",
+        "subprocess",
+        "urllib",
+        "requests",
+    }
+)
+
+
+def _resolve(index, dotted: str) -> List[str]:
+    """The parts of a dotted name, with an imported name replaced by where it came from."""
+    parts = dotted.split(".")
+    imported = index.imports.get(parts[0])
+    if imported is not None:
+        module = imported["module"] or ""
+        if imported["name"]:
+            module = f"{module}.{imported['name']}"
+        parts = module.split(".") + parts[1:]
+    return parts
+
+
+def is_replayable(code: str) -> bool:
+    """Whether the code's outcome depends only on the code, with no input, randomness, time or files.
+
+    Judged from the calls and attribute accesses in its CodeIndex, following
+    imports, so that ``from random import randint`` and ``np.random.rand``
+    count as random and any use of ``sys.stdin`` as input. Calls to
+    ``read_*`` methods, such as ``pd.read_csv``, count as file I/O. Code that
+    builds a set isn't replayable either, as what it prints may follow the
+    set's hash-seeded iteration order.
+    """
+    index = index_source(code)
+    if index.syntax_error or index.sets or not SET_CALLS.isdisjoint(index.calls):
+        return False
+    for call in index.calls:
+        parts = _resolve(index, call)
+        if call in UNCACHEABLE_CALLS or parts[-1].startswith("read_"):
+            return False
+    for name in itertools.chain(index.calls, index.attributes, index.imports):
+        parts = _resolve(index, name)
+        if parts[0] in UNCACHEABLE_MODULES or "random" in parts[1:]:
+            return False
+        if parts[:2] == ["sys", "stdin"]:
+            return False
+    return True
+
+
+def is_replayable_run(student_code: str, response: dict) -> bool:
+    """Whether both the student code and the driver testing it are replayable."""
+    driver_code = (response.get("code_components") or {}).get("driver_code") or ""
+    return is_replayable(student_code) and is_replayable(driver_code)
+
+
+def _verdict_key(
+    lesson: Lesson,
+    student_code: str,
+    response: dict,
+    limits: ResourceLimits,
+    fail_fast: bool = False,
+):
+    driver_code = driver_code_from(response)
+    if driver_code is None:
+        return None
+    options = {**limits.to_dict(), "fail_fast": fail_fast}
+    return verdict_key(str(lesson.path), student_code, driver_code, options)
+
+
+def cached_result(
+    verdicts: VerdictCache,
+    lesson: Lesson,
+    student_code: str,
+    response: dict,
+    limits: Optional[ResourceLimits] = None,
+    fail_fast: bool = False,
+) -> Optional[LessonResult]:
+    """The last result for this exact student code, driver and Python, if there is one."""
+    if limits is None:
+        limits = ResourceLimits.from_response(response)
+    key = _verdict_key(lesson, student_code, response, limits, fail_fast)
+    if key is None or not is_replayable_run(student_code, response):
+        return None
+    entry = verdicts.get(key)
+    if entry is None:
+        return None
+    value = entry.value
+    return LessonResult(
+        lesson=lesson,
+        status=value["status"],
+        message=value["message"],
+        execution=ExecutionResult(**value["execution"]),
+        duration=value["duration"],
+        cached=True,
+    )
+
+
+def _store_result(
+    verdicts: VerdictCache,
+    result: LessonResult,
+    student_code: str,
+    response: dict,
+    limits: ResourceLimits,
+    fail_fast: bool = False,
+):
+    key = _verdict_key(result.lesson, student_code, response, limits, fail_fast)
+    if key is None or result.status not in CACHEABLE_STATUSES:
+        return
+    if not is_replayable_run(student_code, response):
+        return
+    verdicts.put(
+        key,
+        {
+            "status": result.status,
+            "message": result.message,
+            "execution": asdict(result.execution),
+            "duration": result.duration,
+        },
+    )
+
+
+@profiler.profiled("check_lesson")
+def check_lesson(
+    pool: WorkerPool,
+    lesson: Lesson,
+    student_code: str,
+    response: dict,
+    limits: Optional[ResourceLimits] = None,
+    stream: bool = False,
+    verdicts: Optional[VerdictCache] = None,
+    fail_fast: bool = False,
+) -> LessonResult:
+    """Run the student code once and the driver tests against it.
+
+    Args:
+        pool (WorkerPool): Pool to run the job in
+        lesson (Lesson): The lesson being checked
+        student_code (str): The contents of the lesson file
+        response (dict): The validate response with the driver code
+        limits (ResourceLimits, optional): Budgets for the run, by default
+            the lesson's from the validate response
+        stream (bool): Show the student's output as it is produced
+        verdicts (VerdictCache, optional): Where to look for the result of an
+            identical earlier run, and to store this one
+        fail_fast (bool): Stop the driver's test cases at the first failure
+
+    Returns:
+        LessonResult: The outcome, with the raw execution attached
+    """
+    start = time.perf_counter()
+    driver_code = driver_code_from(response)
+    if limits is None:
+        limits = ResourceLimits.from_response(response)
+    if verdicts is not None:
+        cached = cached_result(verdicts, lesson, student_code, response, limits, fail_fast)
+        if cached is not None:
+            return cached
+    if lesson.is_notebook and notebook.kernel_available():
+        # In the notebook's persistent kernel, if any cell has changed
+        execution = notebook.run_notebook(
+            lesson.path,
+            driver_code,
+            timeout=limits.wall_seconds,
+            stream=stream,
+            fail_fast=fail_fast,
+            limits=limits.to_dict(),
+        )
+    else:
+        execution = pool.run_lesson(
+            str(lesson.path),
+            student_code,
+            driver_code=driver_code,
+            timeout=limits.wall_seconds,
+            stream=stream,
+            limits=limits.to_dict(),
+            fail_fast=fail_fast,
+        )
+
+    result = LessonResult(lesson=lesson, status=ERROR, execution=execution)
+    result.duration = time.perf_counter() - start
+    student_run = execution.student
+
+    if execution.output_limit_exceeded:
+        result.message = (
+            f"Your code printed more than {constants.OUTPUT_LIMIT_BYTES // (1024 * 1024)} MB "
+            "and was stopped. It might contain an infinite loop."
+        )
+    elif execution.limit_exceeded == CPU_LIMIT:
+        result.status = TIMEOUT
+        result.message = (
+            f"Your code used more than {limits.cpu_seconds}s of CPU time and was stopped. "
+            "It might contain an infinite loop."
+        )
+    elif execution.limit_exceeded == MEMORY_LIMIT:
+        result.message = f"Your code used more than {limits.memory_mb} MB of memory and was stopped."
+    elif execution.timed_out:
+        result.status = TIMEOUT
+        result.message = "Execution timed out. Your code might contain an infinite loop."
+    elif student_run is None:
+        result.message = f"Error executing code: {execution.stderr}"
+    elif response.get("allow_error"):
+        result.status = PASSED
+        result.message = "Code validated successfully!"
+    elif driver_code is None:
+        result.message = response.get("message", "Unknown error")
+    elif execution.returncode == 0:
+        result.status = PASSED
+        result.message = "Tests passed!"
+    else:
+        result.status = FAILED
+        result.message = _failure_message(execution)
+
+    if verdicts is not None:
+        _store_result(verdicts, result, student_code, response, limits, fail_fast)
+    return result
+
+
+def _failure_message(execution: ExecutionResult) -> str:
+    """The last line of the driver's traceback, usually the failed assertion."""
+    lines = [line for line in (execution.error or execution.stderr).splitlines() if line.strip()]
+    return lines[-1] if lines else "Tests failed"
@@ -0,0 +1,175 @@
+"""Watch lesson files and re-run validation when their code actually changes.
+
+Changes are picked up with inotify where it is available and by polling file
+mtimes otherwise. Bursts of events, such as an editor writing a temporary
+file and renaming it over the lesson, are debounced into a single re-run, and
+a lesson is only re-run when the hash of its normalised AST changes, so
+saving without edits or only touching whitespace and comments is ignored.
+"""
+
+import ast
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from . import constants
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def normalised_hash(source: str) -> str:
+    """Hash the code's AST, ignoring formatting and comments.
+
+    Code that doesn't parse is hashed as text so that edits to it still
+    trigger a run, which then reports the syntax error.
+    """
+    try:
+        normalised = ast.dump(ast.parse(source))
+    except SyntaxError:
+        normalised = source
+    return hashlib.sha256(normalised.encode("utf-8")).hexdigest()
+
+
+def file_hash(path: Path) -> Optional[str]:
+    try:
+        if path.suffix == ".ipynb":
+            from .notebook import notebook_source, read_cells
+
+            # Only the code counts, not outputs and metadata Jupyter rewrites on save
+            return normalised_hash(notebook_source(read_cells(path)))
+        return normalised_hash(path.read_text())
+    except (OSError, UnicodeDecodeError, ValueError):
+        return None
+
+
+class InotifyWatcher:
+    """Report changed files in a set of directories using Linux inotify."""
+
+    def __init__(self, directories: Iterable[Path]):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._directories: Dict[int, Path] = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"Cannot watch {directory}")
+            self._directories[wd] = Path(directory)
+
+    def changes(self, timeout: Optional[float]) -> Set[Path]:
+        """Wait up to ``timeout`` seconds (None waits forever) for changed files."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed = set()
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, _, _, name_length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset : offset + name_length].rstrip(b"\0")
+            offset += name_length
+            if name and wd in self._directories:
+                changed.add(self._directories[wd] / os.fsdecode(name))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Report changed files by comparing mtimes and sizes."""
+
+    def __init__(self, paths: Iterable[Path], interval: float = constants.WATCH_POLL_INTERVAL):
+        self.paths = list(paths)
+        self.interval = interval
+        self._stats = {path: self._stat(path) for path in self.paths}
+
+    @staticmethod
+    def _stat(path: Path):
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def changes(self, timeout: Optional[float]) -> Set[Path]:
+        """Wait up to ``timeout`` seconds (None waits forever) for changed files."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = set()
+            for path in self.paths:
+                stat = self._stat(path)
+                if stat != self._stats[path]:
+                    self._stats[path] = stat
+                    changed.add(path)
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            remaining = self.interval if deadline is None else deadline - time.monotonic()
+            time.sleep(max(0, min(self.interval, remaining)))
+
+    def close(self):
+        pass
+
+
+def make_watcher(paths: Iterable[Path]):
+    """Use inotify on Linux, falling back to polling mtimes."""
+    paths = list(paths)
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher({path.parent for path in paths})
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(paths)
+
+
+def watch(
+    paths: Iterable[Path],
+    on_change: Callable[[Path], None],
+    debounce: float = constants.WATCH_DEBOUNCE,
+):
+    """Call ``on_change`` for each file whose code changes, until interrupted.
+
+    Args:
+        paths (iterable): The lesson files to watch
+        on_change (callable): Called with the path of each changed file
+        debounce (float): Seconds without events before a burst is handled
+    """
+    paths = {Path(path).resolve() for path in paths}
+    hashes = {path: file_hash(path) for path in paths}
+    watcher = make_watcher(paths)
+    try:
+        while True:
+            changed = watcher.changes(timeout=None)
+            # Keep collecting until the burst of saves settles down
+            while True:
+                more = watcher.changes(timeout=debounce)
+                if not more:
+                    break
+                changed |= more
+
+            for path in sorted({path.resolve() for path in changed} & paths):
+                new_hash = file_hash(path)
+                if new_hash is None or new_hash == hashes[path]:
+                    continue
+                hashes[path] = new_hash
+                on_change(path)
+    finally:
+        watcher.close()
@@ -0,0 +1,295 @@
+"""Entry point for the pre-forking execution server.
+
+The server is launched by ``medicode_cli.executor.WorkerPool`` ahead of time
+and imports the modules lessons commonly need once. It then forks a job
+process for each request from the pool, so every job starts with those
+modules already loaded but in a process of its own. A job process blocks
+until its job arrives, runs the student's lesson file once in a fresh
+namespace, then the driver tests against that same execution, reports the
+outcome on its result pipe and exits.
+
+Usage: python -m medicode_cli.worker CONTROL_FD
+"""
+
+import builtins
+import contextlib
+import importlib
+import json
+import os
+import reprlib
+import signal
+import socket
+import sys
+import time
+import traceback
+import types
+from typing import Optional, Tuple
+
+from medicode_cli.capture import BoundedTextIO
+from medicode_cli.constants import WORKER_PRELOAD
+from medicode_cli.log import setup_logging
+from medicode_cli.profiler import peak_rss_bytes
+from medicode_cli.sandbox import CPU_LIMIT, MEMORY_LIMIT, apply_limits, measure_usage
+from medicode_cli.test_cases import run_declared
+
+# Package modules that driver code imports by their top-level names
+DRIVER_HELPERS = ("dev_utils", "student_code_utils")
+
+
+def preload():
+    """Import modules up front so jobs don't pay for them."""
+    for module_name in WORKER_PRELOAD:
+        try:
+            importlib.import_module(module_name)
+        except Exception:  # noqa: BLE001
+            pass
+
+
+def expose_helpers():
+    """Make the driver's helpers importable as top-level modules.
+
+    Only these are registered, rather than putting the package directory on
+    ``sys.path``, where its ``log`` or ``cache`` would shadow a lesson's own.
+    """
+    for name in DRIVER_HELPERS:
+        sys.modules[name] = importlib.import_module(f"medicode_cli.{name}")
+
+
+def read_job(job_fd: int):
+    """Block until the parent sends a job, or return None if it closed the pipe."""
+    with os.fdopen(job_fd, "rb") as f:
+        data = f.read()
+    if not data:
+        return None
+    return json.loads(data)
+
+
+def summarise_globals(namespace: dict) -> dict:
+    """Describe the student's final top-level variables for the driver checks."""
+    variables = {}
+    for name, value in namespace.items():
+        if name.startswith("_") or isinstance(value, types.ModuleType):
+            continue
+        variables[name] = {"type": type(value).__name__, "repr": reprlib.repr(value)}
+    return variables
+
+
+def execute(code: str, filename: str, namespace: dict) -> Tuple[int, Optional[str]]:
+    """Execute ``code`` in ``namespace``, returning its exit code and traceback."""
+    try:
+        exec(compile(code, filename, "exec"), namespace)
+    except SystemExit as e:
+        if e.code is None:
+            return 0, None
+        if isinstance(e.code, int):
+            return e.code, None
+        print(e.code, file=sys.stderr)
+        return 1, None
+    except BaseException as e:  # noqa: BLE001
+        # Drop the worker's own frames so the traceback starts at the student's code
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename == __file__:
+            tb = tb.tb_next
+        formatted = "".join(traceback.format_exception(type(e), e, tb))
+        print(formatted, end="", file=sys.stderr)
+        return 1, formatted
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    return 0, None
+
+
+def execute_driver(
+    code: str, filename: str, namespace: dict, fail_fast: bool = False
+) -> Tuple[int, Optional[str]]:
+    """Execute the driver, then any test cases it declared.
+
+    Returns:
+        tuple: The exit code and the traceback of the first failure, if any
+    """
+    returncode, error = execute(code, filename, namespace)
+    if returncode == 0:
+        outcome = run_declared(fail_fast)
+        if outcome is not None:
+            returncode, error = outcome
+    sys.stdout.flush()
+    return returncode, error
+
+
+def run_student(job: dict) -> types.ModuleType:
+    """Run the student's lesson file once, capturing its output and globals.
+
+    The resulting module is registered as ``student_code`` so the driver's
+    ``import student_code`` reuses this execution, and the captured run is
+    attached for ``run_student_code`` to return instead of running it again.
+    """
+    student_path = job["student_path"]
+    module = types.ModuleType("student_code")
+    module.__dict__.update({"__name__": "__main__", "__file__": student_path, "__builtins__": builtins})
+    sys.argv = [student_path]
+    # As with `python lesson.py`, the lesson's directory comes first
+    sys.path.insert(0, os.path.dirname(os.path.abspath(student_path)))
+
+    # The output is passed straight on to the parent, which streams it, and
+    # only its start and end are kept for the driver
+    stdout, stderr = BoundedTextIO(tee=sys.stdout), BoundedTextIO(tee=sys.stderr)
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        returncode, error = execute(job["student_code"], student_path, module.__dict__)
+
+    module.__name__ = "student_code"
+    module.__medicode_run__ = {
+        "success": returncode == 0,
+        "stdout": stdout.getvalue().strip(),
+        "stderr": stderr.getvalue(),
+        "variables": summarise_globals(module.__dict__),
+        "student_code": job["student_code"],
+    }
+    if error is not None and error.rstrip().splitlines()[-1].startswith("MemoryError"):
+        # Most likely the address space limit rather than a real shortage
+        module.__medicode_run__["limit_exceeded"] = MEMORY_LIMIT
+    sys.modules["student_code"] = module
+    return module
+
+
+def timed(timings: list, name: str, function, *args):
+    """Call ``function``, appending its wall-clock start, duration and peak memory to ``timings``."""
+    start, started = time.time(), time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        timings.append(
+            {
+                "name": name,
+                "start": start,
+                "duration": time.perf_counter() - started,
+                "peak_rss_bytes": peak_rss_bytes(),
+            }
+        )
+
+
+def run_job(job: dict) -> dict:
+    """Run the student code and then, if there is one, the driver against it."""
+    timings = []
+    student = timed(timings, "student code", run_student, job)
+    result = {
+        "student": student.__medicode_run__,
+        "returncode": 0,
+        "error": None,
+        # Reported for `medicode --profile`
+        "timings": timings,
+    }
+    if not result["student"]["success"]:
+        result["returncode"] = 1
+    if "limit_exceeded" in result["student"]:
+        result["limit_exceeded"] = result["student"]["limit_exceeded"]
+
+    # Tests of a run stopped for going over its budget would only fail too
+    if job.get("driver_code") and "limit_exceeded" not in result:
+        filename = job.get("driver_filename", "<medicode-driver>")
+        expose_helpers()
+        namespace = {"__name__": "__main__", "__file__": filename, "__builtins__": builtins}
+        sys.argv = [filename]
+        # The driver's output is reported after the student's, not streamed
+        stdout, stderr = BoundedTextIO(), BoundedTextIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            result["returncode"], result["error"] = timed(
+                timings,
+                "driver tests",
+                execute_driver,
+                job["driver_code"],
+                filename,
+                namespace,
+                job.get("fail_fast", False),
+            )
+        result["stdout"], result["stderr"] = stdout.getvalue(), stderr.getvalue()
+
+    return result
+
+
+def report(result_fd: int, result: dict):
+    with os.fdopen(result_fd, "w") as f:
+        json.dump(result, f)
+
+
+def serve_job(job_fd: int, result_fd: int) -> int:
+    """Wait for one job, run it within its resource limits and report the result."""
+    job = read_job(job_fd)
+    if job is None:
+        return 0
+
+    started = time.perf_counter()
+
+    def on_cpu_limit(signum, frame):
+        # Report what we can before the hard limit's SIGKILL arrives
+        sys.stdout.flush()
+        sys.stderr.flush()
+        report(
+            result_fd,
+            {
+                "returncode": -signum,
+                "error": "CPU time limit exceeded",
+                "limit_exceeded": CPU_LIMIT,
+                "usage": measure_usage(started),
+            },
+        )
+        os._exit(1)
+
+    signal.signal(signal.SIGXCPU, on_cpu_limit)
+    apply_limits(job.get("limits") or {})
+
+    result = run_job(job)
+    result["usage"] = measure_usage(started)
+    report(result_fd, result)
+    return result["returncode"]
+
+
+def serve_forks(control_fd: int):
+    """Fork a job process for every request on the control socket.
+
+    Each request carries the new process's stdin, stdout and stderr plus its
+    job and result pipes as SCM_RIGHTS file descriptors. The child's pid is
+    sent back so the parent can kill it on timeout.
+    """
+    # Children are reaped automatically, the parent learns about their
+    # outcome from the result pipe
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    control = socket.socket(fileno=control_fd)
+    while True:
+        message, fds, _, _ = socket.recv_fds(control, 64, 5)
+        if not message:
+            # The parent closed the pool
+            return
+        pid = os.fork()
+        if pid == 0:
+            control.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            # A session of its own, so a timeout kills the processes the job
+            # started along with it
+            os.setsid()
+            stdin_fd, stdout_fd, stderr_fd, job_fd, result_fd = fds
+            for target, fd in enumerate((stdin_fd, stdout_fd, stderr_fd)):
+                os.dup2(fd, target)
+                os.close(fd)
+            try:
+                returncode = serve_job(job_fd, result_fd)
+            except BaseException:  # noqa: BLE001
+                traceback.print_exc()
+                returncode = 1
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(returncode)
+        for fd in fds:
+            os.close(fd)
+        control.sendall(f"{pid}\n".encode())
+
+
+def main():
+    setup_logging()
+    preload()
+    serve_forks(int(sys.argv[1]))
+    return 0
+
+
+if __name__ == "__main__":
+    # Skip interpreter teardown, nothing needs cleaning up
+    os._exit(main())
@@ -0,0 +1,58 @@
+"""Shared fixtures.
+
+The CLI keeps its state under ~/.medicode, so each test that touches it gets
+a logged-in home directory of its own, and network tests talk to a
+``StubServer`` rather than the course server.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# constants reads the home directory when it is imported, before any fixture
+os.environ["HOME"] = tempfile.mkdtemp(prefix="medicode-tests-")
+
+from medicode_cli import constants  # noqa: E402
+from medicode_cli.stub_server import StubServer  # noqa: E402
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    """A home directory with a logged-in config, holding the CLI's caches and outbox."""
+    monkeypatch.setenv("HOME", str(tmp_path))
+    medicode_dir = tmp_path / ".medicode"
+    medicode_dir.mkdir()
+    config = {"access_token": "test", "refresh_token": "test", "expires_at": time.time() + 86400}
+    (medicode_dir / "config.json").write_text(json.dumps(config))
+    monkeypatch.setattr(constants, "CACHE_DIR", medicode_dir / "cache")
+    monkeypatch.setattr(constants, "OUTBOX_PATH", medicode_dir / "outbox.sqlite3")
+    return tmp_path
+
+
+@pytest.fixture
+def server():
+    with StubServer() as server:
+        yield server
+
+
+@pytest.fixture
+def api(home, server):
+    """A client for ``server`` whose transport retries without sleeping."""
+    from medicode_cli.medicode_api import MedicodeAPI
+    from medicode_cli.transport import Transport
+
+    transport = Transport(backoff_factor=0)
+    api = MedicodeAPI(transport=transport)
+    api.base_url = server.base_url
+    yield api
+    if api._flush_thread is not None:
+        api._flush_thread.join()
+    transport.close()
@@ -0,0 +1,134 @@
+import time
+
+import pytest
+
+from medicode_cli import constants
+from medicode_cli.cache import DiskCache, DriverCache, driver_key
+from medicode_cli.constants import PYTHON_VALIDATE_BATCH_ENDPOINT, PYTHON_VALIDATE_CODE_ENDPOINT
+from medicode_cli.medicode_api import ServerUnreachable
+from medicode_cli.outbox import Outbox
+
+KEY = driver_key("tut-1", "1", "1")
+
+
+@pytest.fixture
+def cache(home):
+    return DriverCache()
+
+
+def fetch(api, cache, code="print(1)", **kwargs):
+    return api.fetch_driver(code, "tut-1", "1", "1", cache=cache, **kwargs)
+
+
+def make_stale(cache):
+    entry = cache.get(KEY)
+    cache.put(KEY, entry.value, stored_at=time.time() - constants.DRIVER_CACHE_TTL - 1)
+
+
+def test_entries_expire_after_the_ttl(tmp_path):
+    cache = DiskCache("test", max_bytes=1 << 20, ttl=60, root=tmp_path)
+    cache.put("fresh", {"a": 1})
+    cache.put("old", {"a": 2}, stored_at=time.time() - 120)
+    assert cache.get_fresh("fresh").value == {"a": 1}
+    assert cache.get_fresh("old") is None
+    assert cache.get("old").value == {"a": 2}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = DiskCache("test", max_bytes=1 << 20, max_entries=2, root=tmp_path)
+    cache.put("a", {})
+    time.sleep(0.01)
+    cache.put("b", {})
+    time.sleep(0.01)
+    cache.get("a")
+    time.sleep(0.01)
+    cache.put("c", {})
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+
+
+def test_driver_is_fetched_once_and_then_served_from_the_cache(api, server, cache):
+    first = fetch(api, cache)
+    assert first["code_components"]["driver_code"] == server.default_driver
+    assert server.requests[PYTHON_VALIDATE_CODE_ENDPOINT] == 1
+
+    second = fetch(api, cache, code="print(2)")
+    assert second["code_components"]["driver_code"] == server.default_driver
+    assert server.requests[PYTHON_VALIDATE_CODE_ENDPOINT] == 1
+
+
+def test_student_code_is_not_cached(api, server, cache):
+    fetch(api, cache, code="secret = 42")
+    assert "secret = 42" not in str(cache.get(KEY).value)
+
+
+def test_fresh_hit_still_sends_the_submission(api, server, cache):
+    fetch(api, cache, code="print(1)")
+    fetch(api, cache, code="print(2)")
+    api._flush_thread.join(5)
+    assert [s["student_code"] for s in server.submissions] == ["print(2)"]
+    with Outbox() as outbox:
+        assert len(outbox) == 0
+
+
+def test_stale_entry_is_revalidated_with_its_etag(api, server, cache):
+    fetch(api, cache)
+    make_stale(cache)
+    response = fetch(api, cache)
+    assert response["code_components"]["driver_code"] == server.default_driver
+    assert server.requests[PYTHON_VALIDATE_CODE_ENDPOINT] == 2
+    # The 304 made the entry fresh again
+    assert cache.get_fresh(KEY) is not None
+
+
+def test_changed_driver_replaces_the_stale_entry(api, server, cache):
+    fetch(api, cache)
+    make_stale(cache)
+    server.default_driver = "print('new tests')"
+    response = fetch(api, cache)
+    assert response["code_components"]["driver_code"] == "print('new tests')"
+    assert cache.get(KEY).value["code_components"]["driver_code"] == "print('new tests')"
+
+
+def test_offline_uses_the_cache_and_queues_the_submission(api, server, cache):
+    fetch(api, cache)
+    make_stale(cache)
+    response = fetch(api, cache, code="print(3)", offline=True)
+    assert response["code_components"]["driver_code"] == server.default_driver
+    assert server.requests[PYTHON_VALIDATE_CODE_ENDPOINT] == 1
+    with Outbox() as outbox:
+        assert [s.code for s in outbox.claim(10)] == ["print(3)"]
+
+
+def test_offline_without_a_cached_driver_fails(api, cache):
+    with pytest.raises(Exception, match="No cached driver code"):
+        fetch(api, cache, offline=True)
+
+
+def test_unreachable_server_falls_back_to_the_stale_entry(api, server, cache):
+    fetch(api, cache)
+    make_stale(cache)
+    api.base_url = "http://127.0.0.1:9/api/medicode-cli"
+    response = fetch(api, cache, code="print(4)")
+    assert response["code_components"]["driver_code"] == server.default_driver
+    with Outbox() as outbox:
+        assert [s.code for s in outbox.claim(10)] == ["print(4)"]
+
+
+def test_unreachable_server_without_a_cached_driver_raises(api, cache):
+    api.base_url = "http://127.0.0.1:9/api/medicode-cli"
+    with pytest.raises(ServerUnreachable):
+        fetch(api, cache)
+
+
+def test_fetch_drivers_batches_only_what_is_not_fresh(api, server, cache):
+    fetch(api, cache)
+    submissions = [
+        {"code": "print(1)", "tutorial_id": "tut-1", "lesson_id": "1", "task_id": "1"},
+        {"code": "print(2)", "tutorial_id": "tut-1", "lesson_id": "2", "task_id": "1"},
+        {"code": "print(3)", "tutorial_id": "tut-2", "lesson_id": "1", "task_id": "1"},
+    ]
+    responses = api.fetch_drivers(submissions, cache=cache, submit=False)
+    assert all(r["code_components"]["driver_code"] == server.default_driver for r in responses)
+    assert server.requests[PYTHON_VALIDATE_BATCH_ENDPOINT] == 1
+    assert cache.get_fresh(driver_key("tut-2", "1", "1")) is not None
@@ -0,0 +1,115 @@
+import subprocess
+import time
+
+import pytest
+
+from medicode_cli.executor import WorkerPool
+from medicode_cli.sandbox import CPU_LIMIT, MEMORY_LIMIT, ResourceLimits
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with WorkerPool(size=1, stdin=subprocess.DEVNULL) as pool:
+        yield pool
+
+
+def run(pool, lesson_dir, code, **kwargs):
+    path = lesson_dir / "lesson-1.py"
+    path.write_text(code)
+    return pool.run_lesson(str(path), code, **kwargs)
+
+
+def is_running(pid: int) -> bool:
+    """Whether ``pid`` is a live process, counting an unreaped zombie as dead."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def test_driver_runs_against_the_student_run(pool, tmp_path):
+    driver = "import student_code\nassert student_code.total == 6\nprint('driver saw', student_code.total)\n"
+    result = run(pool, tmp_path, "total = sum([1, 2, 3])\nprint('hello')\n", driver_code=driver)
+    assert result.success
+    assert result.student["stdout"] == "hello"
+    assert result.student["variables"]["total"] == {"type": "int", "repr": "6"}
+    assert "driver saw 6" in result.stdout
+
+
+def test_student_error_is_reported_from_the_students_own_frame(pool, tmp_path):
+    result = run(pool, tmp_path, "x = 1\nraise ValueError('bad value')\n")
+    assert not result.success
+    assert not result.student["success"]
+    assert 'lesson-1.py", line 2' in result.student["stderr"]
+    assert "worker.py" not in result.student["stderr"]
+
+
+def test_jobs_do_not_share_state(pool, tmp_path):
+    run(pool, tmp_path, "import builtins, sys\nbuiltins.leaked = True\nsys.modules['leaked'] = sys\n")
+    result = run(pool, tmp_path, "import builtins, sys\nprint(hasattr(builtins, 'leaked'), 'leaked' in sys.modules)\n")
+    assert result.student["stdout"] == "False False"
+
+
+def test_lesson_directory_comes_before_the_package(pool, tmp_path):
+    (tmp_path / "log.py").write_text("WHERE = 'lesson'\n")
+    driver = "import dev_utils, student_code_utils\nprint('helpers', dev_utils.DEBUG in (True, False))\n"
+    code = "import sys\nimport log\nprint(log.WHERE, 'dev_utils' in sys.modules)\n"
+    result = run(pool, tmp_path, code, driver_code=driver)
+    assert result.student["stdout"] == "lesson False"
+    assert "helpers True" in result.stdout
+
+
+def test_timeout_kills_the_job(pool, tmp_path):
+    start = time.perf_counter()
+    result = run(pool, tmp_path, "import time\nprint('started', flush=True)\ntime.sleep(30)\n", timeout=0.5)
+    assert result.timed_out
+    assert not result.success
+    assert time.perf_counter() - start < 5
+    assert "started" in result.stdout
+
+
+def test_timeout_kills_the_processes_the_job_started(pool, tmp_path):
+    pid_file = tmp_path / "child.pid"
+    code = (
+        "import subprocess, sys, time\n"
+        "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])\n"
+        f"open({str(pid_file)!r}, 'w').write(str(child.pid))\n"
+        "time.sleep(60)\n"
+    )
+    result = run(pool, tmp_path, code, timeout=1)
+    assert result.timed_out
+    child = int(pid_file.read_text())
+    deadline = time.monotonic() + 5
+    while is_running(child) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not is_running(child)
+
+
+def test_output_over_the_cap_kills_the_job(pool, tmp_path):
+    result = run(pool, tmp_path, "while True:\n    print('x' * 1000)\n", timeout=20)
+    assert result.output_limit_exceeded
+    assert not result.timed_out
+    assert not result.success
+
+
+def test_memory_limit(pool, tmp_path):
+    limits = ResourceLimits(memory_mb=64).to_dict()
+    result = run(pool, tmp_path, "data = bytearray(1024 * 1024 * 1024)\n", limits=limits, timeout=10)
+    assert result.limit_exceeded == MEMORY_LIMIT
+    assert not result.student["success"]
+
+
+def test_cpu_limit(pool, tmp_path):
+    limits = ResourceLimits(cpu_seconds=1).to_dict()
+    result = run(pool, tmp_path, "while True:\n    pass\n", limits=limits, timeout=10)
+    assert result.limit_exceeded == CPU_LIMIT
+    assert not result.timed_out
+    assert not result.success
+
+
+def test_pool_keeps_working_after_a_killed_job(pool, tmp_path):
+    run(pool, tmp_path, "import time\ntime.sleep(30)\n", timeout=0.3)
+    result = run(pool, tmp_path, "print('still here')\n")
+    assert result.success
+    assert result.student["stdout"] == "still here"
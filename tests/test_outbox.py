@@ -0,0 +1,70 @@
+import pytest
+import requests
+
+from medicode_cli.constants import SUBMISSIONS_BULK_ENDPOINT
+from medicode_cli.outbox import Outbox
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    with Outbox(tmp_path / "outbox.sqlite3") as outbox:
+        yield outbox
+
+
+def test_same_code_for_the_same_lesson_is_queued_once(outbox):
+    assert outbox.add("print(1)", "tut-1", "1")
+    assert not outbox.add("print(1)", "tut-1", "1")
+    assert outbox.add("print(2)", "tut-1", "1")
+    assert outbox.add("print(1)", "tut-1", "2")
+    assert len(outbox) == 3
+
+
+def test_claimed_submissions_are_skipped_until_released(outbox, tmp_path):
+    outbox.add("print(1)", "tut-1", "1")
+    outbox.add("print(2)", "tut-1", "2")
+    claimed = outbox.claim(10)
+    assert [s.code for s in claimed] == ["print(1)", "print(2)"]
+    assert [s.attempts for s in claimed] == [1, 1]
+
+    # Another CLI process flushing at the same time gets nothing
+    with Outbox(tmp_path / "outbox.sqlite3") as other:
+        assert other.claim(10) == []
+
+    outbox.release(claimed[:1], error="Server unreachable")
+    (again,) = outbox.claim(10)
+    assert again.code == "print(1)"
+    assert again.attempts == 2
+
+
+def test_expired_lease_can_be_claimed_again(outbox):
+    outbox.add("print(1)", "tut-1", "1")
+    assert outbox.claim(10, lease=-1)
+    assert len(outbox.claim(10)) == 1
+
+
+def test_removed_submissions_are_gone(outbox):
+    outbox.add("print(1)", "tut-1", "1")
+    outbox.remove(outbox.claim(10))
+    assert len(outbox) == 0
+
+
+def test_flush_sends_the_queue_in_bulk(api, server):
+    api.queue_submission("print(1)", "tut-1", "1", "1")
+    api.queue_submission("print(2)", "tut-1", "2")
+    assert api.flush_outbox() == 2
+    assert server.requests[SUBMISSIONS_BULK_ENDPOINT] == 1
+    assert [s["student_code"] for s in server.submissions] == ["print(1)", "print(2)"]
+    assert [s["taskId"] for s in server.submissions] == ["1", None]
+    with Outbox() as outbox:
+        assert len(outbox) == 0
+
+
+def test_failed_flush_leaves_the_queue_for_later(api, server):
+    api.queue_submission("print(1)", "tut-1", "1")
+    server.fail(SUBMISSIONS_BULK_ENDPOINT, 503, times=api.transport.max_retries + 1)
+    with pytest.raises(requests.exceptions.HTTPError):
+        api.flush_outbox()
+    assert server.submissions == []
+
+    assert api.flush_outbox() == 1
+    assert [s["student_code"] for s in server.submissions] == ["print(1)"]
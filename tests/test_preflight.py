@@ -0,0 +1,59 @@
+from medicode_cli import preflight
+
+
+def kinds(source):
+    return [problem.kind for problem in preflight.check(source)]
+
+
+def test_clean_code_has_no_problems():
+    assert preflight.check("# Define total below\ntotal = sum([1, 2])\nprint(total)\n") == []
+
+
+def test_syntax_error_is_reported_with_its_line():
+    (problem,) = preflight.check("x = 1\nprint(x\n")
+    assert problem.kind == preflight.SYNTAX_ERROR
+    assert problem.lineno == 2
+
+
+def test_missing_required_name():
+    problems = preflight.check("# Define mean below\n# Define median below\nmean = 1\n")
+    assert [p.kind for p in problems] == [preflight.MISSING_NAME]
+    assert "`median`" in problems[0].message
+
+
+def test_required_name_may_be_a_function_class_or_import():
+    source = (
+        "# Define f below\n# Define C below\n# Define sqrt below\n"
+        "def f():\n    pass\nclass C:\n    pass\nfrom math import sqrt\n"
+    )
+    assert preflight.check(source) == []
+
+
+def test_method_does_not_define_a_module_level_name():
+    source = "# Define get below\nclass Store:\n    def get(self):\n        pass\n"
+    assert kinds(source) == [preflight.MISSING_NAME]
+
+
+def test_loop_that_can_never_end_is_flagged():
+    for source in (
+        "while True:\n    pass\n",
+        "while True:\n    x = 1\n    'nothing'\n",
+        "y = 2\nwhile True:\n    x = y\n",
+        "def f(a):\n    while True:\n        b = a\n",
+    ):
+        assert kinds(source) == [preflight.INFINITE_LOOP], source
+
+
+def test_loop_that_may_raise_or_break_is_left_alone():
+    for source in (
+        "while True:\n    x = 1/0\n",
+        "while True:\n    x = undefined_name\n",
+        "while True:\n    x += 1\n",
+        "while True:\n    x = 1 < 2\n",
+        "while True:\n    break\n",
+        "while True:\n    print('tick')\n",
+        "y = 1\ndel y\nwhile True:\n    x = y\n",
+        "while True:\n    x = y\n    y = 1\n",
+        "try:\n    while True:\n        pass\nexcept KeyboardInterrupt:\n    pass\n",
+    ):
+        assert kinds(source) == [], source
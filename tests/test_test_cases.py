@@ -0,0 +1,108 @@
+"""The driver's ``@test_case`` functions, each forked from the job process."""
+
+import subprocess
+
+import pytest
+
+from medicode_cli.executor import WorkerPool
+
+STUDENT_CODE = "total = 6\n"
+
+DRIVER_HEADER = "from medicode_cli.test_cases import test_case\nimport student_code\n\n"
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with WorkerPool(size=1, stdin=subprocess.DEVNULL) as pool:
+        yield pool
+
+
+def run_driver(pool, tmp_path, cases: str, fail_fast: bool = False):
+    path = tmp_path / "lesson-1.py"
+    path.write_text(STUDENT_CODE)
+    return pool.run_lesson(
+        str(path), STUDENT_CODE, driver_code=DRIVER_HEADER + cases, fail_fast=fail_fast, timeout=20
+    )
+
+
+def test_every_case_is_reported(pool, tmp_path):
+    result = run_driver(
+        pool,
+        tmp_path,
+        "@test_case\n"
+        "def total_is_six():\n"
+        "    assert student_code.total == 6\n"
+        "\n"
+        "@test_case('total is seven')\n"
+        "def total_is_seven():\n"
+        "    assert student_code.total == 7, 'total should be 7'\n"
+        "\n"
+        "@test_case\n"
+        "def crashes():\n"
+        "    {}['missing']\n",
+    )
+    assert result.returncode == 1
+    assert "✓ total_is_six" in result.stdout
+    assert "✗ total is seven: total should be 7" in result.stdout
+    assert "✗ crashes: KeyError: 'missing'" in result.stdout
+    assert "1 passed, 1 failed, 1 error" in result.stdout
+    assert "total should be 7" in result.error
+
+
+def test_cases_start_from_the_same_student_run(pool, tmp_path):
+    result = run_driver(
+        pool,
+        tmp_path,
+        "@test_case\n"
+        "def changes_total():\n"
+        "    student_code.total = 100\n"
+        "\n"
+        "@test_case\n"
+        "def sees_the_original_total():\n"
+        "    assert student_code.total == 6, student_code.total\n",
+    )
+    assert result.success, result.stdout
+    assert "2 passed" in result.stdout
+
+
+def test_case_timeout(pool, tmp_path):
+    result = run_driver(
+        pool,
+        tmp_path,
+        "@test_case('spins', timeout=0.5)\n"
+        "def spins():\n"
+        "    while True:\n"
+        "        pass\n"
+        "\n"
+        "@test_case\n"
+        "def runs_anyway():\n"
+        "    pass\n",
+    )
+    assert not result.timed_out
+    assert "✗ spins: Timed out after 0.5s" in result.stdout
+    assert "✓ runs_anyway" in result.stdout
+
+
+def test_case_output_is_captured(pool, tmp_path):
+    result = run_driver(pool, tmp_path, "@test_case\ndef talks():\n    print('from the case')\n")
+    assert result.success
+    assert "    from the case" in result.stdout
+
+
+def test_fail_fast_skips_the_remaining_cases(pool, tmp_path):
+    result = run_driver(
+        pool,
+        tmp_path,
+        "@test_case\n"
+        "def fails():\n"
+        "    assert False, 'first failure'\n"
+        "\n"
+        "@test_case\n"
+        "def later():\n"
+        "    pass\n",
+        fail_fast=True,
+    )
+    assert result.returncode == 1
+    assert "✗ fails: first failure" in result.stdout
+    assert "✓ later" not in result.stdout
+    assert "1 failed, 1 skipped" in result.stdout
@@ -0,0 +1,88 @@
+import socket
+
+import pytest
+import requests
+
+from medicode_cli.constants import HEALTH_CHECK_ENDPOINT, PYTHON_VALIDATE_CODE_ENDPOINT
+from medicode_cli.transport import Transport
+
+HEADERS = {"Authorization": "Bearer test"}
+BODY = {"student_code": "print(1)", "tutorialId": "tut-1", "lessonId": "1"}
+
+
+@pytest.fixture
+def transport(home):
+    transport = Transport(max_retries=2, backoff_factor=0, read_timeout=0.3)
+    yield transport
+    transport.close()
+
+
+def url(server, endpoint):
+    return f"{server.base_url}/{endpoint}"
+
+
+def test_get_is_retried_on_a_retryable_status(transport, server):
+    server.fail(HEALTH_CHECK_ENDPOINT, 503, times=2)
+    response = transport.get(url(server, HEALTH_CHECK_ENDPOINT))
+    assert response.status_code == 200
+    assert server.requests[HEALTH_CHECK_ENDPOINT] == 3
+    assert transport.last_timing.attempts == 3
+
+
+def test_retries_stop_at_max_retries(transport, server):
+    server.fail(HEALTH_CHECK_ENDPOINT, 503, times=10)
+    response = transport.get(url(server, HEALTH_CHECK_ENDPOINT))
+    assert response.status_code == 503
+    assert server.requests[HEALTH_CHECK_ENDPOINT] == 3
+
+
+def test_other_errors_are_not_retried(transport, server):
+    server.fail(HEALTH_CHECK_ENDPOINT, 500)
+    assert transport.get(url(server, HEALTH_CHECK_ENDPOINT)).status_code == 500
+    assert server.requests[HEALTH_CHECK_ENDPOINT] == 1
+
+
+def test_post_is_sent_once(transport, server):
+    server.fail(PYTHON_VALIDATE_CODE_ENDPOINT, 503)
+    response = transport.post(url(server, PYTHON_VALIDATE_CODE_ENDPOINT), json=BODY, headers=HEADERS)
+    assert response.status_code == 503
+    assert server.requests[PYTHON_VALIDATE_CODE_ENDPOINT] == 1
+
+
+def test_post_marked_idempotent_is_retried(transport, server):
+    server.fail(PYTHON_VALIDATE_CODE_ENDPOINT, 503)
+    response = transport.post(
+        url(server, PYTHON_VALIDATE_CODE_ENDPOINT), json=BODY, headers=HEADERS, idempotent=True
+    )
+    assert response.status_code == 200
+    assert server.requests[PYTHON_VALIDATE_CODE_ENDPOINT] == 2
+
+
+def test_read_timeout_is_only_retried_when_idempotent(transport, server):
+    server.latency = 0.6
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        transport.post(url(server, PYTHON_VALIDATE_CODE_ENDPOINT), json=BODY, headers=HEADERS)
+    assert server.requests[PYTHON_VALIDATE_CODE_ENDPOINT] == 1
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        transport.post(
+            url(server, PYTHON_VALIDATE_CODE_ENDPOINT), json=BODY, headers=HEADERS, idempotent=True
+        )
+    assert server.requests[PYTHON_VALIDATE_CODE_ENDPOINT] == 4
+
+
+def test_refused_connection_is_retried_even_for_post(transport):
+    # A port nothing listens on, so the request never reaches a server
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    with pytest.raises(requests.exceptions.ConnectionError):
+        transport.post(f"http://127.0.0.1:{port}/api", json=BODY)
+    assert transport.last_timing.attempts == 3
+
+
+def test_timings_are_recorded_per_request(transport, server):
+    transport.get(url(server, HEALTH_CHECK_ENDPOINT))
+    transport.get(url(server, HEALTH_CHECK_ENDPOINT))
+    assert len(transport.timings) == 2
+    assert all(timing.status == 200 and timing.attempts == 1 for timing in transport.timings)